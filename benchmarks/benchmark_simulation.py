@@ -0,0 +1,285 @@
+"""
+A reproducible benchmark of the core simulation loop on synthetic worlds (see synthetic_world.py).
+For each world size it times:
+the world generation, World.sign_all_people_up_to_environments,
+Simulation.simulate_day at low, peak and late prevalence of the epidemic,
+generate_events of the common interventions and the end of run statistics writes (Simulation.finish_run).
+All the random generators are seeded, so two runs on the same commit simulate the same epidemic,
+and the results are saved as json to compare runs across commits:
+
+    python -m benchmarks.benchmark_simulation --sizes 10000 100000 1000000 --output bench.json
+    python -m benchmarks.benchmark_simulation --sizes 10000 --output new.json --compare bench.json
+"""
+import argparse
+import json
+import logging
+import os
+import platform
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+from datetime import datetime, timedelta
+from statistics import mean, median
+from time import perf_counter
+
+import numpy as np
+
+from benchmarks.synthetic_world import make_synthetic_world, SYNTHETIC_CITY_NAME
+from src.logs import make_age_and_state_datas_to_plot
+from src.run_utils import INITIAL_DATE
+from src.seir import DiseaseState
+from src.simulation.interventions import ElderlyQuarantineIntervention, HouseholdIsolationIntervention, \
+    SchoolClosureIntervention, SocialDistancingIntervention, SymptomaticIsolationIntervention, \
+    WorkplaceClosureIntervention
+from src.simulation.params import Params
+from src.simulation.simulation import Simulation
+
+log = logging.getLogger(__name__)
+
+DEFAULT_SIZES = (10000, 100000, 1000000)
+BENCHMARK_FORMAT_VERSION = 1
+
+
+def load_params():
+    """
+    Load the params file of the config (as the jobs of run_utils do)
+    """
+    src_dir = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src')
+    with open(os.path.join(src_dir, 'config.json')) as json_data_file:
+        config_data = json.load(json_data_file)
+    Params.load_from(os.path.join(src_dir, config_data['ParamsFilePath']), override=True)
+    DiseaseState.init_infectiousness_list()
+    return config_data['ParamsFilePath']
+
+
+def _benchmark_interventions():
+    """
+    :return: list of the interventions whose generate_events is timed
+    """
+    start_date = INITIAL_DATE + timedelta(days=10)
+    duration = timedelta(days=30)
+    return [
+        WorkplaceClosureIntervention(start_date, duration, compliance=0.8),
+        SocialDistancingIntervention(start_date, duration, compliance=0.8, age_range=(0, 99)),
+        ElderlyQuarantineIntervention(start_date, duration, compliance=0.8, min_age=70),
+        SchoolClosureIntervention(start_date, duration, compliance=1.0, proportion_of_envs=1.0,
+                                  city_name=SYNTHETIC_CITY_NAME, age_segment=(3, 17)),
+        SymptomaticIsolationIntervention(compliance=0.8, start_date=start_date, duration=duration),
+        HouseholdIsolationIntervention(compliance=0.8, start_date=start_date, duration=duration),
+    ]
+
+
+def _summarize_day_times(day_times):
+    """
+    :param day_times: list of the float seconds of the days of a prevalence phase
+    :return: dict of the statistics of the times, None if there are no days
+    """
+    if not day_times:
+        return None
+    return {
+        'num_days': len(day_times),
+        'mean': mean(day_times),
+        'median': median(day_times),
+        'min': min(day_times),
+        'max': max(day_times),
+        'total': sum(day_times),
+    }
+
+
+def split_by_prevalence(infected_counts, low_fraction=0.1, late_fraction=0.25, peak_width=2):
+    """
+    Split the simulated days by the prevalence of the epidemic.
+    The first day is a phase of its own, since all the people sign up to their environments again on it.
+    :param infected_counts: list of the number of infected people at the end of each day
+    :param low_fraction: float, the days before the peak with less than this fraction of the peak are 'low'
+    :param late_fraction: float, the days after the peak with less than this fraction of the peak are 'late'
+    :param peak_width: int, the days within this many days of the peak day are 'peak'
+    :return: dict from phase name ('first_day', 'low', 'peak', 'late') to the list of the indices of its days
+    """
+    if not infected_counts:
+        return {'first_day': [], 'low': [], 'peak': [], 'late': []}
+    peak_day = int(np.argmax(infected_counts))
+    peak = infected_counts[peak_day]
+    return {
+        'first_day': [0],
+        'low': [day for day in range(1, peak_day) if infected_counts[day] < low_fraction * peak],
+        'peak': list(range(max(0, peak_day - peak_width), min(len(infected_counts), peak_day + peak_width + 1))),
+        'late': [day for day in range(peak_day + 1, len(infected_counts))
+                 if infected_counts[day] < late_fraction * peak],
+    }
+
+
+def benchmark_world_size(num_people, seed=0, max_days=200, num_late_days=5, initial_infected_fraction=0.001):
+    """
+    Run all the benchmarks on a synthetic world of the given size
+    :param num_people: int number of people of the world
+    :param seed: int seed of all the random generators
+    :param max_days: int maximal number of days to simulate
+    :param num_late_days: int, the simulation stops after this many days of late prevalence
+    :param initial_infected_fraction: float fraction of the people to infect at the start
+    :return: dict of the results (seconds of each benchmark, and the size of the world and of the epidemic)
+    """
+    timings = {}
+    start = perf_counter()
+    world = make_synthetic_world(num_people, seed)
+    timings['generate_world'] = perf_counter() - start
+
+    start = perf_counter()
+    world.sign_all_people_up_to_environments()
+    timings['sign_up'] = perf_counter() - start
+
+    outdir = tempfile.mkdtemp(prefix='benchmark_')
+    try:
+        random.seed(seed)
+        np.random.seed(seed)
+        sim = Simulation(world, INITIAL_DATE, outdir=os.path.join(outdir, 'simulation'))
+        sim.infect_random_set(max(1, int(initial_infected_fraction * len(world.all_people()))), 'benchmark')
+        sim.start_run(max_days)
+        day_times = []
+        infected_counts = []
+        num_late = 0
+        for _ in range(max_days):
+            start = perf_counter()
+            sim.simulate_day()
+            day_times.append(perf_counter() - start)
+            infected_counts.append(sim.counters.count_infected())
+            sim.num_days_simulated += 1
+            peak = max(infected_counts)
+            if infected_counts[-1] < 0.25 * peak and infected_counts.index(peak) < len(infected_counts) - 1:
+                num_late += 1
+            if num_late >= num_late_days or infected_counts[-1] == 0:
+                break
+        phases = split_by_prevalence(infected_counts)
+        timings['simulate_day'] = {
+            phase: _summarize_day_times([day_times[day] for day in days]) for phase, days in phases.items()
+        }
+        timings['simulate_day']['all'] = _summarize_day_times(day_times)
+
+        start = perf_counter()
+        sim.finish_run('benchmark', {'persons': make_age_and_state_datas_to_plot()})
+        timings['finish_run'] = perf_counter() - start
+    finally:
+        shutil.rmtree(outdir, ignore_errors=True)
+
+    # The interventions hook events on the people, so they get a fresh copy of the world
+    world = make_synthetic_world(num_people, seed)
+    timings['generate_events'] = {}
+    for intervention in _benchmark_interventions():
+        random.seed(seed)
+        start = perf_counter()
+        intervention.generate_events(world)
+        timings['generate_events'][type(intervention).__name__] = perf_counter() - start
+
+    return {
+        'num_people': len(world.all_people()),
+        'num_environments': len(world.all_environments),
+        'days_simulated': len(day_times),
+        'peak_infected': max(infected_counts) if infected_counts else 0,
+        'peak_day': int(np.argmax(infected_counts)) if infected_counts else None,
+        'timings': timings,
+    }
+
+
+def _git_commit():
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', 'HEAD'], cwd=os.path.dirname(os.path.abspath(__file__)), stderr=subprocess.DEVNULL
+        ).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_benchmarks(sizes=DEFAULT_SIZES, seed=0, max_days=200):
+    """
+    Run the benchmarks on synthetic worlds of all the given sizes
+    :param sizes: iterable of int numbers of people
+    :param seed: int seed of all the random generators
+    :param max_days: see benchmark_world_size
+    :return: dict of the results and of the environment of the run (commit, versions, params...)
+    """
+    params_file = load_params()
+    results = {
+        'format_version': BENCHMARK_FORMAT_VERSION,
+        'git_commit': _git_commit(),
+        'date': datetime.now().isoformat(timespec='seconds'),
+        'python': sys.version.split()[0],
+        'numpy': np.__version__,
+        'platform': platform.platform(),
+        'params_file': params_file,
+        'seed': seed,
+        'max_days': max_days,
+        'sizes': {},
+    }
+    for num_people in sizes:
+        log.info("Benchmarking a world of {} people".format(num_people))
+        results['sizes'][str(num_people)] = benchmark_world_size(num_people, seed, max_days)
+    return results
+
+
+def _flatten_timings(timings, prefix=''):
+    """
+    :return: dict from the dotted name of each timing (e.g. 'simulate_day.peak.median') to its seconds
+    """
+    flat = {}
+    for name, value in timings.items():
+        if isinstance(value, dict):
+            flat.update(_flatten_timings(value, prefix + name + '.'))
+        elif value is not None and not (prefix.startswith('simulate_day.') and name in ('num_days', 'total')):
+            flat[prefix + name] = value
+    return flat
+
+
+def compare_results(baseline, current, threshold=0.2, min_seconds=0.05):
+    """
+    Compare the timings of two benchmark runs
+    :param baseline: dict of the results of the baseline run (see run_benchmarks)
+    :param current: dict of the results of the current run
+    :param threshold: float, a timing that is slower by more than this fraction is a regression
+    :param min_seconds: float, timings that are shorter than this in both runs are too noisy to compare
+    :return: list of (world size, timing name, baseline seconds, current seconds) of the regressions
+    """
+    regressions = []
+    for size, current_results in current['sizes'].items():
+        if size not in baseline['sizes']:
+            continue
+        baseline_timings = _flatten_timings(baseline['sizes'][size]['timings'])
+        for name, seconds in _flatten_timings(current_results['timings']).items():
+            old_seconds = baseline_timings.get(name)
+            if old_seconds is None or max(old_seconds, seconds) < min_seconds:
+                continue
+            if seconds > old_seconds * (1 + threshold):
+                regressions.append((size, name, old_seconds, seconds))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark the simulation loop on synthetic worlds')
+    parser.add_argument('--sizes', type=int, nargs='+', default=list(DEFAULT_SIZES),
+                        help='the numbers of people of the synthetic worlds')
+    parser.add_argument('--seed', type=int, default=0, help='the seed of all the random generators')
+    parser.add_argument('--max-days', type=int, default=200, help='the maximal number of days to simulate')
+    parser.add_argument('--output', default='benchmark_results.json', help='the path of the json results file')
+    parser.add_argument('--compare', help='the path of a results file of a baseline run to compare with')
+    parser.add_argument('--threshold', type=float, default=0.2,
+                        help='the fraction of slowdown that counts as a regression')
+    args = parser.parse_args(argv)
+    logging.basicConfig(format='%(levelname)s:%(message)s', level=logging.INFO)
+
+    results = run_benchmarks(args.sizes, args.seed, args.max_days)
+    with open(args.output, 'w') as f:
+        json.dump(results, f, indent=2)
+    log.info("Saved the results to {}".format(args.output))
+    if args.compare is None:
+        return 0
+    with open(args.compare) as f:
+        baseline = json.load(f)
+    regressions = compare_results(baseline, results, args.threshold)
+    for size, name, old_seconds, seconds in regressions:
+        log.warning("{} people, {}: {:.4f}s -> {:.4f}s".format(size, name, old_seconds, seconds))
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,49 @@
+import random
+
+import numpy as np
+
+from src.util import Distribution
+from src.world.city_data.city import City, CityFields
+from src.world.population_generation import generate_city
+
+SYNTHETIC_CITY_NAME = 'synthetic'
+
+# Rough demographics of an Israeli city, so the synthetic worlds have realistic households, schools and workplaces
+_AGE_SEGMENTS = [(0, 9), (10, 19), (20, 29), (30, 39), (40, 49), (50, 59), (60, 69), (70, 79), (80, 99)]
+_AGE_PROBS = [0.19, 0.17, 0.14, 0.13, 0.12, 0.09, 0.08, 0.05, 0.03]
+_HOUSEHOLD_SIZE_SEGMENTS = [(1, 1), (2, 2), (3, 3), (4, 4), (5, 5), (6, 7)]
+_HOUSEHOLD_SIZE_PROBS = [0.2, 0.24, 0.17, 0.17, 0.13, 0.09]
+
+
+def make_synthetic_city(population, name=SYNTHETIC_CITY_NAME):
+    """
+    Make a City with fixed demographic distributions, without reading the demographic xls file.
+    Only the fields that the naive population generation uses are set.
+    :param population: int number of people in the city
+    :param name: str english name of the city
+    :return: City object
+    """
+    fields = dict.fromkeys(CityFields)
+    fields.update(
+        town_symbol=0,
+        hebrew_name=name,
+        english_name=name,
+        population=population,
+        age_distribution=Distribution(_AGE_SEGMENTS, _AGE_PROBS),
+        household_size_distribution=Distribution(_HOUSEHOLD_SIZE_SEGMENTS, _HOUSEHOLD_SIZE_PROBS)
+    )
+    return City(**fields)
+
+
+def make_synthetic_world(num_people, seed=0):
+    """
+    Generate the World of a synthetic city (see make_synthetic_city) with the naive population generation,
+    and the environments of the loaded params (schools, workplaces...).
+    The world depends only on the number of people, the seed and the params.
+    :param num_people: int (approximate) number of people
+    :param seed: int seed of the random generators
+    :return: World object
+    """
+    random.seed(seed)
+    np.random.seed(seed)
+    return generate_city(make_synthetic_city(num_people), is_smart_household_generation=False, scaling=1.0)
@@ -19,9 +19,8 @@ class ImmuneByAgeExtension(Simulation):
         if portion of population that is immune > self.ImmunePortion Do nothing
         else immune by age group
         """
-        tmp = [1 for p in self.parent._world.all_people() if(( p.get_disease_state() == DiseaseState.IMMUNE) and ( p.get_disease_state() != DiseaseState.DECEASED))]
-        cnt  = sum(tmp)
-        num_people  = sum([1 for p in self.parent._world.all_people() if p.get_disease_state() != DiseaseState.DECEASED])
+        cnt  = self.parent.counters.count(DiseaseState.IMMUNE)
+        num_people  = self.parent.counters.count_alive()
         potionUntilNow = cnt / num_people
         peopleToImmune=[]
         if self.ImmunePortion > potionUntilNow:
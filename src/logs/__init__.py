@@ -1,4 +1,6 @@
 from src.logs.stats import Statistics, DayStatistics
+from src.logs.instrumentation import DayInstrumentation, INSTRUMENTATION_FILE_NAME, summarize_instrumentation_files
+from src.logs.memory_census import MemoryCensus, MEMORY_CENSUS_JSON_FILE_NAME, MEMORY_CENSUS_REPORT_FILE_NAME
 from src.logs.stats import \
     make_age_and_state_datas_to_plot, \
     make_infections_age_datas_to_plot,\
@@ -12,6 +14,12 @@ from src.logs.stats import \
 __all__ = [
     'Statistics',
     'DayStatistics',
+    'DayInstrumentation',
+    'INSTRUMENTATION_FILE_NAME',
+    'summarize_instrumentation_files',
+    'MemoryCensus',
+    'MEMORY_CENSUS_JSON_FILE_NAME',
+    'MEMORY_CENSUS_REPORT_FILE_NAME',
     'make_age_and_state_datas_to_plot',
     'make_age_and_state_datas_to_plot',
     'make_infections_age_datas_to_plot',
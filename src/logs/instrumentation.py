@@ -0,0 +1,183 @@
+import csv
+import json
+import os
+from collections import Counter
+from statistics import mean, stdev
+from time import perf_counter
+
+INSTRUMENTATION_FILE_NAME = 'instrumentation.jsonl'
+
+
+class DayInstrumentation(object):
+    """
+    Records where the time of each simulated day goes:
+    the wall time of each phase of the day (see Simulation.simulate_day) and counts of the work done in it
+    (events applied, people re-registered, environments propagated, infections...),
+    some of them broken down by environment type.
+    A phase is timed from the end of the previous phase (or the start of the day) to the call of end_phase,
+    so recording costs one clock read per phase.
+    A disabled object ignores all the calls, so the simulation can always call it.
+    The phases and counts are ignored outside of a day (between end_day and the next start_day),
+    e.g. of the events that are applied when the simulation is infected, before its first day.
+    Work that is done inside of the phases, e.g. by a listener while the events are applied, is timed as a section
+    (see clock and end_section), its time is also a part of the time of the phase it was done in.
+    The days are written as json lines, one object per day:
+    {"date": "2020-03-01", "phase_seconds": {phase: seconds}, "section_seconds": {section: seconds},
+     "counts": {name: count}}
+    """
+    __slots__ = ('enabled', '_days', '_date', '_phase_seconds', '_section_seconds', '_counts', '_last_time')
+
+    def __init__(self, enabled=True):
+        """
+        :param enabled: bool, whether to record anything
+        """
+        self.enabled = enabled
+        self._days = []
+        self._date = None
+        self._phase_seconds = None
+        self._section_seconds = None
+        self._counts = None
+        self._last_time = None
+
+    def start_day(self, date):
+        """
+        Start recording a day, the first phase is timed from now
+        :param date: datetime.date of the day
+        """
+        if not self.enabled:
+            return
+        self._date = date
+        self._phase_seconds = {}
+        self._section_seconds = {}
+        self._counts = Counter()
+        self._last_time = perf_counter()
+
+    def end_phase(self, phase):
+        """
+        End the current phase of the day, the next phase is timed from now
+        :param phase: str name of the phase, the times of a phase that ends several times in a day are summed
+        """
+        if self._counts is None:
+            return
+        now = perf_counter()
+        self._phase_seconds[phase] = self._phase_seconds.get(phase, 0.0) + now - self._last_time
+        self._last_time = now
+
+    def clock(self):
+        """
+        :return: the start time of a section (see end_section), None outside of a day
+        """
+        if self._counts is None:
+            return None
+        return perf_counter()
+
+    def end_section(self, section, start):
+        """
+        Add the time from the given start to the time of a section of the day
+        :param section: str name of the section, the times of a section that ends several times in a day are summed
+        :param start: the start time of the section (see clock)
+        """
+        if start is None or self._counts is None:
+            return
+        self._section_seconds[section] = self._section_seconds.get(section, 0.0) + perf_counter() - start
+
+    def add_count(self, name, count=1):
+        """
+        :param name: str name of the counter
+        :param count: int amount to add to it today
+        """
+        if self._counts is None:
+            return
+        self._counts[name] += count
+
+    def add_counts_by_env(self, name, env_counts):
+        """
+        Add a count that is broken down by environment type,
+        the total is saved under the name and each environment type under "<name>.<environment type>"
+        :param name: str name of the counter
+        :param env_counts: Counter from environment type name to the amount to add to it today
+        """
+        if self._counts is None:
+            return
+        for env_name, count in env_counts.items():
+            self._counts[name] += count
+            self._counts[name + '.' + env_name] += count
+
+    def end_day(self):
+        """
+        Save the records of the current day
+        """
+        if not self.enabled:
+            return
+        self._days.append({
+            'date': self._date.isoformat(),
+            'phase_seconds': self._phase_seconds,
+            'section_seconds': self._section_seconds,
+            'counts': dict(self._counts)
+        })
+        self._phase_seconds = self._section_seconds = self._counts = None
+
+    def get_days(self):
+        """
+        :return: list of the dicts of the recorded days (see the class doc)
+        """
+        return self._days
+
+    def write(self, path):
+        """
+        Write the recorded days as json lines
+        :param path: str path of the file
+        """
+        with open(path, 'w') as f:
+            for day in self._days:
+                f.write(json.dumps(day) + '\n')
+
+    @staticmethod
+    def load(path):
+        """
+        :param path: str path of a file written by write
+        :return: list of the dicts of the days
+        """
+        with open(path) as f:
+            return [json.loads(line) for line in f if line.strip()]
+
+
+def summarize_instrumentation_files(paths, name, outdir):
+    """
+    Write a summary of the instrumentation files of several runs of the same simulation:
+    for each phase time, section time and count, its mean and std over the runs of its total and of its daily mean,
+    with the phases (and the sections) ordered by their total time
+    :param paths: list of the paths of the instrumentation files (see DayInstrumentation.write)
+    :param name: str name of the summary, the file is <outdir>/<name>_instrumentation_summary.csv
+    :param outdir: str path of the output directory
+    :return: the path of the summary file
+    """
+    runs = [DayInstrumentation.load(path) for path in paths]
+    rows = []
+    kinds = (('phase_seconds', 'phase_seconds'), ('section_seconds', 'section_seconds'), ('count', 'counts'))
+    for kind, key in kinds:
+        totals = [Counter() for _ in runs]
+        for run_totals, days in zip(totals, runs):
+            for day in days:
+                run_totals.update(day.get(key, {}))
+        names = set().union(*totals)
+        for metric in names:
+            run_sums = [run_totals[metric] for run_totals in totals]
+            daily_means = [run_totals[metric] / len(days) for run_totals, days in zip(totals, runs) if days]
+            rows.append({
+                'kind': kind,
+                'name': metric,
+                'total_mean': mean(run_sums),
+                'total_std': stdev(run_sums) if len(run_sums) > 1 else 0.0,
+                'daily_mean': mean(daily_means) if daily_means else 0.0,
+                'daily_std': stdev(daily_means) if len(daily_means) > 1 else 0.0
+            })
+    kind_order = [kind for kind, _ in kinds]
+    rows.sort(key=lambda row: (kind_order.index(row['kind']), -row['total_mean'] if row['kind'] != 'count' else 0,
+                               row['name']))
+    summary_path = os.path.join(outdir, name + '_instrumentation_summary.csv')
+    with open(summary_path, 'w', newline='') as f:
+        writer = csv.DictWriter(f, ['kind', 'name', 'total_mean', 'total_std', 'daily_mean', 'daily_std'])
+        writer.writeheader()
+        writer.writerows(rows)
+    return summary_path
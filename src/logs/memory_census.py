@@ -0,0 +1,290 @@
+import gc
+import json
+import os
+import sys
+import tracemalloc
+from collections import Counter, defaultdict, deque
+from enum import Enum
+from types import BuiltinFunctionType, FunctionType, MethodType, ModuleType
+
+from src.logs.stats import DayStatistics
+from src.simulation.event import DayEvent, DayTrigger, Event
+from src.world import InfectionData, Person, ROUTINE_CACHE
+from src.world.environments.homogeneous_environment import HomogeneousEnvironment
+
+MEMORY_CENSUS_JSON_FILE_NAME = 'memory_census.json'
+MEMORY_CENSUS_REPORT_FILE_NAME = 'memory_census.txt'
+
+# The types whose retained size is measured, as (name, predicate) pairs.
+# 'Event' is every Event that is not a DayEvent, and 'HomogeneousEnvironment' includes all its subclasses.
+_KEY_TYPES = (
+    ('Person', lambda obj: isinstance(obj, Person)),
+    ('InfectionData', lambda obj: isinstance(obj, InfectionData)),
+    ('DayEvent', lambda obj: isinstance(obj, DayEvent)),
+    ('Event', lambda obj: isinstance(obj, Event) and not isinstance(obj, DayEvent)),
+    ('DayTrigger', lambda obj: isinstance(obj, DayTrigger)),
+    ('HomogeneousEnvironment', lambda obj: isinstance(obj, HomogeneousEnvironment)),
+    ('DayStatistics', lambda obj: isinstance(obj, DayStatistics)),
+)
+_KEY_CLASSES = (Person, InfectionData, Event, DayTrigger, HomogeneousEnvironment, DayStatistics)
+
+# The subsystems that allocations are attributed to, by the source files in their tracebacks.
+# An allocation belongs to the first subsystem (in this order) that has a frame in its traceback,
+# e.g. the events made by an intervention belong to 'interventions' although they are made in event.py.
+_SRC_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+_SUBSYSTEMS = (
+    ('interventions', ('simulation/interventions/',)),
+    ('stats', ('logs/',)),
+    ('seir_events', ('seir/', 'simulation/event.py', 'simulation/transition_queue.py')),
+    ('environments', ('world/environments/',)),
+    ('population', ('world/population_generation/', 'world/city_data/')),
+    ('world', ('world/',)),
+    ('simulation', ('simulation/', 'run_utils.py')),
+)
+_NO_CHILDREN_TYPES = (str, bytes, int, float, complex, bool, type(None), type, ModuleType, FunctionType,
+                      BuiltinFunctionType, MethodType, Enum)
+
+
+def _subsystem_of(traceback):
+    """
+    :param traceback: tracemalloc.Traceback
+    :return: str name of the subsystem of the allocation (see _SUBSYSTEMS), 'other' if none of them matches
+    """
+    src_paths = [
+        os.path.relpath(frame.filename, _SRC_ROOT).replace(os.sep, '/') for frame in traceback
+        if os.path.abspath(frame.filename).startswith(_SRC_ROOT)
+    ]
+    for name, prefixes in _SUBSYSTEMS:
+        if any(path.startswith(prefix) for path in src_paths for prefix in prefixes):
+            return name
+    return 'other'
+
+
+def _innermost_src_frame(traceback):
+    """
+    :param traceback: tracemalloc.Traceback (ordered from the oldest frame to the most recent)
+    :return: str "file:line" of the most recent frame of the traceback in the source tree,
+    or of the most recent frame if none of them is in it
+    """
+    src_frames = [frame for frame in traceback if os.path.abspath(frame.filename).startswith(_SRC_ROOT)]
+    if not src_frames:
+        return "{}:{}".format(traceback[-1].filename, traceback[-1].lineno)
+    frame = src_frames[-1]
+    return "{}:{}".format(os.path.relpath(frame.filename, _SRC_ROOT).replace(os.sep, '/'), frame.lineno)
+
+
+def _children(obj):
+    """
+    :return: the objects that the given object holds (the items of builtin containers, and the attributes of others)
+    """
+    if isinstance(obj, dict):
+        for key, value in obj.items():
+            yield key
+            yield value
+    elif isinstance(obj, (list, tuple, set, frozenset, deque)):
+        yield from obj
+    else:
+        for cls in type(obj).__mro__:
+            for name in cls.__dict__.get('__slots__', ()):
+                if name not in ('__dict__', '__weakref__') and hasattr(obj, name):
+                    yield getattr(obj, name)
+        if hasattr(obj, '__dict__'):
+            yield obj.__dict__
+
+
+def _retained_size(root, visited):
+    """
+    The size of an object and of everything it holds that was not already counted,
+    without entering the other objects of the key types (they are counted on their own)
+    :param root: the object
+    :param visited: set of the ids of the objects that were already counted, updated in place
+    :return: int number of bytes
+    """
+    size = 0
+    stack = [root]
+    while stack:
+        obj = stack.pop()
+        if id(obj) in visited:
+            continue
+        if obj is not root and isinstance(obj, _KEY_CLASSES):
+            continue
+        visited.add(id(obj))
+        size += sys.getsizeof(obj)
+        if not isinstance(obj, _NO_CHILDREN_TYPES):
+            stack.extend(_children(obj))
+    return size
+
+
+class MemoryCensus(object):
+    """
+    A diagnostic mode that reports, at chosen days of a simulation, what takes the memory:
+    1. the number and the (shallow) size of the objects of each type that the garbage collector tracks
+    2. the retained size of the key types of the simulation (people, events, environments, statistics...):
+    the size of their objects and of the containers and helper objects that only they hold
+    3. the traced allocations (see tracemalloc) by the subsystem that made them (see _SUBSYSTEMS),
+    and the lines that allocated the most
+    4. the sizes and the hit rates of the tables of the routine cache (see RoutineCache).
+    Tracing the allocations slows the run down and takes memory of its own, and a census goes over all the objects
+    (a census that is taken while tracing, before the last one, takes tens of seconds for a city),
+    so this should only be used for diagnosis. The tracing stops after the last census.
+    """
+    __slots__ = ('days', 'num_top', '_censuses')
+
+    NUM_TRACEBACK_FRAMES = 10
+
+    def __init__(self, days, num_top=30):
+        """
+        :param days: iterable of int numbers of days, a census is taken at the end of each of them
+        (1 is the end of the first simulated day)
+        :param num_top: int number of types and allocation lines to report in each census
+        """
+        self.days = frozenset(days)
+        self.num_top = num_top
+        self._censuses = []
+        self.start_tracing()
+
+    @classmethod
+    def start_tracing(cls):
+        """
+        Start tracing the allocations (if they are not traced yet).
+        Should be called as early as possible, e.g. before the world is loaded, so its allocations are attributed.
+        """
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(cls.NUM_TRACEBACK_FRAMES)
+
+    @staticmethod
+    def stop_tracing():
+        if tracemalloc.is_tracing():
+            tracemalloc.stop()
+
+    def on_day_end(self, day, date):
+        """
+        Take a census if the given day is one of the chosen days
+        :param day: int number of days simulated so far
+        :param date: datetime.date of the day
+        """
+        if day in self.days:
+            self.take(day, date, stop_tracing=day == max(self.days))
+
+    def take(self, day, date, stop_tracing=False):
+        """
+        Take a census of the memory now
+        :param day: int number of days simulated so far
+        :param date: datetime.date of the day
+        :param stop_tracing: Whether to stop tracing the allocations once they are captured (for the last census),
+        the rest of the census and of the run are much faster without it
+        """
+        # The snapshot is taken first, so the allocations of the census itself are not in it
+        snapshot = tracemalloc.take_snapshot() if tracemalloc.is_tracing() else None
+        traced_current, traced_peak = tracemalloc.get_traced_memory()
+        if stop_tracing:
+            self.stop_tracing()
+        gc.collect()
+        objects = gc.get_objects()
+        type_counts = Counter()
+        type_sizes = Counter()
+        key_objects = defaultdict(list)
+        for obj in objects:
+            type_name = type(obj).__qualname__
+            type_counts[type_name] += 1
+            type_sizes[type_name] += sys.getsizeof(obj)
+            if isinstance(obj, _KEY_CLASSES):
+                for name, predicate in _KEY_TYPES:
+                    if predicate(obj):
+                        key_objects[name].append(obj)
+        visited = set()
+        key_types = [
+            {
+                'type': name,
+                'count': len(key_objects[name]),
+                'retained_size': sum(_retained_size(obj, visited) for obj in key_objects[name])
+            }
+            for name, _ in _KEY_TYPES
+        ]
+        del objects, key_objects, visited
+
+        census = {
+            'day': day,
+            'date': date.isoformat(),
+            'gc_objects': sum(type_counts.values()),
+            'types': [
+                {'type': type_name, 'count': type_counts[type_name], 'size': size}
+                for type_name, size in type_sizes.most_common(self.num_top)
+            ],
+            'key_types': key_types,
+            'routine_cache': ROUTINE_CACHE.get_stats(),
+        }
+        if snapshot is not None:
+            subsystems = defaultdict(lambda: {'size': 0, 'count': 0})
+            lines = defaultdict(lambda: {'size': 0, 'count': 0, 'subsystem': None})
+            for statistic in snapshot.statistics('traceback'):
+                subsystem = _subsystem_of(statistic.traceback)
+                subsystems[subsystem]['size'] += statistic.size
+                subsystems[subsystem]['count'] += statistic.count
+                line = lines[_innermost_src_frame(statistic.traceback)]
+                line['size'] += statistic.size
+                line['count'] += statistic.count
+                line['subsystem'] = subsystem
+            census['traced_current'] = traced_current
+            census['traced_peak'] = traced_peak
+            census['subsystems'] = dict(sorted(subsystems.items(), key=lambda item: -item[1]['size']))
+            census['top_lines'] = [
+                dict(line=line, **data)
+                for line, data in sorted(lines.items(), key=lambda item: -item[1]['size'])[:self.num_top]
+            ]
+        self._censuses.append(census)
+
+    def get_censuses(self):
+        """
+        :return: list of the dicts of the censuses that were taken
+        """
+        return self._censuses
+
+    def write(self, output_path):
+        """
+        Write the censuses as json, and as a readable report
+        :param output_path: str path of the output directory
+        """
+        with open(os.path.join(output_path, MEMORY_CENSUS_JSON_FILE_NAME), 'w') as f:
+            json.dump(self._censuses, f, indent=1)
+        with open(os.path.join(output_path, MEMORY_CENSUS_REPORT_FILE_NAME), 'w') as f:
+            f.write(self.format_report())
+
+    def format_report(self):
+        """
+        :return: str readable report of the censuses
+        """
+        lines = []
+        for census in self._censuses:
+            lines.append("=== day {} ({}): {} objects tracked by gc ===".format(
+                census['day'], census['date'], census['gc_objects']
+            ))
+            if 'traced_current' in census:
+                lines.append("traced memory: {:.1f} MB (peak {:.1f} MB)".format(
+                    census['traced_current'] / 2 ** 20, census['traced_peak'] / 2 ** 20
+                ))
+            lines.append("")
+            lines.append("{:<32}{:>12}{:>16}".format("key type", "count", "retained MB"))
+            for row in census['key_types']:
+                lines.append("{:<32}{:>12}{:>16.2f}".format(row['type'], row['count'], row['retained_size'] / 2 ** 20))
+            lines.append("")
+            lines.append("{:<32}{:>12}{:>16}".format("routine cache table", "entries", "hit rate"))
+            for name, row in census['routine_cache'].items():
+                lines.append("{:<32}{:>12}{:>16.3f}".format(name, row['size'], row['hit_rate']))
+            if 'subsystems' in census:
+                lines.append("")
+                lines.append("{:<32}{:>12}{:>16}".format("subsystem", "blocks", "allocated MB"))
+                for name, row in census['subsystems'].items():
+                    lines.append("{:<32}{:>12}{:>16.2f}".format(name, row['count'], row['size'] / 2 ** 20))
+                lines.append("")
+                lines.append("{:<60}{:<16}{:>12}{:>16}".format("line", "subsystem", "blocks", "allocated MB"))
+                for row in census['top_lines']:
+                    lines.append("{:<60}{:<16}{:>12}{:>16.2f}".format(
+                        row['line'], row['subsystem'], row['count'], row['size'] / 2 ** 20
+                    ))
+            lines.append("")
+            lines.append("{:<32}{:>12}{:>16}".format("type", "count", "shallow MB"))
+            for row in census['types']:
+                lines.append("{:<32}{:>12}{:>16.2f}".format(row['type'], row['count'], row['size'] / 2 ** 20))
+            lines.append("")
+        return "\n".join(lines)
@@ -65,3 +65,37 @@ def calculate_r0_data(population, max_date=None):
     smoothed_avg_r0 = [c[1][1] for c in r0_by_infection_date]
     avg_r0 = [c[1][0] for c in r0_by_infection_date]
     return {'dates': dates, 'smoothed_avg_r0': smoothed_avg_r0, 'avg_r0': avg_r0}
+
+
+def calculate_r0_data_from_arrays(initial_date, infection_days, transmitters, num_infections, max_date=None):
+    """
+    Same as calculate_r0_data, for a population held in arrays (see ArraySimulation).
+    :param initial_date: The date of day 0
+    :param infection_days: numpy int array, the infection day of each person (-1 if he has no infection date)
+    :param transmitters: numpy int array, the index of the person who infected each person (-1 if none)
+    :param num_infections: numpy float array, the (smoothed) number of people each person infected
+    :param max_date: The last date of the graph
+    """
+    has_date = infection_days >= 0
+    if not has_date.any():
+        return None
+    # how many each person has infected
+    infected_counts = np.bincount(transmitters[transmitters >= 0], minlength=len(infection_days))
+
+    min_day = int(infection_days[has_date].min())
+    max_day = int(infection_days[has_date].max())
+    days = infection_days[has_date] - min_day
+    num_infecting = np.bincount(days, minlength=max_day - min_day + 1)
+    total_infected = np.bincount(days, weights=infected_counts[has_date], minlength=max_day - min_day + 1)
+    smoothed_num_infected = np.bincount(days, weights=num_infections[has_date], minlength=max_day - min_day + 1)
+
+    max_date = initial_date + timedelta(days=max_day) if not max_date else max_date
+    dates, avg_r0, smoothed_avg_r0 = [], [], []
+    for i in range(max_day - min_day + 1):
+        date = initial_date + timedelta(days=min_day + i)
+        if date > max_date:
+            break
+        dates.append(date)
+        avg_r0.append(total_infected[i] / num_infecting[i] if num_infecting[i] > 0 else np.NaN)
+        smoothed_avg_r0.append(smoothed_num_infected[i] / num_infecting[i] if num_infecting[i] > 0 else np.NaN)
+    return {'dates': dates, 'smoothed_avg_r0': smoothed_avg_r0, 'avg_r0': avg_r0}
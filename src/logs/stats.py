@@ -6,7 +6,7 @@ matplotlib.use('Agg')
 import matplotlib.pyplot as plt
 import matplotlib.dates as mdates
 import warnings
-from numpy import sqrt, nanmean, nanstd, NaN, isnan, array, logical_or
+from numpy import sqrt, nanmean, nanstd, NaN, isnan, array, logical_or, zeros, int32
 import csv
 import logging
 from collections import Counter, namedtuple, defaultdict
@@ -20,7 +20,8 @@ from src.logs.summary import make_summary_by_age_table, TableFormat
 from src.simulation.params import Params
 from src.seir import DiseaseState
 from src.world import RedactedPersonAndEnv,World
-from src.logs.r0_data import calculate_r0_data
+from src.logs.r0_data import calculate_r0_data, calculate_r0_data_from_arrays
+from src.logs.instrumentation import INSTRUMENTATION_FILE_NAME
 
 
 logging.getLogger('matplotlib.font_manager').disabled = True
@@ -36,7 +37,10 @@ INTERVENTION_TYPE_TO_COLOR = {
     CityCurfewIntervention: 'gray',
     HouseholdIsolationIntervention: 'blue',
     WorkplaceClosureIntervention: 'teal',
-    LockdownIntervention: 'pink'
+    LockdownIntervention: 'pink',
+    AdaptiveIntervention: 'purple',
+    VaccinationCampaignIntervention: 'olive',
+    ContactTracingIntervention: 'cyan'
 }
 
 INTERVENTION_TYPE_TO_LABEL = {
@@ -48,7 +52,10 @@ INTERVENTION_TYPE_TO_LABEL = {
     SchoolClosureIntervention: 'school closure',
     SchoolIsolationIntervention: 'school isolation',
     SymptomaticIsolationIntervention: 'symptomatic isolation',
-    WorkplaceClosureIntervention: 'workplace closure'
+    WorkplaceClosureIntervention: 'workplace closure',
+    AdaptiveIntervention: 'adaptive intervention',
+    VaccinationCampaignIntervention: 'vaccination campaign',
+    ContactTracingIntervention: 'contact tracing'
 }
 
 class DataToPlot(object):
@@ -98,13 +105,12 @@ class DayStatistics(object):
     __slots__ = ('date', 'person_count', 'infection_data_projection', 'diff_infect')
 
     def __init__(self, date, changed_population):
-        self.date = date
         #how many people change to each state
-        self.person_count = Counter(
+        person_count = Counter(
             person.get_state()
             for person in changed_population
         )
-        self.person_count.subtract(
+        person_count.subtract(
             person.get_last_state()
             for person in changed_population
         ) 
@@ -114,6 +120,24 @@ class DayStatistics(object):
             for person in changed_population
             if (person.get_infection_data() is not None) and (person.get_infection_data().date == date)
         )
+        self._init_from_counts(date, person_count, infected_today_stats)
+
+    @classmethod
+    def from_counts(cls, date, person_count, infected_today_stats):
+        """
+        Make the DayStatistics of a simulation that does not hold Person objects (see ArraySimulation)
+        :param date: The date of the data
+        :param person_count: Counter from RedactedPerson (or None) to the change in the number of such people
+        :param infected_today_stats: list of InfectionData.get_stats() like dicts of today's infections
+        :return: DayStatistics
+        """
+        ret = cls.__new__(cls)
+        ret._init_from_counts(date, person_count, infected_today_stats)
+        return ret
+
+    def _init_from_counts(self, date, person_count, infected_today_stats):
+        self.date = date
+        self.person_count = person_count
         #how many got infected divided into inector_state,env_name,etc'
         self.infection_data_projection = {
             key: Counter(stat[key] for stat in infected_today_stats)
@@ -151,9 +175,20 @@ class Statistics(object):
         'all_environment_names',
         'full_env_name_to_short_env_name',
         '_hood_data',
+        '_hood_infected',
+        '_hood_id_offset',
+        '_random_seed',
+        '_generating_city_name',
+        '_generating_scale',
     )
 
-    def __init__(self, output_path, world):
+    def __init__(self, output_path, world, collect_hood_data=True):
+        """
+        :param output_path: The path of the directory output files should be written into
+        :param world: The World of the simulation
+        :param collect_hood_data: Whether to save the number of infected people in each neighborhood on each day
+        (see get_neiborhood_data), sweeps that never read it can skip this
+        """
         self._output_path = output_path
         if not os.path.isdir(output_path):
             os.mkdir(output_path)
@@ -164,7 +199,15 @@ class Statistics(object):
         self.num_infected = 0
         self.min_date = None
         self.max_date = None
-        self._hood_data= {}
+        self._hood_data = None
+        self._hood_infected = None
+        self._hood_id_offset = 0
+        self._random_seed = None
+        # The simulation may not keep its world (see ArraySimulation), so the inputs of the world are kept here
+        self._generating_city_name = world._generating_city_name
+        self._generating_scale = world._generating_scale
+        if collect_hood_data:
+            self._init_hood_data(world)
         self.all_environment_names = set([env._full_name for env in world.all_environments])
         self.all_environment_names.add('initial_group')
         self.full_env_name_to_short_env_name = {'initial_group': 'initial_group'}
@@ -182,25 +225,74 @@ class Statistics(object):
         self._days_data.append(daily_data)
         self.num_infected += self._days_data[-1].diff_infect
         self.update_date_range(daily_data.date)
-        #Counts how many are sick in each neighborhood
-        hood_data = {}
-        for person in world.all_people():
-            if person.get_disease_state().is_infected():
-                hoodID = person.get_neighberhood().get_neighborhood_id()
-                if hoodID not in hood_data:
-                    hood_data[hoodID] = 1 
-                else:
-                    hood_data[hoodID] +=1
-        self._hood_data[daily_data.date] = hood_data
+        #Counts how many are sick in each neighborhood, updating only by the people that changed today
+        if self._hood_data is not None:
+            for person in world.changed_people():
+                self._update_hood_infected(person, None, person.get_last_state())
+                self._update_hood_infected(person, person.get_state(), None)
+            self._save_hood_data(daily_data.date)
+
+    def add_daily_data_from_hood_deltas(self, daily_data: DayStatistics, hood_deltas):
+        """
+        Register the data of this day, for a simulation that does not hold Person objects (see ArraySimulation)
+        :param daily_data: DayStatistics
+        :param hood_deltas: dict from neighborhood id to the change in its number of infected people today
+        """
+        assert self._final_state is None, "Can't add daily data after marked ending!"
+        self._days_data.append(daily_data)
+        self.num_infected += self._days_data[-1].diff_infect
+        self.update_date_range(daily_data.date)
+        if self._hood_data is not None:
+            for hood_id, delta in hood_deltas.items():
+                self._hood_infected[hood_id - self._hood_id_offset] += delta
+            self._save_hood_data(daily_data.date)
+
+    def _init_hood_data(self, world):
+        """
+        Init the running number of infected people in each neighborhood, as of the last saved states.
+        The counts are kept in a dense array indexed by the neighborhood ids
+        (which are consecutive in a generated world) minus the smallest id.
+        """
+        people = world.all_people()
+        hood_ids = set(
+            env.get_neighborhood_id() for env in world.all_environments if env.name == 'neighborhood_community'
+        )
+        hood_ids.update(
+            person.get_neighberhood().get_neighborhood_id() for person in people
+            if person.get_neighberhood() is not None
+        )
+        self._hood_id_offset = min(hood_ids, default=0)
+        self._hood_infected = zeros(max(hood_ids, default=-1) - self._hood_id_offset + 1, dtype=int32)
+        self._hood_data = {}
+        for person in people:
+            self._update_hood_infected(person, person.get_last_state(), None)
+
+    def _save_hood_data(self, date):
+        self._hood_data[date] = self._hood_infected.copy()
+
+    def _update_hood_infected(self, person, new_state, old_state):
+        """
+        Update the running count of infected people in the person's neighborhood
+        when he moves from old_state to new_state (both are RedactedPerson or None)
+        """
+        hood = person.get_neighberhood()
+        if hood is None:
+            return
+        delta = int(new_state is not None and new_state.disease_state.is_infected()) - \
+            int(old_state is not None and old_state.disease_state.is_infected())
+        if delta != 0:
+            self._hood_infected[hood.get_neighborhood_id() - self._hood_id_offset] += delta
 
     def get_neiborhood_data(self,date,hood_id):
         '''
         Returns the number of infected people which lives in certain neighborhood
+        (0 if the neighborhood data is not collected)
         '''
-        if self._hood_data == None:             return 0
-        if date not in self._hood_data:         return 0 
-        if hood_id not in self._hood_data[date]:return 0
-        return  self._hood_data[date][hood_id]
+        if self._hood_data is None:             return 0
+        if date not in self._hood_data:         return 0
+        index = hood_id - self._hood_id_offset
+        if not 0 <= index < len(self._hood_data[date]): return 0
+        return int(self._hood_data[date][index])
             
     def mark_ending(self, all_people):
         """
@@ -222,6 +314,14 @@ class Statistics(object):
                 )
         self._final_state = Counter(all_redacted_people)
 
+    def mark_ending_from_counts(self, final_state):
+        """
+        Mark this as a complete simulation, for a simulation that does not hold Person objects (see ArraySimulation)
+        :param final_state: Counter of RedactedPersonAndEnv
+        """
+        assert self._final_state is None, "Can't mark ending twice!"
+        self._final_state = final_state
+
     def update_date_range(self, date):
         """
         Updates the min_date and max_date of this simulation
@@ -236,6 +336,15 @@ class Statistics(object):
         self.min_date = min(self.min_date, date)
         self.max_date = max(self.max_date, date)
 
+    def set_output_path(self, output_path):
+        """
+        Change the directory the output files should be written into (e.g. for a branch of a run)
+        :param output_path: The path of the directory
+        """
+        self._output_path = output_path
+        if not os.path.isdir(output_path):
+            os.makedirs(output_path)
+
     def add_intervention(self, intervention):
         """
         Adds an intervention to the documented list of interventions
@@ -329,6 +438,17 @@ class Statistics(object):
             max_date = self.max_date
         self._r0_data = calculate_r0_data(population, max_date)
 
+    def calc_r0_data_from_arrays(self, initial_date, infection_days, transmitters, num_infections, max_date=None):
+        """
+        Same as calc_r0_data, for a simulation that does not hold Person objects (see ArraySimulation)
+        See calculate_r0_data_from_arrays for the parameters.
+        """
+        if max_date is None:
+            max_date = self.max_date
+        self._r0_data = calculate_r0_data_from_arrays(
+            initial_date, infection_days, transmitters, num_infections, max_date
+        )
+
     def plot_r0_data(self, image_path, avg_props=None, smoothed_props=None):
         """
         Plots the R data of this simulation (computed in advance).
@@ -629,6 +749,15 @@ class Statistics(object):
         assert params == self._params_at_init, "Params changed mid-simulation!"
         params.dump(params_path)
 
+    def set_random_seed(self, entropy, keys):
+        """
+        Document the random stream of the simulation (written to the inputs.txt file),
+        so its run can be repeated (see seed.seed_sequence)
+        :param entropy: int root entropy of the run
+        :param keys: tuple of the keys of the stream of the simulation's job
+        """
+        self._random_seed = (entropy, tuple(keys))
+
     def write_inputs(self, sim):
         """
         Write an inputs.txt file which documents the parameters which were used
@@ -638,12 +767,14 @@ class Statistics(object):
         inputs_path = os.path.join(self._output_path, 'inputs.txt')
         with open(inputs_path, 'w') as f:
             f.write('\n'.join([
-                "City: {}".format(sim._world._generating_city_name),
-                "Scale: {}".format(sim._world._generating_scale),
+                "City: {}".format(self._generating_city_name),
+                "Scale: {}".format(self._generating_scale),
                 "Initial date: {}".format(sim._initial_date),
                 "Initial infection: {}".format(sim.initial_infection_doc),
                 "Num days: {}".format(sim.num_days_to_run),
                 "base_infectiousness: {}".format(self._params_at_init["person"]["base_infectiousness"]),
+                "Random seed entropy: {}".format(None if self._random_seed is None else self._random_seed[0]),
+                "Random seed keys: {}".format(None if self._random_seed is None else self._random_seed[1]),
                 "",
                 "Interventions:",
                 ""
@@ -678,6 +809,20 @@ class Statistics(object):
                         params = [curr_name, count, key, value]
                         csv_writer.writerow(params)
 
+    def write_instrumentation(self, instrumentation):
+        """
+        Writes the per phase timings and counters of the simulated days next to the statistics
+        :param instrumentation: DayInstrumentation object
+        """
+        instrumentation.write(os.path.join(self._output_path, INSTRUMENTATION_FILE_NAME))
+
+    def write_memory_census(self, memory_census):
+        """
+        Writes the memory censuses that were taken during the run next to the statistics
+        :param memory_census: MemoryCensus object
+        """
+        memory_census.write(self._output_path)
+
     def dump(self, path):
         """
         Save this object to a file, so we may use it to generate more outputs
@@ -4,16 +4,18 @@ import multiprocessing as mp
 import os
 import sys
 import time
-from datetime import date
+from datetime import date, timedelta
 import copy
 
 from tqdm import tqdm
 
-from src.util import seed
+from src.util import seed, SimulationEngine
 from src.logs import *
 from src.simulation.params import Params
 from src.world.population_generation import PopulationLoader
 from src.simulation.simulation import Simulation
+from src.simulation.array_simulation import ArraySimulation, ReplicatedArraySimulation
+from src.simulation.partitioned_simulation import PartitionedArraySimulation
 from src.simulation.initial_infection_params import SmartInitialInfectionParams, NaiveInitialInfectionParams
 from src.seir import DiseaseState
 
@@ -25,17 +27,20 @@ class Task:
     An object which represents a task of running a single simulation once
     Each task, has to be single processed
     """
-    __slots__ = ('func', 'params', 'is_done')
+    __slots__ = ('func', 'params', 'is_done', 'runs_in_parent')
 
-    def __init__(self, func, params):
+    def __init__(self, func, params, runs_in_parent=False):
         """
         Init a task object
         :param func: the main function of the task (currently only create_and_run_simulation)
         :param params: the parameters to pass to the func
+        :param runs_in_parent: Whether a multi processed run() runs the task in its own process instead of its pool,
+        since the task starts worker processes of its own (see PartitionedArraySimulation)
         """
         self.func = func
         self.params = params
         self.is_done = False
+        self.runs_in_parent = runs_in_parent
 
 
 class RunningJob(object):
@@ -74,6 +79,29 @@ class RunningJob(object):
         if self.interventions is None:
             self.interventions = []
 
+        self.seed_entropy = None
+        self.seed_keys = ()
+
+    def set_seed_stream(self, entropy, parent_keys=()):
+        """
+        Set the random stream of the job, derived from the root entropy of the run
+        by the keys of the jobs that contain it and its own scenario name (see seed.seed_sequence).
+        Jobs that contain other jobs pass the stream on to them.
+        :param entropy: int root entropy of the run
+        :param parent_keys: tuple of the keys of the jobs that contain this job
+        """
+        self.seed_entropy = entropy
+        self.seed_keys = tuple(parent_keys) + (self.scenario_name,)
+
+    def get_seed_sequence(self, *keys):
+        """
+        :param keys: keys of a sub stream of the job's stream
+        :return: numpy SeedSequence of the job's random stream (or its sub stream)
+        """
+        if self.seed_entropy is None:
+            self.set_seed_stream(seed.new_entropy())
+        return seed.seed_sequence(self.seed_entropy, *(self.seed_keys + keys))
+
     def update_params(self, params_change):
         """
         Add more params to change to the param changes dict.
@@ -115,7 +143,9 @@ class SimpleJob(RunningJob):
 
     def __init__(self, scenario_name, city_name, scale, infection_params=SmartInitialInfectionParams(100, 50),
                  days=250, city_name_to_infect=None, initial_date=INITIAL_DATE,
-                 params_to_change=None, datas_to_plot=None, interventions=None):
+                 params_to_change=None, datas_to_plot=None, interventions=None, engine=SimulationEngine.OBJECTS,
+                 collect_hood_data=True, checkpoint_every=None, num_workers=None, instrument=False,
+                 memory_census_days=None):
         """
         Initialize a simple job, that runs one simulation task
         :param scenario_name: str name to use for the directories and filenames of the outputs
@@ -129,6 +159,19 @@ class SimpleJob(RunningJob):
         :param params_to_change: dict of the temporary changes to make to Param object
         :param datas_to_plot: states what data from the simulation will be counted and saved to output plots,
         see DataToPlot doc. Has a default behavior if the param is omitted.
+        :param engine: SimulationEngine, the implementation that runs the simulation (see ArraySimulation)
+        :param collect_hood_data: Whether to save the daily number of infected people in each neighborhood
+        :param checkpoint_every: int, if given the simulation is checkpointed every that many days
+        into the output directory, and a stopped run can be continued with resume_from_checkpoint
+        (supported only by the objects engine)
+        :param num_workers: int number of worker processes of the partitioned engine, the number of CPUs if None
+        (see PartitionedArraySimulation). The workers can't be started from the (daemonic) processes of a pool,
+        so a multi processed run() runs the tasks of the partitioned engine in its own process, next to its pool
+        :param instrument: Whether to record the time and the work of each phase of each simulated day
+        into instrumentation.jsonl next to statistics.pkl (see DayInstrumentation, supported only by the objects engine)
+        :param memory_census_days: iterable of the numbers of days at whose end a census of the memory is taken
+        into memory_census.txt next to statistics.pkl, the allocations are traced from the loading of the world
+        (see MemoryCensus, supported only by the objects engine)
         """
 
         super(SimpleJob, self).__init__(
@@ -138,6 +181,18 @@ class SimpleJob(RunningJob):
         )
         self.infection_params = infection_params
         self.city_name_to_infect = city_name_to_infect
+        self.engine = engine
+        self.collect_hood_data = collect_hood_data
+        assert checkpoint_every is None or engine == SimulationEngine.OBJECTS, \
+            "Checkpoints are supported only by the objects engine"
+        self.checkpoint_every = checkpoint_every
+        self.num_workers = num_workers
+        assert not instrument or engine == SimulationEngine.OBJECTS, \
+            "Instrumentation is supported only by the objects engine"
+        self.instrument = instrument
+        assert memory_census_days is None or engine == SimulationEngine.OBJECTS, \
+            "Memory censuses are supported only by the objects engine"
+        self.memory_census_days = memory_census_days
         self.datas_to_plot = datas_to_plot
         if self.datas_to_plot is None:
             self.datas_to_plot = {
@@ -157,7 +212,10 @@ class SimpleJob(RunningJob):
         outdir = os.path.join(outdir, self.scenario_name)
         assert not os.path.exists(outdir), "Directory '%s' already exists!" % outdir
         os.makedirs(outdir)
-        return [Task(self.create_and_run_simulation, (outdir, stop_early))]
+        return [Task(
+            self.create_and_run_simulation, (outdir, stop_early),
+            runs_in_parent=self.engine == SimulationEngine.PARTITIONED
+        )]
 
     def finalize(self, outdir):
         pass
@@ -171,17 +229,79 @@ class SimpleJob(RunningJob):
         :param with_population_caching: bool, if False generates the population, else - tries to use the cache and save time.
         :param verbosity: bool, if it's True then additional output logs will be printed to the screen
         """
-        seed.set_random_seed()
-        config_path = os.path.join(os.path.dirname(__file__),"config.json")
-        with open(config_path) as json_data_file:
-            ConfigData = json.load(json_data_file)
-            citiesDataPath = ConfigData['CitiesFilePath']
-            paramsDataPath = ConfigData['ParamsFilePath']
-            Extensionslst = ConfigData['ExtensionsNamelst']
-        Params.load_from(os.path.join(os.path.dirname(__file__), paramsDataPath), override=True)
-        for param, val in self.params_to_change.items():
-            Params.loader()[param] = val
-        DiseaseState.init_infectiousness_list()
+        sim, Extensionslst = self.create_simulation(outdir, stop_early, with_population_caching, verbosity)
+        checkpoint_args = {}
+        if self.checkpoint_every is not None:
+            checkpoint_args = dict(checkpoint_path=self.get_checkpoint_path(outdir), checkpoint_every=self.checkpoint_every)
+        if len(Extensionslst) > 0:
+            sim.run_simulation(self.days, self.scenario_name, datas_to_plot=self.datas_to_plot,extensionsList = Extensionslst,
+                               **checkpoint_args)
+        else:
+            sim.run_simulation(self.days, self.scenario_name, datas_to_plot=self.datas_to_plot,extensionsList = None,
+                               **checkpoint_args)
+
+    def create_simulation(self, outdir, stop_early, with_population_caching=True, verbosity=False):
+        """
+        Updates the params changes, loads or creates the population, and initializes and infects the simulation
+        :param outdir: the output directory for the task
+        :param stop_early: only relevant to R computation, see Simulation doc
+        :param with_population_caching: see create_and_run_simulation
+        :param verbosity: see create_and_run_simulation
+        :return: tuple of the simulation and the list of the names of the extensions to run it with
+        """
+        if self.memory_census_days is not None:
+            MemoryCensus.start_tracing()
+        world, Extensionslst = self._load_world(with_population_caching, verbosity)
+
+        ExtensionType = None
+        
+        if self.engine == SimulationEngine.ARRAYS:
+            sim = ArraySimulation(world, self.initial_date, self.interventions,
+                                  verbosity=verbosity, outdir=outdir, stop_early=stop_early,
+                                  collect_hood_data=self.collect_hood_data,
+                                  seed_sequence=self.get_seed_sequence('simulation'))
+        elif self.engine == SimulationEngine.PARTITIONED:
+            sim = PartitionedArraySimulation(world, self.initial_date, self.interventions,
+                                             verbosity=verbosity, outdir=outdir, stop_early=stop_early,
+                                             collect_hood_data=self.collect_hood_data, num_workers=self.num_workers,
+                                             seed_sequence=self.get_seed_sequence('simulation'))
+        else:
+            sim = Simulation(world, self.initial_date, self.interventions,
+                             verbosity=verbosity, outdir=outdir, stop_early=stop_early,
+                             collect_hood_data=self.collect_hood_data, instrument=self.instrument,
+                             memory_census_days=self.memory_census_days)
+        sim.stats.set_random_seed(self.seed_entropy, self.seed_keys)
+        self.infection_params.infect_simulation(sim, outdir, world)
+        return sim, Extensionslst
+
+    def create_replicated_simulation(self, outdirs, stop_early, seed_sequences, with_population_caching=True,
+                                     verbosity=False):
+        """
+        Like create_simulation, but creates a ReplicatedArraySimulation that runs several replicates of the job at once
+        :param outdirs: list of the output directories of the replicates
+        :param seed_sequences: list of the SeedSequences of the random streams of the replicates
+        :return: tuple of the simulation and the list of the names of the extensions to run it with
+        """
+        assert self.engine == SimulationEngine.ARRAYS, "Replicates are supported only by the arrays engine"
+        world, Extensionslst = self._load_world(with_population_caching, verbosity)
+        sim = ReplicatedArraySimulation(world, self.initial_date, outdirs, self.interventions,
+                                        verbosity=verbosity, stop_early=stop_early,
+                                        collect_hood_data=self.collect_hood_data, seed_sequences=seed_sequences)
+        self.infection_params.infect_simulation(sim, outdirs[0], world)
+        return sim, Extensionslst
+
+    def _load_world(self, with_population_caching, verbosity):
+        """
+        Loads the params of the job, loads or creates the population and seeds the global random generators
+        with the job's stream. The population is created from a stream of its own (by the city and scale),
+        so it does not depend on the job that happens to create it first.
+        :return: tuple of the World and the list of the names of the extensions to run it with
+        """
+        job_seed_sequence = self.get_seed_sequence('global')
+        seed.seed_global_generators(seed.seed_sequence(self.seed_entropy, 'population', self.city_name, self.scale))
+        ConfigData = self._load_params()
+        citiesDataPath = ConfigData['CitiesFilePath']
+        Extensionslst = ConfigData['ExtensionsNamelst']
 
         citiesDataPath  = citiesDataPath
         
@@ -194,16 +314,45 @@ class SimpleJob(RunningJob):
         )
 
         world = population_loader.get_world(city_name=self.city_name, scale=self.scale,is_smart = True)
+        seed.seed_global_generators(job_seed_sequence)
+        return world, Extensionslst
 
-        ExtensionType = None
-        
-        sim = Simulation(world, self.initial_date, self.interventions,
-                         verbosity=verbosity, outdir=outdir, stop_early=stop_early)
-        self.infection_params.infect_simulation(sim, outdir)
-        if len(Extensionslst) > 0:
-            sim.run_simulation(self.days, self.scenario_name, datas_to_plot=self.datas_to_plot,extensionsList = Extensionslst)
-        else:
-            sim.run_simulation(self.days, self.scenario_name, datas_to_plot=self.datas_to_plot,extensionsList = None)
+    def _load_params(self):
+        """
+        Load the params of this job (the params file of the config with the job's changes)
+        :return: dict of the config data
+        """
+        config_path = os.path.join(os.path.dirname(__file__),"config.json")
+        with open(config_path) as json_data_file:
+            ConfigData = json.load(json_data_file)
+            paramsDataPath = ConfigData['ParamsFilePath']
+        Params.load_from(os.path.join(os.path.dirname(__file__), paramsDataPath), override=True)
+        for param, val in self.params_to_change.items():
+            Params.loader()[param] = val
+        DiseaseState.init_infectiousness_list()
+        return ConfigData
+
+    @staticmethod
+    def get_checkpoint_path(outdir):
+        """
+        :param outdir: the output directory of the task
+        :return: the path of the checkpoint file of the task
+        """
+        return os.path.join(outdir, 'checkpoint.pkl')
+
+    def resume_from_checkpoint(self, outdir):
+        """
+        Continue a run of create_and_run_simulation that was stopped (e.g. crashed or preempted),
+        from the last checkpoint in its output directory
+        :param outdir: the output directory of the stopped task
+        """
+        assert self.checkpoint_every is not None, "This job does not save checkpoints"
+        self._load_params()
+        sim = Simulation.load_checkpoint(self.get_checkpoint_path(outdir))
+        sim.resume_simulation(
+            self.scenario_name, datas_to_plot=self.datas_to_plot,
+            checkpoint_path=self.get_checkpoint_path(outdir), checkpoint_every=self.checkpoint_every
+        )
 
 
 class RepeatJob(RunningJob):
@@ -213,20 +362,26 @@ class RepeatJob(RunningJob):
     If datas_to_plot is not given it plots the same graphs of its repeated job.
     """
 
-    def __init__(self, job, num_repetitions, datas_to_plot=None):
+    def __init__(self, job, num_repetitions, datas_to_plot=None, vectorized=False):
         """
         initialize a repeated job
         :param job: SimpleJob object to repeatedly run
         :param num_repetitions: int times to run the job
         :param datas_to_plot: states what data from the simulation will be counted and saved to output plots,
         see DataToPlot doc. The default behavior if the param is omitted, is to generate the outputs of the given job
+        :param vectorized: bool, if True all the repetitions run in a single task, as the replicates of one
+        ReplicatedArraySimulation that share the population and interventions (requires the arrays engine).
+        The outputs of the repetitions are the same files as when they run separately.
         """
         super(RepeatJob, self).__init__(
             job.scenario_name, job.city_name, job.scale,
             job.days, job.initial_date, job.params_to_change, job.interventions
         )
         assert isinstance(job, SimpleJob), "No implementation of RepeatJob(job) for job of type %s" % type(job)
+        assert not vectorized or job.engine == SimulationEngine.ARRAYS, \
+            "Vectorized repetitions are supported only by the arrays engine"
         self.num_repetitions = num_repetitions
+        self.vectorized = vectorized
         self.datas_to_plot = datas_to_plot
         if self.datas_to_plot is None:
             self.datas_to_plot = job.datas_to_plot
@@ -243,6 +398,14 @@ class RepeatJob(RunningJob):
         for job in self.jobs:
             job.update_params(params_change)
 
+    def set_seed_stream(self, entropy, parent_keys=()):
+        """
+        Set the random streams of the job and of each of its repetitions, see RunningJob.set_seed_stream
+        """
+        super(RepeatJob, self).set_seed_stream(entropy, parent_keys)
+        for job in self.jobs:
+            job.set_seed_stream(entropy, self.seed_keys)
+
     def generate_tasks(self, outdir, stop_early=None):
         """
         creates the output directory for the run, and returns the all tasks to run
@@ -253,12 +416,37 @@ class RepeatJob(RunningJob):
         outdir = os.path.join(outdir, self.scenario_name)
         assert not os.path.exists(outdir), "Directory '%s' already exists!" % outdir
         os.makedirs(outdir)
+        if self.vectorized:
+            outdirs = [os.path.join(outdir, job.scenario_name) for job in self.jobs]
+            for job_outdir in outdirs:
+                os.makedirs(job_outdir)
+            return [Task(self.run_replicates, (outdirs, stop_early))]
         return sum([job.generate_tasks(outdir, stop_early) for job in self.jobs], [])
 
+    def run_replicates(self, outdirs, stop_early, with_population_caching=True, verbosity=False):
+        """
+        The function of the task of a vectorized job, that runs all the repetitions together
+        :param outdirs: list of the output directories of the repetitions
+        :param stop_early: only relevant to R computation, see Simulation doc
+        :param with_population_caching: see SimpleJob.create_and_run_simulation
+        :param verbosity: see SimpleJob.create_and_run_simulation
+        """
+        job = self.jobs[0]
+        # Each replicate draws from the stream of its repetition, as it would when running separately
+        seed_sequences = [repetition.get_seed_sequence('simulation') for repetition in self.jobs]
+        sim, Extensionslst = job.create_replicated_simulation(
+            outdirs, stop_early, seed_sequences, with_population_caching, verbosity
+        )
+        for stats, repetition in zip(sim.replicate_stats, self.jobs):
+            stats.set_random_seed(repetition.seed_entropy, repetition.seed_keys)
+        sim.run_simulation(job.days, [job.scenario_name for job in self.jobs], datas_to_plot=job.datas_to_plot,
+                           extensionsList=Extensionslst or None)
+
     def finalize(self, outdir):
         """
         handles the outputs that need to be done after all the tasks are finished.
-        Here the computation of mean, std and confidence of all the task is done, and saved to output directory
+        Here the computation of mean, std and confidence of all the task is done, and saved to output directory,
+        and the instrumentation of the tasks (if the job is instrumented) is summarized
         :param outdir: output directory path
         """
         outdir = os.path.join(outdir, self.scenario_name)
@@ -273,6 +461,11 @@ class RepeatJob(RunningJob):
         get_multiple_stats_summary_file(stats_files, self.scenario_name, outdir, shortened=False)
         get_multiple_stats_summary_file(stats_files, self.scenario_name, outdir, shortened=True)
         get_r_mean_and_confidence_from_statistics(stats_files, self.scenario_name, outdir)
+        if self.jobs[0].instrument:
+            summarize_instrumentation_files(
+                [os.path.join(os.path.dirname(stats_file), INSTRUMENTATION_FILE_NAME) for stats_file in stats_files],
+                self.scenario_name, outdir
+            )
 
     def get_all_params_changes(self):
         """
@@ -281,6 +474,110 @@ class RepeatJob(RunningJob):
         return sum([job.get_all_params_changes() for job in self.jobs], [])
 
 
+class BranchingJob(RunningJob):
+    """
+    A subclass that implements a job which runs several scenarios (branches) that differ only in
+    interventions that start on or after a certain day of the run.
+    The shared days (the prefix) are simulated once, by the given SimpleJob, and a snapshot of the simulation
+    is saved at the end of them. Then each branch continues from its own copy of the snapshot,
+    with its interventions added, as a separate task (so the branches may run in parallel).
+    The outputs of each branch are saved to a sub directory named after it.
+    """
+
+    def __init__(self, job, branch_day, branches):
+        """
+        initialize a branching job
+        :param job: SimpleJob object that runs the prefix, its interventions are shared by all the branches
+        :param branch_day: int number of days to simulate before the branches split
+        :param branches: dict from branch name to the list of interventions that are added to the branch,
+        they can not start before the branch date
+        """
+        super(BranchingJob, self).__init__(
+            job.scenario_name, job.city_name, job.scale,
+            job.days, job.initial_date, job.params_to_change, job.interventions
+        )
+        assert isinstance(job, SimpleJob), "No implementation of BranchingJob(job) for job of type %s" % type(job)
+        assert job.engine == SimulationEngine.OBJECTS, "Branching is supported only by the objects engine"
+        assert 0 <= branch_day <= job.days
+        branch_date = job.initial_date + timedelta(days=branch_day)
+        for interventions in branches.values():
+            for intervention in interventions:
+                assert intervention.start_date >= branch_date, "Branch interventions can not start before the branch"
+        self.job = job
+        self.branch_day = branch_day
+        self.branches = branches
+
+    def update_params(self, params_change):
+        """
+        Update the param changes from the given job to the prefix job
+        :param params_change: dict of changes to Params
+        """
+        super(BranchingJob, self).update_params(params_change)
+        self.job.update_params(params_change)
+
+    def set_seed_stream(self, entropy, parent_keys=()):
+        """
+        Set the random stream of the job, the prefix job has the same stream
+        (and the branches continue the stream of the prefix from the snapshot)
+        """
+        super(BranchingJob, self).set_seed_stream(entropy, parent_keys)
+        self.job.set_seed_stream(entropy, parent_keys)
+
+    @staticmethod
+    def get_snapshot_path(outdir):
+        """
+        :param outdir: the output directory of the job
+        :return: the path of the snapshot file of the prefix
+        """
+        return os.path.join(outdir, 'prefix_snapshot.pkl')
+
+    def generate_tasks(self, outdir, stop_early=None):
+        """
+        creates the output directory for the run, and returns the task that runs the prefix,
+        which returns the tasks of the branches when it's done
+        :param outdir: the path to the output directory
+        :param stop_early: only relevant to R computation, see Simulation doc
+        :return: list of one Task
+        """
+        outdir = os.path.join(outdir, self.scenario_name)
+        assert not os.path.exists(outdir), "Directory '%s' already exists!" % outdir
+        os.makedirs(outdir)
+        return [Task(self.run_prefix, (outdir, stop_early))]
+
+    def run_prefix(self, outdir, stop_early, with_population_caching=True, verbosity=False):
+        """
+        Simulates the shared days and saves the snapshot of the simulation
+        :param outdir: the output directory of the job
+        :param stop_early: only relevant to R computation, see Simulation doc
+        :param with_population_caching: see SimpleJob.create_and_run_simulation
+        :param verbosity: see SimpleJob.create_and_run_simulation
+        :return: list of the Task objects of the branches
+        """
+        sim, Extensionslst = self.job.create_simulation(outdir, stop_early, with_population_caching, verbosity)
+        sim.start_run(self.days, Extensionslst if len(Extensionslst) > 0 else None)
+        sim.simulate_days(self.branch_day)
+        with open(self.get_snapshot_path(outdir), 'wb') as f:
+            f.write(sim.snapshot())
+        return [Task(self.run_branch, (os.path.join(outdir, name), stop_early)) for name in self.branches]
+
+    def run_branch(self, outdir, stop_early, with_population_caching=True, verbosity=False):
+        """
+        Continues the snapshot of the prefix with the interventions of a branch, and saves its outputs
+        :param outdir: the output directory of the branch (named after it, inside the output directory of the job)
+        :param stop_early: only relevant to R computation, see Simulation doc
+        :param with_population_caching: unused, the population is loaded from the snapshot
+        :param verbosity: unused, the verbosity of the prefix is kept
+        """
+        name = os.path.basename(outdir)
+        self.job._load_params()
+        with open(self.get_snapshot_path(os.path.dirname(outdir)), 'rb') as f:
+            sim = Simulation.from_snapshot(f.read(), outdir, self.branches[name])
+        sim.resume_simulation(self.scenario_name + "_" + name, datas_to_plot=self.job.datas_to_plot)
+
+    def finalize(self, outdir):
+        pass
+
+
 class ParamChangeRJob(RunningJob):
     """
     A subclass that implements a job which repeat a given job and change each time one given parameter value.
@@ -321,6 +618,14 @@ class ParamChangeRJob(RunningJob):
         for job in self.jobs:
             job.update_params(params_change)
 
+    def set_seed_stream(self, entropy, parent_keys=()):
+        """
+        Set the random streams of the job and of each of its jobs, see RunningJob.set_seed_stream
+        """
+        super(ParamChangeRJob, self).set_seed_stream(entropy, parent_keys)
+        for job in self.jobs:
+            job.set_seed_stream(entropy, self.seed_keys)
+
     def generate_tasks(self, outdir, stop_early=None):
         """
         generates all the task of each job, one job per param change
@@ -359,15 +664,20 @@ class ParamChangeRJob(RunningJob):
         return sum([job.get_all_params_changes() for job in self.jobs], [])
 
 
-def create_city_and_serialize(city_name, scale, params_to_change):
+def create_city_and_serialize(city_name, scale, params_to_change, seed_entropy=None):
     """
     Generate population of a given city.
     Done once for each triplet (city, scale, params_to_change).
     :param city_name: str city name, "all" for entire country
     :param scale: float between 0-1, that states the size proportion of the city. 1 if for actual size
     :param params_to_change: dict of params to change, in Params object
+    :param seed_entropy: int root entropy of the run, the population is created from its stream
+    (see SimpleJob._load_world), if None a new entropy is used
     :return: World object
     """
+    if seed_entropy is None:
+        seed_entropy = seed.new_entropy()
+    seed.seed_global_generators(seed.seed_sequence(seed_entropy, 'population', city_name, scale))
     config_path = os.path.dirname(__file__) + "/config.json"
     with open(config_path) as json_data_file:
         ConfigData = json.load(json_data_file)
@@ -392,12 +702,13 @@ def create_city_and_serialize(city_name, scale, params_to_change):
     population_loader.get_world(city_name=city_name, scale=scale)
 
 
-def generate_all_cities_for_jobs(jobs, cpus_to_use):
+def generate_all_cities_for_jobs(jobs, cpus_to_use, seed_entropy=None):
     """
     Generate all the population needed before the jobs starts to run, and serialize it. That way,
     The multi processed runs don't try to generate the population at the same time, and can use the cashed results.
     :param jobs: all the jobs to be running
     :param cpus_to_use: the number of cpu cores to use, if grater than 1, the run will be multi processed
+    :param seed_entropy: int root entropy of the run (see create_city_and_serialize)
     """
     appearing_cities = set((job.city_name, job.scale) for job in jobs)
     appearing_cities_to_params = {city: [] for city in appearing_cities}
@@ -415,9 +726,9 @@ def generate_all_cities_for_jobs(jobs, cpus_to_use):
     print("Generating all cities...")
     if cpus_to_use == 1:
         for city_name, scale in appearing_cities:
-            create_city_and_serialize(city_name, scale, Params.loader())
+            create_city_and_serialize(city_name, scale, Params.loader(), seed_entropy)
         for city_name, scale, params_to_change in appearing_cities_and_params:
-            create_city_and_serialize(city_name, scale, params_to_change)
+            create_city_and_serialize(city_name, scale, params_to_change, seed_entropy)
     else:
         ctx = mp.get_context("spawn")
         pool = ctx.Pool(cpus_to_use)
@@ -425,7 +736,7 @@ def generate_all_cities_for_jobs(jobs, cpus_to_use):
 
         for city_name, scale, params_to_change in appearing_cities_and_params:
             futures.append(pool.apply_async(
-                create_city_and_serialize, args=(city_name, scale, params_to_change)
+                create_city_and_serialize, args=(city_name, scale, params_to_change, seed_entropy)
             ))
         pool.close()
         pool.join()
@@ -461,6 +772,11 @@ def run(jobs, multi_processed=True, with_population_caching=True, verbosity=True
     This func handles the user's run of the given simulation jobs.
     The run of the jobs can be multi processed, with each simulation as a unique process, and can use cached population
     to save time.
+    A task may return a list of new tasks of its job (see BranchingJob), which are run after it.
+    The tasks that start worker processes of their own (see Task.runs_in_parent) are run in this process,
+    while the pool runs the rest.
+    All the random streams of the run are derived from one root entropy (see seed.py), so the results
+    do not depend on the number of processes or on the order of the tasks.
     """
     config_path =os.path.join(os.path.dirname(__file__), "config.json")
     with open(config_path) as json_data_file:
@@ -473,6 +789,10 @@ def run(jobs, multi_processed=True, with_population_caching=True, verbosity=True
 
     if cpus_to_use == 0 or not multi_processed:
         cpus_to_use = 1
+
+    seed_entropy = seed.new_entropy()
+    for job in jobs:
+        job.set_seed_stream(seed_entropy)
             
     tasks_sets = [job.generate_tasks(outdir) for job in jobs]
     finalizers = [job.finalize for job in jobs]
@@ -481,18 +801,21 @@ def run(jobs, multi_processed=True, with_population_caching=True, verbosity=True
         for task_set, finalizer in zip(tasks_sets, finalizers):
             for task in task_set:
                 job_outdir, stop_early = task.params
-                task.func(
+                new_tasks = task.func(
                     job_outdir,
                     stop_early,
                     with_population_caching=with_population_caching,
                     verbosity=verbosity
                 )
+                if new_tasks:
+                    task_set.extend(new_tasks)
+                    prog_bar.total += len(new_tasks)
                 prog_bar.update()
             finalizer(outdir)
             prog_bar.update()
     else:
         if with_population_caching:
-            generate_all_cities_for_jobs(jobs, cpus_to_use)
+            generate_all_cities_for_jobs(jobs, cpus_to_use, seed_entropy)
         print('running a pool of {} threads parallelly'.format(cpus_to_use))
         sys.stdout.flush()
         prog_bar = tqdm(total=sum(len(task_set) + 1 for task_set in tasks_sets))
@@ -500,9 +823,23 @@ def run(jobs, multi_processed=True, with_population_caching=True, verbosity=True
         pool = ctx.Pool(cpus_to_use)
 
         finalize_futures = []
+        futures = []
+
+        def submit(finalizer, task_set, task):
+            futures.append(pool.apply_async(
+                task.func,
+                args=(*task.params, with_population_caching, verbosity),
+                callback=get_callback(finalizer, task_set, task)
+            ))
 
         def get_callback(finalizer, task_set, task):
-            def callback(_):
+            def callback(new_tasks):
+                # The new tasks are submitted before this future is marked as ready, so they are waited for below
+                if new_tasks:
+                    task_set.extend(new_tasks)
+                    prog_bar.total += len(new_tasks)
+                    for new_task in new_tasks:
+                        submit(finalizer, task_set, new_task)
                 prog_bar.update()
                 task.is_done = True
                 if all(t.is_done for t in task_set):
@@ -513,14 +850,18 @@ def run(jobs, multi_processed=True, with_population_caching=True, verbosity=True
 
             return callback
 
-        futures = []
+        parent_tasks = []
         for task_set, finalizer in zip(tasks_sets, finalizers):
-            for task in task_set:
-                futures.append(pool.apply_async(
-                    task.func,
-                    args=(*task.params, with_population_caching, verbosity),
-                    callback=get_callback(finalizer, task_set, task)
-                ))
+            for task in list(task_set):
+                if task.runs_in_parent:
+                    parent_tasks.append((finalizer, task_set, task))
+                else:
+                    submit(finalizer, task_set, task)
+        # The tasks that start worker processes of their own run here, while the pool runs the rest
+        for finalizer, task_set, task in parent_tasks:
+            get_callback(finalizer, task_set, task)(
+                task.func(*task.params, with_population_caching, verbosity)
+            )
         for future in futures:
             future.wait()
             future.get()
@@ -1,8 +1,9 @@
-from src.seir.seir_times import sample_seir_times, daysdelta,RealDataSeirTimesGeneration,SIRS
+from src.seir.seir_times import sample_seir_times, sample_seir_transitions_batch, daysdelta,RealDataSeirTimesGeneration,SIRS
 from src.seir.disease_state import DiseaseState
 
 __all__ = [
     'sample_seir_times',
+    'sample_seir_transitions_batch',
     'daysdelta',
     'DiseaseState',
     'RealDataSeirTimesGeneration',
@@ -1,6 +1,7 @@
 from datetime import timedelta
 from enum import Enum
 import random as _random
+import numpy as _np
 from scipy.stats import gamma
 import warnings
 
@@ -281,6 +282,90 @@ class RealDataSeirTimesGeneration(StatisticalSeirTimesGeneration):
         else:
             return daysdelta(self._critical_before_immune_distribution.sample()), DiseaseState.IMMUNE
 
+    @staticmethod
+    def sample_days_batch(distribution, size, rng=_np.random):
+        """
+        Vectorized sampling of 'size' durations (in days) from one of the gamma distributions
+        :param rng: numpy Generator (or the numpy.random module) to draw from
+        :return: numpy int array
+        """
+        values = _np.array([segment[0] for segment in distribution.segments])
+        probs = _np.array(distribution.segment_distribution.probs, dtype=float)
+        return rng.choice(values, size=size, p=probs / probs.sum())
+
+    @staticmethod
+    def access_table_per_age_batch(table, ages):
+        return _np.asarray(table)[_np.minimum(ages // 10, 8)]
+
+    def sample_transitions_batch(self, ages, rng=_np.random):
+        """
+        Vectorized version of sample_seir_times, for a batch of people that got infected on the same day.
+        :param ages: numpy int array of the ages of the infected people
+        :param rng: numpy Generator (or the numpy.random module) to draw from
+        :return: A tuple (latent_days, rows, days, new_states) of numpy arrays, where latent_days[j] is the latency
+        duration of the j-th person, and the i-th transition moves the rows[i]-th person to the DiseaseState
+        whose value is new_states[i], days[i] days after the infection
+        """
+        num_people = len(ages)
+        all_rows = _np.arange(num_people)
+        rows, days, new_states = [], [], []
+
+        def add_transitions(curr_rows, curr_days, state):
+            rows.append(curr_rows)
+            days.append(curr_days)
+            new_states.append(_np.full(len(curr_rows), state.value, dtype=_np.int8))
+
+        latent_days = self.sample_days_batch(self._latent_period_distribution, num_people, rng)
+        is_symptomatic = rng.random(num_people) < \
+            self.access_table_per_age_batch(self.symptomatic_given_infected_per_age, ages)
+
+        asymptomatic = all_rows[~is_symptomatic]
+        curr_days = latent_days[asymptomatic]
+        add_transitions(asymptomatic, curr_days, DiseaseState.ASYMPTOMATICINFECTIOUS)
+        add_transitions(
+            asymptomatic,
+            curr_days + self.sample_days_batch(self._infectious_before_immune_distribution, len(asymptomatic), rng),
+            DiseaseState.IMMUNE
+        )
+
+        symptomatic = all_rows[is_symptomatic]
+        curr_days = latent_days[symptomatic]
+        add_transitions(symptomatic, curr_days, DiseaseState.INCUBATINGPOSTLATENT)
+        curr_days = curr_days + \
+            self.sample_days_batch(self._infectious_before_symptomatic_distribution, len(symptomatic), rng)
+        add_transitions(symptomatic, curr_days, DiseaseState.SYMPTOMATICINFECTIOUS)
+        critical_given_symptomatic = \
+            self.access_table_per_age_batch(self.critical_given_hospitalized_per_age, ages[symptomatic]) * \
+            self.access_table_per_age_batch(self.hospitalization_given_symptomatic_per_age, ages[symptomatic])
+        is_critical = rng.random(len(symptomatic)) < critical_given_symptomatic
+
+        recovering = symptomatic[~is_critical]
+        add_transitions(
+            recovering,
+            curr_days[~is_critical] +
+            self.sample_days_batch(self._symptomatic_before_immune_distribution, len(recovering), rng),
+            DiseaseState.IMMUNE
+        )
+        critical = symptomatic[is_critical]
+        curr_days = curr_days[is_critical] + \
+            self.sample_days_batch(self._symptomatic_before_critical_distribution, len(critical), rng)
+        add_transitions(critical, curr_days, DiseaseState.CRITICAL)
+        is_deceased = rng.random(len(critical)) < \
+            self.access_table_per_age_batch(self.deceased_given_critical_per_age, ages[critical])
+        add_transitions(
+            critical[is_deceased],
+            curr_days[is_deceased] +
+            self.sample_days_batch(self._critical_before_deceased_distribution, int(is_deceased.sum()), rng),
+            DiseaseState.DECEASED
+        )
+        add_transitions(
+            critical[~is_deceased],
+            curr_days[~is_deceased] +
+            self.sample_days_batch(self._critical_before_immune_distribution, int((~is_deceased).sum()), rng),
+            DiseaseState.IMMUNE
+        )
+        return latent_days, _np.concatenate(rows), _np.concatenate(days), _np.concatenate(new_states)
+
     # For singleton use:
     singleton = None
     @classmethod
@@ -348,6 +433,25 @@ class SIRS(RealDataSeirTimesGeneration):
         if stage == DiseaseState.IMMUNE:
             return self.sample_immune_stage(person)
 
+    def sample_transitions_batch(self, ages, rng=_np.random):
+        """
+        Vectorized version of sample_seir_times, see RealDataSeirTimesGeneration.sample_transitions_batch.
+        Here the people that become immune become susceptible again after some time.
+        """
+        latent_days, rows, days, new_states = super().sample_transitions_batch(ages, rng)
+        to_immune = new_states == DiseaseState.IMMUNE.value
+        return latent_days, \
+            _np.concatenate([rows, rows[to_immune]]), \
+            _np.concatenate([
+                days,
+                days[to_immune] +
+                self.sample_days_batch(self._immuned_before_susceptible_distribution, int(to_immune.sum()), rng)
+            ]), \
+            _np.concatenate([
+                new_states,
+                _np.full(int(to_immune.sum()), DiseaseState.SUSCEPTIBLE.value, dtype=_np.int8)
+            ])
+
     def sample_seir_times(self, person):
         """
         Samples all stages and their durations for a given Person
@@ -390,3 +494,17 @@ def sample_seir_times(sir_type:machine_type ,person):
         return RealDataSeirTimesGeneration.make().sample_seir_times(person)
     elif sir_type == machine_type.SIRS:
         return SIRS.make().sample_seir_times(person)
+
+
+def sample_seir_transitions_batch(sir_type: machine_type, ages, rng=_np.random):
+    """
+    Samples the SEIR stages and durations of a batch of people at once
+    (see RealDataSeirTimesGeneration.sample_transitions_batch)
+    :param ages: numpy int array of the ages of the infected people
+    :param rng: numpy Generator (or the numpy.random module) to draw from
+    :return: (latent_days, rows, days, new_states) numpy arrays
+    """
+    if sir_type == machine_type.SIR:
+        return RealDataSeirTimesGeneration.make().sample_transitions_batch(ages, rng)
+    elif sir_type == machine_type.SIRS:
+        return SIRS.make().sample_transitions_batch(ages, rng)
@@ -0,0 +1,719 @@
+from collections import Counter
+from datetime import timedelta
+from copy import deepcopy
+import logging
+import os
+
+import numpy as np
+
+from src.seir import DiseaseState, sample_seir_transitions_batch
+from src.simulation.interventions.intervention import TimedIntervention
+from src.simulation.params import Params
+from src.simulation.simulation import ORDER
+from src.logs import Statistics, DayStatistics
+from src.util import seed
+from src.util.Enumerations import machine_type
+from src.world import ArrayWorld, PopulationCounters, RedactedPerson, RedactedPersonAndEnv
+
+
+log = logging.getLogger(__name__)
+
+_NUM_STATE_VALUES = DiseaseState.IMMUNE.value + 1
+# Lookup tables from DiseaseState values (0 is not a state) to their properties
+_STATE_IS_INFECTED = np.array([v > 0 and DiseaseState(v).is_infected() for v in range(_NUM_STATE_VALUES)])
+_STATE_IS_INFECTIOUS = np.array([v > 0 and DiseaseState(v).is_infectious() for v in range(_NUM_STATE_VALUES)])
+_NO_STATE = -1
+
+
+def compute_routine_changes(arrays, intervention, people, rng):
+    """
+    Compute the routine changes of the given intervention on all the complying people,
+    the same way TimedIntervention.generate_events does
+    :param arrays: the ArrayWorld of the people
+    :param intervention: TimedIntervention object
+    :param people: list of the Person objects, by their rows in the arrays
+    :param rng: numpy Generator of the compliance draws (see seed.sub_sequence)
+    :return: tuple of numpy arrays (members, values) of the changed member entries and their new routine values
+    """
+    if not isinstance(intervention, TimedIntervention):
+        raise NotImplementedError(
+            "ArraySimulation does not support interventions of type {}".format(type(intervention).__name__)
+        )
+    members, values = [], []
+    for row, person in enumerate(people):
+        if intervention._condition(person) and rng.random() < intervention.compliance:
+            if intervention._args is None:
+                routine_change = intervention._routine_generator(person)
+            else:
+                routine_change = intervention._routine_generator(person, intervention._args)
+            for env_name, val in routine_change.items():
+                member = arrays.member_index(row, env_name)
+                assert member >= 0, "environment '%s' isn't in the routine of person %d" % (env_name, row)
+                members.append(member)
+                values.append(val)
+    return np.array(members, dtype=np.int64), np.array(values, dtype=np.float64)
+
+
+def apply_routine_change(member_weights, change_counts, change_values, is_add, key, members, values):
+    """
+    Add or remove a routine change on the given members,
+    and recompute their weights as the product of all their active routine changes (see Person.update_routine)
+    :param member_weights: numpy float array of the routine weights of the member entries, updated in place
+    :param change_counts: dict from routine change key to the numpy array of its active count on each member
+    :param change_values: dict from routine change key to the numpy array of its value on each member
+    """
+    if key not in change_counts:
+        change_counts[key] = np.zeros(len(member_weights), dtype=np.int16)
+        change_values[key] = np.ones(len(member_weights), dtype=np.float64)
+    if is_add:
+        change_counts[key][members] += 1
+        change_values[key][members] = values
+    else:
+        assert (change_counts[key][members] > 0).all(), "Removing an inactive routine change " + key
+        change_counts[key][members] -= 1
+    weights = np.ones(len(members), dtype=np.float64)
+    for curr_key, counts in change_counts.items():
+        is_active = counts[members] > 0
+        weights[is_active] *= change_values[curr_key][members[is_active]]
+    member_weights[members] = weights
+
+
+def schedule_transitions(transitions, rows, days, new_states):
+    """
+    Save the given disease transitions in a calendar
+    :param transitions: dict from day to the list of (rows, new state values) of its transitions
+    """
+    order = np.argsort(days, kind='stable')
+    rows, days, new_states = rows[order], days[order], new_states[order]
+    unique_days, starts = np.unique(days, return_index=True)
+    ends = np.append(starts[1:], len(days))
+    for day, start, end in zip(unique_days, starts, ends):
+        transitions.setdefault(int(day), []).append((rows[start:end], new_states[start:end]))
+
+
+def write_simulation_outputs(sim, stats, name, datas_to_plot):
+    """
+    Write the output files of a finished simulation that does not hold Person objects
+    (the same files as Simulation.finish_run)
+    :param sim: the simulation object
+    :param stats: its Statistics object, marked as ended
+    :param name: str name of the run
+    :param datas_to_plot: dict of the datas to plot (see DataToPlot)
+    """
+    stats.dump('statistics.pkl')
+    for data_name, data_to_plot in datas_to_plot.items():
+        stats.plot_daily_sum(data_name, data_to_plot)
+    stats.write_summary_file('summary')
+    stats.write_summary_file('summary_long', shortened=False)
+    if stats._r0_data:
+        stats.plot_r0_data('r0_data_' + name)
+    stats.write_params()
+    stats.write_daily_delta('daily_delta')
+    stats.write_inputs(sim)
+    stats.write_interventions_inputs_csv()
+
+
+class ArraySimulation(object):
+    """
+    An alternative to Simulation, which holds the state of all the people in numpy arrays (see ArrayWorld)
+    instead of Person objects, environment dicts and events.
+    The disease transitions are kept in a calendar of numpy arrays, and the infection is propagated
+    in all the environments together with vectorized draws, following the same model as
+    HomogeneousEnvironment.propagate_infection.
+    It reads the same params and produces the same Statistics as Simulation.
+
+    The per-person state arrays have a replicate dimension, flattened replicate-major:
+    the row of person i of replicate r is r * num_people + i, and the index of environment e of replicate r
+    is r * num_envs + e, while the ArrayWorld (the people, environments, memberships and routine weights)
+    is shared by all the replicates. A plain ArraySimulation has a single replicate,
+    see ReplicatedArraySimulation for running several.
+    Each replicate draws from its own random stream (see seed.py), so the results of a replicate
+    do not depend on the other replicates that run with it.
+
+    Currently supports TimedIntervention interventions (their routine changes are computed once at init),
+    NaiveInitialInfectionParams without immunization and SmartInitialInfectionParams.
+    """
+    __slots__ = (
+        '_verbosity',
+        '_arrays',
+        '_date',
+        '_initial_date',
+        '_day',
+        '_machine_type',
+        'interventions',
+        'stats',
+        'counters',
+        '_counter_city_indices',
+        'stop_early',
+        'stop_condition',
+        'last_day_to_record_r',
+        'num_r_days',
+        'first_infectious_people',
+        'initial_infection_doc',
+        'num_days_to_run',
+        '_states',
+        '_last_states',
+        '_changed_rows',
+        '_transitions',
+        '_infection_records',
+        '_routine_changes',
+        '_routine_change_counts',
+        '_routine_change_values',
+        '_infection_envs',
+        '_transmitters',
+        '_infection_days',
+        '_num_infections',
+        '_num_replicates',
+        '_replicate_stats',
+        '_replicate_counters',
+        '_is_running',
+        '_rngs',
+        '_interventions_rng',
+    )
+
+    def __init__(self, world, initial_date, interventions=None, stop_early=None, verbosity=False,
+                 outdir=os.path.join(os.path.dirname(os.path.dirname(__file__)), 'outputs'), collect_hood_data=True,
+                 stop_condition=None, seed_sequence=None):
+        """
+        :param world: The World object that this simulation will run on (converted to an ArrayWorld)
+        :param initial_date: The starting date for the simulation
+        :param interventions: A list of the interventions applied in this simulation
+        :param stop_early: see Simulation
+        :param verbosity: Whether or not this simulation should print debug info
+        :param outdir: The path of the directory output files
+        should be written into
+        :param collect_hood_data: see Simulation
+        :param stop_condition: see Simulation
+        :param seed_sequence: numpy SeedSequence of the random stream of the simulation (see seed.seed_sequence),
+        if None it is seeded from the global numpy random generator
+        """
+        self._setup(world, initial_date, interventions, stop_early, verbosity, [outdir], collect_hood_data,
+                    stop_condition, None if seed_sequence is None else [seed_sequence])
+
+    def _setup(self, world, initial_date, interventions, stop_early, verbosity, outdirs, collect_hood_data,
+               stop_condition, seed_sequences):
+        """
+        Initialize a simulation of len(outdirs) replicates, see __init__ for the other parameters
+        :param outdirs: list of the output directories of the replicates
+        :param seed_sequences: list of the SeedSequences of the random streams of the replicates, or None
+        """
+        if interventions is None:
+            interventions = []
+        self._verbosity = verbosity
+        self._arrays = ArrayWorld.from_world(world)
+        self._date = initial_date
+        self._initial_date = deepcopy(initial_date)
+        self._day = 0
+        self._machine_type = machine_type[Params.loader()['person']['state_macine_type']]
+        self.interventions = interventions
+        self._num_replicates = len(outdirs)
+        # The stats and counters of the first replicate are the public ones, as in Simulation
+        self._replicate_stats = [Statistics(outdir, world, collect_hood_data) for outdir in outdirs]
+        self.stats = self._replicate_stats[0]
+        self.counters = PopulationCounters(world)
+        self._replicate_counters = [self.counters] + \
+            [deepcopy(self.counters) for _ in range(1, self._num_replicates)]
+        self._counter_city_indices = np.array(
+            [self.counters.city_index(city_name) for city_name in self._arrays.city_names], dtype=np.int64
+        )[self._arrays.city_codes]
+        for stats in self._replicate_stats:
+            for intervention in interventions:
+                stats.add_intervention(intervention)
+
+        people = world.all_people()
+        num_rows = self._num_replicates * self._arrays.num_people
+        self._states = np.tile(np.array([p.get_disease_state().value for p in people], dtype=np.int8),
+                               self._num_replicates)
+        self._last_states = np.tile(np.array([
+            _NO_STATE if p.get_last_state() is None else p.get_last_state().disease_state.value for p in people
+        ], dtype=np.int8), self._num_replicates)
+        self._changed_rows = [self._rows_in_all_replicates(
+            np.array([row for row, p in enumerate(people) if p._changed], dtype=np.int64)
+        )]
+        self._is_running = np.ones(self._num_replicates, dtype=bool)
+        if seed_sequences is None:
+            entropy = np.random.randint(2 ** 32, size=4, dtype=np.uint32)
+            seed_sequences = np.random.SeedSequence(entropy).spawn(self._num_replicates)
+        assert len(seed_sequences) == self._num_replicates
+        self._rngs = [np.random.default_rng(sequence) for sequence in seed_sequences]
+        # The complying people are the same in all the replicates, so they are drawn from a stream of their own
+        self._interventions_rng = np.random.default_rng(seed.sub_sequence(seed_sequences[0], 'interventions'))
+        # day -> list of (rows, new state values) of the disease transitions of that day
+        self._transitions = {}
+        # day -> list of rows of people whose infection data is dated to that day
+        self._infection_records = {}
+        self._infection_envs = np.full(num_rows, -1, dtype=np.int64)
+        self._transmitters = np.full(num_rows, -1, dtype=np.int64)
+        self._infection_days = np.full(num_rows, -1, dtype=np.int64)
+        self._num_infections = np.zeros(num_rows, dtype=np.float64)
+
+        self.stop_early = stop_early
+        self.stop_condition = stop_condition
+        self.last_day_to_record_r = None
+        self.num_r_days = None
+        if self.stop_early is not None:
+            name_stop, self.num_r_days = self.stop_early
+            self.last_day_to_record_r = initial_date + timedelta(days=self.num_r_days)
+            assert name_stop == "r", "Other premature stops are not yet supported"
+        self.first_infectious_people = np.zeros(num_rows, dtype=bool)
+
+        self.initial_infection_doc = None
+        self.num_days_to_run = None
+
+        # day -> list of (is_add, key, members, values) of the routine changes of that day
+        self._routine_changes = {}
+        self._routine_change_counts = {}
+        self._routine_change_values = {}
+        for intervention in self.interventions:
+            self._register_intervention(intervention, people)
+
+    def _day_of(self, date):
+        return (date - self._initial_date).days
+
+    def _replicate_rows(self, replicate):
+        """
+        :return: slice of the rows of the given replicate
+        """
+        num_people = self._arrays.num_people
+        return slice(replicate * num_people, (replicate + 1) * num_people)
+
+    def _rows_in_all_replicates(self, rows):
+        """
+        :param rows: numpy int array of person indices in the ArrayWorld
+        :return: numpy int array of the rows of these people in all the replicates, by replicate
+        """
+        return (np.arange(self._num_replicates)[:, None] * self._arrays.num_people + rows).ravel()
+
+    def _random(self, replicates):
+        """
+        :param replicates: numpy int array of the replicates of the draws, sorted
+        :return: numpy float array of uniform draws in [0, 1), each from the random stream of its replicate
+        """
+        draws = np.empty(len(replicates), dtype=np.float64)
+        bounds = np.searchsorted(replicates, np.arange(self._num_replicates + 1))
+        for replicate in np.flatnonzero(bounds[1:] > bounds[:-1]):
+            draws[bounds[replicate]:bounds[replicate + 1]] = \
+                self._rngs[replicate].random(bounds[replicate + 1] - bounds[replicate])
+        return draws
+
+    def _members_of_rows(self, rows):
+        """
+        :param rows: numpy int array of rows
+        :return: tuple of numpy int arrays (members, people, envs) of the member entries of the given rows,
+        where members index the (shared) member arrays of the ArrayWorld,
+        and people and envs are the rows and environment indices of the entries in their replicates
+        """
+        arrays = self._arrays
+        replicates, people = np.divmod(rows, arrays.num_people)
+        members = arrays.members_of_people(people)
+        replicates = np.repeat(replicates, arrays.person_ptr[people + 1] - arrays.person_ptr[people])
+        return members, arrays.member_people[members] + replicates * arrays.num_people, \
+            arrays.member_envs[members] + replicates * arrays.num_envs
+
+    def _members_of_environments(self, envs):
+        """
+        :param envs: numpy int array of environment indices (of all the replicates)
+        :return: tuple of numpy int arrays (members, people, envs) of the member entries of the given environments,
+        ordered by environment, see _members_of_rows
+        """
+        arrays = self._arrays
+        replicates, world_envs = np.divmod(envs, arrays.num_envs)
+        members = arrays.members_of_environments(world_envs)
+        replicates = np.repeat(replicates, arrays.env_ptr[world_envs + 1] - arrays.env_ptr[world_envs])
+        return members, arrays.member_people[members] + replicates * arrays.num_people, \
+            arrays.member_envs[members] + replicates * arrays.num_envs
+
+    def _register_intervention(self, intervention, people):
+        """
+        Compute the routine changes of the given intervention on all the complying people,
+        and save them on the start and end days of the intervention.
+        """
+        members, values = compute_routine_changes(self._arrays, intervention, people, self._interventions_rng)
+        self._routine_changes.setdefault(self._day_of(intervention.start_date), []).append(
+            (True, intervention._key, members, values)
+        )
+        self._routine_changes.setdefault(self._day_of(intervention.end_date), []).append(
+            (False, intervention._key, members, None)
+        )
+
+    def _apply_routine_change(self, is_add, key, members, values):
+        apply_routine_change(
+            self._arrays.member_weights, self._routine_change_counts, self._routine_change_values,
+            is_add, key, members, values
+        )
+
+    def _schedule_transitions(self, rows, days, new_states):
+        schedule_transitions(self._transitions, rows, days, new_states)
+
+    def _infect(self, rows, envs, transmitters):
+        """
+        Infect the given (susceptible) people and schedule their disease transitions
+        :param rows: numpy int array of people, sorted by replicate
+        :param envs: the environment index in the ArrayWorld (or array of indices) where they got infected
+        :param transmitters: the row (or array of rows) of the people who infected them, -1 if none
+        """
+        if len(rows) == 0:
+            return
+        assert (self._states[rows] == DiseaseState.SUSCEPTIBLE.value).all()
+        self._states[rows] = DiseaseState.LATENT.value
+        self._changed_rows.append(rows)
+        self._infection_envs[rows] = envs
+        self._transmitters[rows] = transmitters
+        num_people = self._arrays.num_people
+        bounds = np.searchsorted(rows, np.arange(self._num_replicates + 1) * num_people)
+        for replicate in np.flatnonzero(bounds[1:] > bounds[:-1]):
+            replicate_rows = rows[bounds[replicate]:bounds[replicate + 1]]
+            latent_days, transition_rows, days, new_states = sample_seir_transitions_batch(
+                self._machine_type, self._arrays.ages[replicate_rows % num_people].astype(np.int64),
+                self._rngs[replicate]
+            )
+            self._schedule_transitions(replicate_rows[transition_rows], self._day + days, new_states)
+            self._infection_days[replicate_rows] = self._day + latent_days
+            for day in np.unique(latent_days):
+                self._infection_records.setdefault(self._day + int(day), []).append(
+                    replicate_rows[latent_days == day]
+                )
+
+    def _apply_transitions(self, day):
+        for rows, new_states in self._transitions.pop(day, []):
+            self._states[rows] = new_states
+            self._changed_rows.append(rows)
+
+    def _propagate_infection(self):
+        """
+        Simulate the contacts in all the environments with infectious people,
+        with the same model as HomogeneousEnvironment.propagate_infection
+        (the weights of the infection sources, the infection draws and the choice of each infection's source
+        are all done in vectorized batches, of all the running replicates together)
+        """
+        arrays = self._arrays
+        num_rows = self._num_replicates * arrays.num_people
+        infectious = np.flatnonzero(_STATE_IS_INFECTIOUS[self._states])
+        infectious = infectious[self._is_running[infectious // arrays.num_people]]
+        if len(infectious) == 0:
+            return
+        source_members, source_people, source_envs = self._members_of_rows(infectious)
+        source_weights = arrays.infectiousness_probs[source_people % arrays.num_people] * \
+            np.array(DiseaseState.infectiousness_list)[self._states[source_people]] * \
+            arrays.member_weights[source_members]
+        total_weights = np.bincount(
+            source_envs, weights=source_weights, minlength=self._num_replicates * arrays.num_envs
+        )
+        active_envs = np.flatnonzero(total_weights > 0)
+        if len(active_envs) == 0:
+            return
+
+        members, people, envs = self._members_of_environments(active_envs)
+        is_candidate = (self._states[people] == DiseaseState.SUSCEPTIBLE.value) & (arrays.member_weights[members] > 0)
+        members, people, envs = members[is_candidate], people[is_candidate], envs[is_candidate]
+        infection_probs = -np.expm1(
+            -arrays.contact_probs[envs % arrays.num_envs] * total_weights[envs] * arrays.member_weights[members]
+        )
+        is_infected = self._random(people // arrays.num_people) < infection_probs
+        people, envs = people[is_infected], envs[is_infected]
+        # A person may only be infected once, in the first environment (by index) that infected him
+        infected, first = np.unique(people, return_index=True)
+        if len(infected) == 0:
+            return
+        infection_envs = envs[first]
+
+        # Sample the infection source of each infection, in proportion to the weights in its environment
+        order = np.argsort(source_envs, kind='stable')
+        sorted_envs = source_envs[order]
+        cumulative_weights = np.cumsum(source_weights[order])
+        env_starts = np.searchsorted(sorted_envs, infection_envs, side='left')
+        env_ends = np.searchsorted(sorted_envs, infection_envs, side='right')
+        base_weights = np.where(env_starts > 0, cumulative_weights[np.maximum(env_starts - 1, 0)], 0.0)
+        targets = base_weights + self._random(infected // arrays.num_people) * total_weights[infection_envs]
+        positions = np.clip(np.searchsorted(cumulative_weights, targets, side='right'), env_starts, env_ends - 1)
+        transmitters = source_people[order[positions]]
+
+        num_infections_per_env = np.bincount(infection_envs, minlength=len(total_weights))
+        has_infections = num_infections_per_env[source_envs] > 0
+        self._num_infections += np.bincount(
+            source_people[has_infections],
+            weights=source_weights[has_infections] * num_infections_per_env[source_envs[has_infections]] /
+            total_weights[source_envs[has_infections]],
+            minlength=num_rows
+        )
+        self._infect(infected, infection_envs % arrays.num_envs, transmitters)
+
+    def _make_day_statistics(self, changed, infected_today):
+        """
+        Make today's DayStatistics of a replicate from its people that changed today
+        :param changed: numpy int array of rows
+        :param infected_today: numpy int array of the rows whose infection data is dated to today
+        """
+        num_people = self._arrays.num_people
+        ages = self._arrays.ages[changed % num_people].astype(np.int64)
+        person_count = Counter()
+        codes, counts = np.unique(ages * _NUM_STATE_VALUES + self._states[changed], return_counts=True)
+        for code, count in zip(codes, counts):
+            person_count[RedactedPerson(int(code // _NUM_STATE_VALUES), DiseaseState(int(code % _NUM_STATE_VALUES)))] \
+                += int(count)
+        last_states = self._last_states[changed]
+        had_state = last_states != _NO_STATE
+        codes, counts = np.unique(ages[had_state] * _NUM_STATE_VALUES + last_states[had_state], return_counts=True)
+        for code, count in zip(codes, counts):
+            person_count[RedactedPerson(int(code // _NUM_STATE_VALUES), DiseaseState(int(code % _NUM_STATE_VALUES)))] \
+                -= int(count)
+
+        infected_today_stats = []
+        arrays = self._arrays
+        for row in infected_today:
+            env = self._infection_envs[row]
+            transmitter = self._transmitters[row]
+            infected_today_stats.append({
+                "infection_env_short": arrays.env_names[arrays.env_name_codes[env]],
+                "infection_env_long": arrays.env_full_names[arrays.env_full_name_codes[env]],
+                "infected_age": int(arrays.ages[row % num_people]),
+                "infector_age": None if transmitter < 0 else int(arrays.ages[transmitter % num_people]),
+                "infector_disease_state": None if transmitter < 0 else DiseaseState(int(self._states[transmitter]))
+            })
+        return DayStatistics.from_counts(self._date, person_count, infected_today_stats)
+
+    def _hood_deltas(self, changed):
+        """
+        :param changed: numpy int array of the rows of a replicate that changed today
+        :return: dict from neighborhood id to the change in its number of infected people today
+        """
+        hoods = self._arrays.hood_ids[changed % self._arrays.num_people]
+        last_states = self._last_states[changed]
+        deltas = _STATE_IS_INFECTED[self._states[changed]].astype(np.int64) - \
+            np.where(last_states == _NO_STATE, False, _STATE_IS_INFECTED[last_states]).astype(np.int64)
+        is_relevant = (hoods >= 0) & (deltas != 0)
+        unique_hoods, inverse = np.unique(hoods[is_relevant], return_inverse=True)
+        sums = np.bincount(inverse, weights=deltas[is_relevant], minlength=len(unique_hoods))
+        return {int(hood): int(delta) for hood, delta in zip(unique_hoods, sums) if delta != 0}
+
+    def simulate_day(self):
+        """
+        Simulate one day of the simulation, in the same steps as Simulation.simulate_day:
+        1. Apply the day's routine changes and disease transitions
+        2. spread the infection throughout the environments
+        3. register the changes to the Statistics object of each running replicate
+        """
+        for is_add, key, members, values in self._routine_changes.pop(self._day, []):
+            self._apply_routine_change(is_add, key, members, values)
+        self._apply_transitions(self._day)
+
+        self._propagate_infection()
+
+        num_people = self._arrays.num_people
+        changed = np.unique(np.concatenate(self._changed_rows)) if self._changed_rows else np.zeros(0, dtype=np.int64)
+        changed = changed[self._is_running[changed // num_people]]
+        records = self._infection_records.pop(self._day, [])
+        records = np.concatenate(records) if records else np.zeros(0, dtype=np.int64)
+        bounds = np.searchsorted(changed, np.arange(self._num_replicates + 1) * num_people)
+        if self._verbosity and self._date.weekday() == 6:
+            log.info("------ day-{}: disease state ------------".format(self._date))
+        for replicate in np.flatnonzero(self._is_running):
+            replicate_changed = changed[bounds[replicate]:bounds[replicate + 1]]
+            counters = self._replicate_counters[replicate]
+            counters.update_from_arrays(
+                self._last_states[replicate_changed].astype(np.int64), self._states[replicate_changed].astype(np.int64),
+                self._arrays.ages[replicate_changed % num_people],
+                self._counter_city_indices[replicate_changed % num_people]
+            )
+            counters.end_day()
+            if self._verbosity and self._date.weekday() == 6:
+                log.info(counters.state_counts())
+
+            daily_data = self._make_day_statistics(replicate_changed, records[records // num_people == replicate])
+            self._replicate_stats[replicate].add_daily_data_from_hood_deltas(
+                daily_data, self._hood_deltas(replicate_changed)
+            )
+        self._last_states[changed] = self._states[changed]
+        self._changed_rows = []
+
+        if self.last_day_to_record_r is not None and self._date <= self.last_day_to_record_r:
+            self.first_infectious_people[changed[_STATE_IS_INFECTED[self._states[changed]]]] = True
+        self._date += timedelta(days=1)
+        self._day += 1
+
+    def infect_random_set(self, num_infected: int, infection_doc: str, per_to_immune=0.0, Immune_compliance: float = 1,
+                          order: ORDER = ORDER.NONE, city_name=None, min_age=0, people_per_day=1):
+        """
+        Infect a uniformly random initial set of susceptible people (see Simulation.infect_random_set)
+        Immunization is not supported yet.
+        Each replicate draws its own initial set.
+        """
+        assert isinstance(num_infected, int)
+        assert self.initial_infection_doc is None
+        if per_to_immune:
+            raise NotImplementedError("ArraySimulation does not support immunization")
+        self.initial_infection_doc = infection_doc
+        for replicate in range(self._num_replicates):
+            is_candidate = self._states[self._replicate_rows(replicate)] == DiseaseState.SUSCEPTIBLE.value
+            if city_name is not None:
+                is_candidate &= self._arrays.city_codes == self._arrays.city_names.index(city_name)
+            candidates = np.flatnonzero(is_candidate) + replicate * self._arrays.num_people
+            rows = self._rngs[replicate].choice(candidates, min(num_infected, len(candidates)), replace=False)
+            self._infect(np.sort(rows), self._arrays.initial_group_index, -1)
+
+    def infect_chosen_set(self, infection_datas, infection_doc):
+        """
+        Infect a chosen and specific set of people, with given seir times (see Simulation.infect_chosen_set),
+        the same people in all the replicates
+        :param infection_datas: list of (id, date, seir_times) for each person to infect
+        :param infection_doc: str to doc the infection for inputs file
+        """
+        assert self.initial_infection_doc is None
+        self.initial_infection_doc = infection_doc
+        id_to_row = {person_id: row for row, person_id in enumerate(self._arrays.person_ids)}
+        rows, days, new_states = [], [], []
+        infected = []
+        for person_id, infection_date, seir_times in infection_datas:
+            row = id_to_row[person_id]
+            infected.append(row)
+            day = self._day_of(infection_date)
+            for i in range(1, len(seir_times)):
+                day += seir_times[i - 1][1].days
+                rows.append(row)
+                days.append(day)
+                new_states.append(seir_times[i][0].value)
+        infected = self._rows_in_all_replicates(np.array(infected, dtype=np.int64))
+        self._states[infected] = DiseaseState.LATENT.value
+        self._changed_rows.append(infected)
+        self._infection_envs[infected] = self._arrays.initial_group_index
+        self._schedule_transitions(
+            self._rows_in_all_replicates(np.array(rows, dtype=np.int64)),
+            np.tile(np.array(days, dtype=np.int64), self._num_replicates),
+            np.tile(np.array(new_states, dtype=np.int8), self._num_replicates)
+        )
+        for day in sorted(self._transitions.keys()):
+            if day < self._day:
+                self._apply_transitions(day)
+
+    def first_people_are_done(self, replicate=0):
+        """
+        see Simulation.first_people_are_done
+        """
+        if self.stop_early is None:
+            return False
+        rows = self._replicate_rows(replicate)
+        return not _STATE_IS_INFECTED[self._states[rows][self.first_infectious_people[rows]]].any()
+
+    def should_stop(self, replicate=0):
+        """
+        see Simulation.should_stop
+        """
+        return self.stop_condition is not None and bool(self.stop_condition(self._replicate_counters[replicate]))
+
+    def _final_state(self, replicate=0):
+        """
+        :return: Counter of RedactedPersonAndEnv of all the people of the replicate (see Statistics.mark_ending)
+        """
+        arrays = self._arrays
+        rows = self._replicate_rows(replicate)
+        infection_envs = self._infection_envs[rows]
+        env_codes = np.where(infection_envs >= 0, arrays.env_full_name_codes[np.maximum(infection_envs, 0)] + 1, 0)
+        num_env_codes = len(arrays.env_full_names) + 1
+        codes, counts = np.unique(
+            (arrays.ages.astype(np.int64) * _NUM_STATE_VALUES + self._states[rows]) * num_env_codes + env_codes,
+            return_counts=True
+        )
+        final_state = Counter()
+        for code, count in zip(codes, counts):
+            env_code = int(code % num_env_codes)
+            age_and_state = int(code // num_env_codes)
+            final_state[RedactedPersonAndEnv(
+                age_and_state // _NUM_STATE_VALUES,
+                DiseaseState(age_and_state % _NUM_STATE_VALUES),
+                arrays.env_full_names[env_code - 1] if env_code > 0 else None
+            )] = int(count)
+        return final_state
+
+    def run_simulation(self, num_days, name, datas_to_plot=None, run_simulation=None, extensionsList=None):
+        """
+        The main loop of the simulation, see Simulation.run_simulation
+        Extensions are not supported, since they work on Person objects.
+        """
+        self._run(num_days, [name], datas_to_plot, extensionsList)
+
+    def _run(self, num_days, names, datas_to_plot, extensionsList):
+        """
+        Run all the replicates until each of them stops, and write the outputs of each replicate once it stops
+        :param names: list of the names of the replicates' runs
+        """
+        assert self.num_days_to_run is None
+        assert len(names) == self._num_replicates
+        if extensionsList:
+            raise NotImplementedError("ArraySimulation does not support extensions")
+        self.num_days_to_run = num_days
+        if datas_to_plot is None:
+            datas_to_plot = dict()
+        for name in names:
+            log.info("Starting simulation " + name)
+
+        for day in range(num_days):
+            self.simulate_day()
+            for replicate in np.flatnonzero(self._is_running):
+                if self._replicate_stats[replicate].is_static() or self.first_people_are_done(replicate) or \
+                        self.should_stop(replicate):
+                    if self._verbosity:
+                        log.info('simulation {} stopping after {} days'.format(names[replicate], day))
+                    self._finish_replicate(replicate, names[replicate], datas_to_plot)
+            if not self._is_running.any():
+                break
+        for replicate in np.flatnonzero(self._is_running):
+            self._finish_replicate(replicate, names[replicate], datas_to_plot)
+
+    def _finish_replicate(self, replicate, name, datas_to_plot):
+        """
+        Stop simulating the given replicate, and write its outputs
+        """
+        self._is_running[replicate] = False
+        stats = self._replicate_stats[replicate]
+        rows = self._replicate_rows(replicate)
+        transmitters = self._transmitters[rows]
+        stats.mark_ending_from_counts(self._final_state(replicate))
+        stats.calc_r0_data_from_arrays(
+            self._initial_date, self._infection_days[rows],
+            np.where(transmitters >= 0, transmitters - rows.start, -1), self._num_infections[rows], self.num_r_days
+        )
+        write_simulation_outputs(self, stats, name, datas_to_plot)
+
+
+class ReplicatedArraySimulation(ArraySimulation):
+    """
+    Runs several independent replicates of the same ArraySimulation in one pass,
+    as the replicate dimension of the per-person state arrays (see ArraySimulation),
+    so the infection of all the replicates is propagated together in the same vectorized batches.
+    The replicates share the world, the interventions (including which people comply with them)
+    and the initial infection parameters, and differ only in their disease states and random draws.
+    Each replicate writes its own Statistics and outputs into its own output directory, like separate runs.
+    The initial set of a random infection is drawn for each replicate,
+    while a chosen set (see SmartInitialInfectionParams) is the same in all the replicates.
+    """
+    __slots__ = ()
+
+    def __init__(self, world, initial_date, outdirs, interventions=None, stop_early=None, verbosity=False,
+                 collect_hood_data=True, stop_condition=None, seed_sequences=None):
+        """
+        :param outdirs: list of the output directories of the replicates, one for each replicate
+        :param seed_sequences: list of the numpy SeedSequences of the random streams of the replicates,
+        one for each replicate (see seed.seed_sequence), if None they are seeded from the global numpy random generator
+        See ArraySimulation for the other parameters, the stop conditions apply to each replicate separately
+        """
+        assert len(outdirs) > 0
+        self._setup(world, initial_date, interventions, stop_early, verbosity, list(outdirs), collect_hood_data,
+                    stop_condition, seed_sequences)
+
+    @property
+    def num_replicates(self):
+        return self._num_replicates
+
+    @property
+    def replicate_stats(self):
+        """
+        :return: list of the Statistics objects of the replicates
+        """
+        return list(self._replicate_stats)
+
+    def run_simulation(self, num_days, names, datas_to_plot=None, run_simulation=None, extensionsList=None):
+        """
+        Run all the replicates, see ArraySimulation.run_simulation
+        :param names: list of the names of the replicates' runs, one for each replicate
+        """
+        self._run(num_days, names, datas_to_plot, extensionsList)
@@ -0,0 +1,178 @@
+import copyreg
+from contextlib import contextmanager
+import gc
+import io
+from operator import attrgetter
+import os
+import pickle
+
+from src.world import Person
+
+
+class _Unset(object):
+    """
+    Marks a Person slot without a value in the pickled states (pickled by reference, so it keeps its identity)
+    """
+    pass
+
+
+def _load_person(person_id):
+    """
+    Placeholder for the pickled people references, resolved by _CheckpointUnpickler.find_class
+    """
+    raise RuntimeError("Person references can only be loaded by load_checkpoint_file")
+
+
+class _CheckpointPickler(pickle.Pickler):
+    """
+    Pickles every Person as a reference by its id, and collects the referenced people,
+    so their states can be pickled after the object that references them (see dump_checkpoint).
+    Pickling the people directly recurses through the whole social graph
+    (person -> environment -> the people signed up to it -> ...) and exceeds the recursion limit,
+    while the people's states are shallow when the other people in them are references.
+    The references are made by the dispatch table, so the other objects are pickled without python callbacks.
+    """
+
+    def __init__(self, file):
+        super(_CheckpointPickler, self).__init__(file, protocol=pickle.HIGHEST_PROTOCOL)
+        self.people = {}
+        self.dispatch_table = copyreg.dispatch_table.copy()
+        self.dispatch_table[Person] = self._reduce_person
+
+    def _reduce_person(self, person):
+        self.people[person._id] = person
+        return _load_person, (person._id,)
+
+
+class _CheckpointUnpickler(pickle.Unpickler):
+    """
+    Resolves the people references of _CheckpointPickler to empty Person objects,
+    which are filled once their states are loaded (see load_checkpoint_file)
+    """
+
+    def __init__(self, file):
+        super(_CheckpointUnpickler, self).__init__(file)
+        self.people = {}
+
+    def find_class(self, module, name):
+        if module == __name__ and name == _load_person.__name__:
+            return self.get_person
+        return super(_CheckpointUnpickler, self).find_class(module, name)
+
+    def get_person(self, person_id):
+        person = self.people.get(person_id)
+        if person is None:
+            person = self.people[person_id] = Person.__new__(Person)
+            # The id is set first, since the person is hashed by it when it's put in dicts and sets
+            person._id = person_id
+        return person
+
+
+_get_person_state = attrgetter(*Person.__slots__)
+
+
+def _person_state(person):
+    try:
+        return _get_person_state(person)
+    except AttributeError:
+        return tuple(getattr(person, name, _Unset) for name in Person.__slots__)
+
+
+def _people_states(people):
+    return [(person._id, _person_state(person)) for person in people]
+
+
+def _set_people_states(unpickler, people_states):
+    for person_id, state in people_states:
+        person = unpickler.get_person(person_id)
+        for name, value in zip(Person.__slots__, state):
+            if value is not _Unset:
+                setattr(person, name, value)
+
+
+@contextmanager
+def _gc_paused():
+    """
+    Pause the garbage collector, which otherwise scans the whole (large) heap again and again
+    while the many small objects of a checkpoint are created
+    """
+    was_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        yield
+    finally:
+        if was_enabled:
+            gc.enable()
+
+
+def _dump(checkpoint, f, people):
+    pickler = _CheckpointPickler(f)
+    people = list(people)
+    dumped_ids = set(person._id for person in people)
+    pickler.dump(_people_states(people))
+    pickler.dump(checkpoint)
+    while len(dumped_ids) < len(pickler.people):
+        batch = [person for person_id, person in list(pickler.people.items()) if person_id not in dumped_ids]
+        dumped_ids.update(person._id for person in batch)
+        pickler.dump(_people_states(batch))
+    pickler.dump(None)
+
+
+def _load(f):
+    unpickler = _CheckpointUnpickler(f)
+    _set_people_states(unpickler, unpickler.load())
+    checkpoint = unpickler.load()
+    people_states = unpickler.load()
+    while people_states is not None:
+        _set_people_states(unpickler, people_states)
+        people_states = unpickler.load()
+    return checkpoint
+
+
+def dump_checkpoint(checkpoint, path, people=()):
+    """
+    Pickle an object graph that holds Person objects into a file.
+    The states of the given people are pickled first (so they are loaded before the objects that use them,
+    like a World, see World.__setstate__), then the object, and then the states of the other people it references
+    in batches, until no new people are referenced.
+    The file is written with the highest pickle protocol and then moved into place,
+    so a crash while writing it never destroys the previous file.
+    :param checkpoint: picklable object
+    :param path: str path of the file
+    :param people: iterable of Person objects to pickle before the object
+    """
+    tmp_path = path + '.tmp'
+    with _gc_paused(), open(tmp_path, 'wb') as f:
+        _dump(checkpoint, f, people)
+    os.replace(tmp_path, path)
+
+
+def load_checkpoint_file(path):
+    """
+    Load an object that was saved by dump_checkpoint
+    :param path: str path of the file
+    :return: the saved object
+    """
+    with _gc_paused(), open(path, 'rb') as f:
+        return _load(f)
+
+
+def dumps_checkpoint(checkpoint, people=()):
+    """
+    Like dump_checkpoint, but into bytes (e.g. to clone an object graph in memory)
+    :return: bytes
+    """
+    f = io.BytesIO()
+    with _gc_paused():
+        _dump(checkpoint, f, people)
+    return f.getvalue()
+
+
+def loads_checkpoint(data):
+    """
+    Load an object that was saved by dumps_checkpoint, every call makes a new copy of it
+    :param data: bytes
+    :return: the saved object
+    """
+    with _gc_paused():
+        return _load(io.BytesIO(data))
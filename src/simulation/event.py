@@ -1,4 +1,7 @@
 import datetime
+from enum import Enum
+
+import numpy as np
 
 class Trigger:
     """
@@ -168,6 +171,92 @@ class AndTrigger(MultiTrigger):
         return res
 
 
+class _ThresholdTrigger(Trigger):
+    """
+    An abstract subclass, that represents a trigger that compares the daily average of a rolling count
+    of the simulation's PopulationCounters to a threshold.
+    The counts are read from the history of the counters (see PopulationCounters.daily_entries and daily_counts),
+    so checking the trigger takes a few array reads and does not depend on the size of the population.
+    It is False until num_days days of the simulation ended.
+    """
+    __slots__ = ('states', 'threshold', 'num_days', 'city_name', 'above', '_state_values')
+
+    def __init__(self, states, threshold, num_days=1, city_name=None, above=True):
+        """
+        :param states: DiseaseState or iterable of DiseaseStates to count
+        :param threshold: float threshold of the daily average of the count
+        :param num_days: int number of the last days (that ended) to average over, e.g. 7 for a weekly average
+        :param city_name: str name of the city to count in, None for all the cities
+        :param above: True if the trigger is True when the average is above the threshold, False if below it
+        """
+        super().__init__()
+        if isinstance(states, Enum):
+            states = [states]
+        self.states = tuple(states)
+        self.threshold = threshold
+        self.num_days = num_days
+        self.city_name = city_name
+        self.above = above
+        self._state_values = np.array([state.value for state in self.states], dtype=np.int64)
+
+    def _total(self, counters):
+        """
+        Has to be implemented by each subclass
+        :param counters: PopulationCounters of the simulation
+        :return: int sum of the count over the last num_days days
+        """
+        raise NotImplementedError()
+
+    def average(self, simulation):
+        """
+        :param simulation: Simulation object
+        :return: float daily average of the count over the last num_days days, None if fewer days ended
+        """
+        counters = simulation.counters
+        if counters.num_days() < self.num_days:
+            return None
+        return self._total(counters) / self.num_days
+
+    def trigger(self, simulation):
+        """
+        returns whether the trigger's condition holds
+        :param simulation: Simulation object
+        :return: True if the average is above (or below) the threshold
+        """
+        average = self.average(simulation)
+        res = average is not None and (average > self.threshold if self.above else average < self.threshold)
+        self._is_triggered |= res
+        return res
+
+    def __repr__(self):
+        return "{}(states={}, threshold={}, num_days={}, city_name={}, above={})".format(
+            type(self).__name__, [state.name for state in self.states], self.threshold, self.num_days,
+            self.city_name, self.above
+        )
+
+
+class IncidenceTrigger(_ThresholdTrigger):
+    """
+    This trigger compares the daily number of people that entered the given states to a threshold,
+    e.g. the new infections (entries to DiseaseState.LATENT) of a city, averaged over the last 7 days.
+    """
+    __slots__ = ()
+
+    def _total(self, counters):
+        return counters.daily_entries(self._state_values, self.num_days, self.city_name)
+
+
+class PrevalenceTrigger(_ThresholdTrigger):
+    """
+    This trigger compares the daily number of people in the given states to a threshold,
+    e.g. the number of people in DiseaseState.CRITICAL at the end of the last day.
+    """
+    __slots__ = ()
+
+    def _total(self, counters):
+        return counters.daily_counts(self._state_values, self.num_days, self.city_name)
+
+
 class EmptyEffect:
     """
     Does nothing.
@@ -306,6 +395,146 @@ class RemoveRoutineChangeEnvironmentEffect:
             member.remove_routine_change(self.routine_change_key)
 
 
+class AddRoutineChangeGroupEffect:
+    """
+    An effect which adds some routine change to a fixed group of people (e.g. the complying members of an environment),
+    so a whole group takes one event instead of an event for each person
+    """
+    __slots__ = ('_people', 'routine_change_key', 'routine_change_vals')
+
+    def __init__(self, people, routine_change_key, routine_change_vals):
+        """
+        :param people: tuple of Person
+        :param routine_change_key: str The name of the routine change
+        :param routine_change_vals: tuple of the routine change of each of the people
+        """
+        assert len(people) == len(routine_change_vals)
+        self._people = people
+        self.routine_change_key = routine_change_key
+        self.routine_change_vals = routine_change_vals
+
+    def apply(self, simulation):
+        key = self.routine_change_key
+        for person, routine_change_val in zip(self._people, self.routine_change_vals):
+            person.add_routine_change(key, routine_change_val)
+
+
+class RemoveRoutineChangeGroupEffect:
+    """
+    An effect which removes some routine change from a fixed group of people
+    """
+    __slots__ = ('_people', 'routine_change_key')
+
+    def __init__(self, people, routine_change_key):
+        self._people = people
+        self.routine_change_key = routine_change_key
+
+    def apply(self, simulation):
+        for person in self._people:
+            person.remove_routine_change(self.routine_change_key)
+
+
+class PeriodicRoutineChangeEffect:
+    """
+    An effect which toggles a routine change of a fixed group of people on and off periodically:
+    the change is off during [phase_start + i * cycle, phase_start + i * cycle + off_duration) for every i >= 0,
+    and on the rest of the time until end_date.
+    Each application toggles the change and registers the effect again on the date of the next toggle,
+    so only one pending event is kept for the group however long the schedule is.
+    The first application should be on a date when the change is on (see first_on_date).
+    """
+    __slots__ = (
+        '_people', 'routine_change_key', 'routine_change_vals',
+        '_phase_start', '_off_duration', '_cycle', '_end_date', '_is_on'
+    )
+
+    def __init__(self, people, routine_change_key, routine_change_vals, phase_start, off_duration, cycle, end_date):
+        """
+        :param people: tuple of Person
+        :param routine_change_key: str The name of the routine change
+        :param routine_change_vals: tuple of the routine change of each of the people
+        :param phase_start: datetime.date of the start of the first period that the change is off
+        :param off_duration: timedelta of the periods that the change is off
+        :param cycle: timedelta between the starts of two periods that the change is off, longer than off_duration
+        :param end_date: datetime.date when the change is removed for good
+        """
+        assert len(people) == len(routine_change_vals)
+        assert cycle > off_duration
+        self._people = people
+        self.routine_change_key = routine_change_key
+        self.routine_change_vals = routine_change_vals
+        self._phase_start = phase_start
+        self._off_duration = off_duration
+        self._cycle = cycle
+        self._end_date = end_date
+        self._is_on = False
+
+    def first_on_date(self, start_date):
+        """
+        :param start_date: datetime.date from which the schedule applies
+        :return: datetime.date of the first date from start_date on when the change is on
+        """
+        offset = (start_date - self._phase_start) % self._cycle
+        if start_date >= self._phase_start and offset < self._off_duration:
+            return start_date + self._off_duration - offset
+        return start_date
+
+    def apply(self, simulation):
+        today = simulation._date
+        key = self.routine_change_key
+        if not self._is_on:
+            for person, routine_change_val in zip(self._people, self.routine_change_vals):
+                person.add_routine_change(key, routine_change_val)
+            self._is_on = True
+            if today < self._phase_start:
+                next_date = self._phase_start
+            else:
+                next_date = self._phase_start + ((today - self._phase_start) // self._cycle + 1) * self._cycle
+            next_date = min(next_date, self._end_date)
+        else:
+            for person in self._people:
+                person.remove_routine_change(key)
+            self._is_on = False
+            next_date = today + self._off_duration
+            if next_date >= self._end_date:
+                return
+        simulation.register_event_on_day(Event(effect=self), next_date)
+
+
+class AddActivityMultiplierEffect:
+    """
+    An effect which multiplies the activity of a whole environment (see HomogeneousEnvironment.add_activity_multiplier)
+    """
+    __slots__ = ('_environment', 'key', 'multiplier')
+
+    def __init__(self, environment, key, multiplier):
+        """
+        :param environment: HomogeneousEnvironment
+        :param key: str key of the multiplier
+        :param multiplier: float multiplier of the activity
+        """
+        self._environment = environment
+        self.key = key
+        self.multiplier = multiplier
+
+    def apply(self, simulation):
+        self._environment.add_activity_multiplier(self.key, self.multiplier)
+
+
+class RemoveActivityMultiplierEffect:
+    """
+    An effect which removes an activity multiplier from an environment
+    """
+    __slots__ = ('_environment', 'key')
+
+    def __init__(self, environment, key):
+        self._environment = environment
+        self.key = key
+
+    def apply(self, simulation):
+        self._environment.remove_activity_multiplier(self.key)
+
+
 class RemoveRoutineChangeEffect:
     """
     An effect which removes a routine change from a person
@@ -421,3 +650,92 @@ class DayEvent(Event):
             effect = EmptyEffect()
         super().__init__(DayTrigger(date), effect)
         self._date = date
+
+
+class StateChangeListener(object):
+    """
+    A listener to some changes of the disease state of every person in the simulation
+    (registered on the simulation like an event, see Simulation.register_events).
+    Unlike events that are hooked on each person in advance (see Person.hook_on_change),
+    a listener makes the events of a person only when the change happens to him,
+    so it takes time and memory proportional to the number of people that change, not to the population.
+    Each subclass implements on_state_change
+    """
+    __slots__ = ('states',)
+
+    def __init__(self, states):
+        """
+        :param states: iterable of the (old_state, new_state) tuples of DiseaseStates to listen to
+        """
+        self.states = tuple(states)
+
+    def on_state_change(self, person, old_state, new_state, simulation):
+        """
+        Called after the disease state of a person changed by one of the changes of self.states
+        :param person: Person
+        :param old_state: DiseaseState
+        :param new_state: DiseaseState
+        :param simulation: Simulation object
+        """
+        raise NotImplementedError()
+
+
+class DiseaseStateTransition(object):
+    """
+    A compact record of a scheduled change of a person's disease state, on a given date.
+    Unlike a DayEvent it has no trigger, effect or hooks of its own - the simulation keeps it in its TransitionQueue,
+    and when the date comes it applies the change with apply_disease_state_transition.
+    """
+    __slots__ = ('_date', 'person', 'old_state', 'new_state')
+
+    def __init__(self, date, person, old_state, new_state):
+        """
+        :param date: datetime.date of the change
+        :param person: Person
+        :param old_state: DiseaseState
+        :param new_state: DiseaseState
+        """
+        self._date = date
+        self.person = person
+        self.old_state = old_state
+        self.new_state = new_state
+
+    def apply(self, simulation):
+        """
+        Apply the change if the simulation is on the date of this transition (like a DayEvent)
+        :param simulation: Simulation object
+        """
+        if simulation._date == self._date:
+            apply_disease_state_transition(self.person, self.old_state, self.new_state, simulation)
+
+    def __repr__(self):
+        return "DiseaseStateTransition(date={}, person={}, {} -> {})".format(
+            self._date, self.person.get_id(), self.old_state, self.new_state
+        )
+
+
+def apply_disease_state_transition(person, old_state, new_state, simulation):
+    """
+    Change the disease state of the given person from old_state to new_state.
+    If some events are hooked on this change (see Person.hook_on_change), the change is done by applying
+    the person's state change event, so that they are applied too.
+    Then the listeners of the simulation to this change (see StateChangeListener) are notified.
+    :param person: Person
+    :param old_state: DiseaseState
+    :param new_state: DiseaseState
+    :param simulation: Simulation object
+    """
+    event = person.state_to_events.get((old_state, new_state))
+    if event is not None:
+        event.apply(simulation)
+    else:
+        assert person.get_disease_state() == old_state, (
+            str(person.get_disease_state()) +
+            " - " + str(old_state) +
+            " of id " + str(person.get_id())
+        )
+        person.set_disease_state(new_state)
+    listeners = simulation.state_change_listeners.get((old_state, new_state))
+    if listeners is not None:
+        for listener in listeners:
+            listener.on_state_change(person, old_state, new_state, simulation)
@@ -11,7 +11,13 @@ class InitialInfectionParams(object):
     def __init__(self):
         pass
 
-    def infect_simulation(self, sim, outdir):
+    def infect_simulation(self, sim, outdir, world=None):
+        """
+        :param sim: the simulation object to infect
+        :param outdir: the output directory of the simulation
+        :param world: the World of the simulation, sim._world if None
+        (the array engines do not keep their world, so it must be given for them)
+        """
         raise NotImplementedError()
 
 class InitialImmuneType(Enum):
@@ -40,7 +46,7 @@ class NaiveInitialInfectionParams(InitialInfectionParams):
         self.Immune_compliance = Immune_compliance
         self.order = order
 
-    def infect_simulation(self, sim, outdir):
+    def infect_simulation(self, sim, outdir, world=None):
         if self.immune_source == InitialImmuneType.GENERAL_POPULATION:
             sim.infect_random_set(self.num_to_infect, str(self),self.per_to_Immune,self.Immune_compliance,self.order, \
             self.city_name_to_infect,self.min_age,people_per_day = self.people_per_day)
@@ -70,9 +76,11 @@ class SmartInitialInfectionParams(InitialInfectionParams):
         self.initial_symptomatic_num_in_each_city = initial_symptomatic_num_in_each_city
         self.initial_random_set_for_mock = initial_random_set_for_mock
 
-    def infect_simulation(self, sim, outdir):
+    def infect_simulation(self, sim, outdir, world=None):
+        if world is None:
+            world = sim._world
         mock_sim = InitialStateSimulation(
-            sim._world,
+            world,
             sim._initial_date,
             None,
             verbosity=False,
@@ -80,12 +88,12 @@ class SmartInitialInfectionParams(InitialInfectionParams):
         )
         mock_sim.infect_random_set(self.initial_random_set_for_mock, "N/A", None)
         initial_infections = mock_sim.get_initial_infections(
-            {city: self.initial_symptomatic_num_in_each_city for city in sim._world.get_all_city_names()}
+            {city: self.initial_symptomatic_num_in_each_city for city in world.get_all_city_names()}
         )
-        for e in sim._world.all_environments:
+        for e in world.all_environments:
             e.clear()
 
-        sim._world.sign_all_people_up_to_environments()
+        world.sign_all_people_up_to_environments()
         sim.infect_chosen_set(initial_infections, str(self))
 
     def __str__(self):
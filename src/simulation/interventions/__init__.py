@@ -1,6 +1,9 @@
 from src.simulation.interventions.partial_environment_intervention import SchoolClosureIntervention, SchoolIsolationIntervention, AttributeAndPeriodData
+from src.simulation.interventions.adaptive_intervention import AdaptiveIntervention
+from src.simulation.interventions.vaccination_campaign import VaccinationCampaignIntervention, VaccinationPlanner
 from src.simulation.interventions.intervention import \
     CityCurfewIntervention, \
+    ContactTracingIntervention, \
     ElderlyQuarantineIntervention, \
     HouseholdIsolationIntervention, \
     ImmuneByHouseholdIntervention,\
@@ -11,8 +14,10 @@ from src.simulation.interventions.intervention import \
     WorkplaceClosureIntervention
 
 __all__ = [
+    'AdaptiveIntervention',
     'AttributeAndPeriodData',
     'CityCurfewIntervention',
+    'ContactTracingIntervention',
     'ElderlyQuarantineIntervention',
     'HouseholdIsolationIntervention',
     'ImmuneGeneralPopulationIntervention',
@@ -22,5 +27,7 @@ __all__ = [
     'SchoolIsolationIntervention',
     'SocialDistancingIntervention',
     'SymptomaticIsolationIntervention',
+    'VaccinationCampaignIntervention',
+    'VaccinationPlanner',
     'WorkplaceClosureIntervention',
 ]
@@ -0,0 +1,88 @@
+from datetime import timedelta
+from src.simulation.interventions.intervention import Intervention
+from src.simulation.event import DayEvent, Event, Trigger
+from src.world import World
+
+
+class _AdaptiveEffect:
+    """
+    An effect which checks the triggers of an AdaptiveIntervention at the start of a day,
+    turns its intervention on or off by them, and registers itself again on the next day until the end date
+    """
+    __slots__ = ('_adaptive', '_on_effects', '_off_effects', '_is_active')
+
+    def __init__(self, adaptive, on_effects, off_effects):
+        """
+        :param adaptive: AdaptiveIntervention
+        :param on_effects: list of the effects that turn the intervention on
+        :param off_effects: list of the effects that turn the intervention off
+        """
+        self._adaptive = adaptive
+        self._on_effects = on_effects
+        self._off_effects = off_effects
+        self._is_active = False
+
+    def is_active(self):
+        return self._is_active
+
+    def _set_active(self, is_active, simulation):
+        for effect in (self._on_effects if is_active else self._off_effects):
+            effect.apply(simulation)
+        self._is_active = is_active
+
+    def apply(self, simulation):
+        today = simulation._date
+        adaptive = self._adaptive
+        if today >= adaptive.end_date:
+            if self._is_active:
+                self._set_active(False, simulation)
+            return
+        if not self._is_active:
+            if adaptive.activate_trigger.trigger(simulation):
+                self._set_active(True, simulation)
+        elif adaptive.deactivate_trigger.trigger(simulation):
+            self._set_active(False, simulation)
+        simulation.register_event_on_day(Event(effect=self), today + timedelta(days=1))
+
+
+class AdaptiveIntervention(Intervention):
+    """
+    An intervention that turns another intervention on and off by the course of the epidemic,
+    e.g. a lockdown that starts when the number of critical people exceeds X, and ends when it is below Y.
+    The triggers are checked at the start of each day between the start and the end dates of the intervention,
+    on the counts of the days that ended (see IncidenceTrigger and PrevalenceTrigger),
+    by one event that registers itself again on the next day.
+    The events of the intervention are generated once: the effects of the events on its start date turn it on,
+    and the effects of the events on its end date turn it off, so it has to make only DayEvents on these dates
+    (e.g. a TimedIntervention, or a PartialEnvironmentIntervention without period_data).
+    """
+    __slots__ = ('intervention', 'activate_trigger', 'deactivate_trigger')
+
+    def __init__(self, intervention: Intervention, activate_trigger: Trigger, deactivate_trigger: Trigger):
+        """
+        :param intervention: Intervention to turn on and off, it may be active between its start and end dates
+        :param activate_trigger: Trigger that turns the intervention on (when it's off)
+        :param deactivate_trigger: Trigger that turns the intervention off (when it's on)
+        """
+        super(AdaptiveIntervention, self).__init__(intervention.compliance, intervention.start_date, intervention.duration)
+        self.intervention = intervention
+        self.activate_trigger = activate_trigger
+        self.deactivate_trigger = deactivate_trigger
+
+    def generate_events(self, world: World):
+        """
+        generates the events of the intervention, and an event that turns them on and off on the start date
+        :param world: World object
+        :return: list of Event objects
+        """
+        on_effects = []
+        off_effects = []
+        for event in self.intervention.generate_events(world):
+            assert isinstance(event, DayEvent) and not event.hooks and \
+                event._date in (self.start_date, self.end_date), \
+                "AdaptiveIntervention only supports interventions of DayEvents on their start and end dates"
+            if event._date == self.start_date:
+                on_effects.append(event.effect)
+            else:
+                off_effects.append(event.effect)
+        return [DayEvent(date=self.start_date, effect=_AdaptiveEffect(self, on_effects, off_effects))]
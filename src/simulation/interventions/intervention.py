@@ -1,50 +1,77 @@
 import inspect
 import random
 import itertools
+from collections import Counter, defaultdict, deque
 from datetime import date, timedelta
+from functools import wraps
+
+import numpy as np
 
 from src.seir import DiseaseState, seir_times
 from src.simulation.event import (
     AddRoutineChangeEffect,
-    AfterTrigger,
     AddRoutineChangeEnvironmentEffect,
-    AndTrigger,
+    AddRoutineChangeGroupEffect,
     DayEvent,
-    DelayedEffect,
     DiseaseStateChangeEffect,
     EmptyEffect,
-    EmptyTrigger,
     Event,
-    OrTrigger,
     RemoveRoutineChangeEffect,
     RemoveRoutineChangeEnvironmentEffect,
-    TimeRangeTrigger
+    RemoveRoutineChangeGroupEffect,
+    StateChangeListener
 )
 from src.simulation.params import Params
 from src.world import Person, World
+from src.world.routine_cache import ROUTINE_CACHE
 from src.world.environments.household import Household
 
-def lockdown_routine(person: Person):
+def routine_of_environments(routine_name):
+    """
+    A decorator that makes a routine generator (a function from a person to his routine change)
+    from a function of the names of the person's environments and the routine's params.
+    The routine changes are memoized by the environment names and the params (see RoutineCache.generated_change),
+    so all the people with the same environments share one immutable routine change,
+    and it is made only once instead of once for each person.
+    :param routine_name: str name of the routine in the interventions_routines params
+    """
+    def decorator(make_routine):
+        @wraps(make_routine)
+        def routine_generator(person: Person):
+            params = Params.loader()["interventions_routines"][routine_name]
+            env_names = person.get_environment_names()
+            return ROUTINE_CACHE.generated_change(
+                (routine_name, env_names, tuple(params.items())), make_routine, env_names, params
+            )
+        return routine_generator
+    return decorator
+
+
+@routine_of_environments("lockdown")
+def lockdown_routine(env_names, params):
     """
     Create a routine change that represents a person being in lockdown.
     Here we try to represent the changing (decreasing of weights) of the weight in all the environment, due to the lockdown and at home contacts increase.
-    :param person: Person
+    Called as lockdown_routine(person), see routine_of_environments
+    :param env_names: tuple of the names of the person's environments
+    :param params: the lockdown routine params
     :return: routine change dict, keys are environment names, values are weight multipliers.
     """
-    params = Params.loader()["interventions_routines"]["lockdown"]
-    return {env_name: params["all"] for env_name in person.get_routine()}
+    return {env_name: params["all"] for env_name in env_names}
 
-def workplace_closure_routine(person: Person):
+@routine_of_environments("workplace_closure")
+def workplace_closure_routine(env_names, params):
     """
     Create a routine change that represents a closure of the person's workplace.
     Here we try to represent the changing of the weight in the workplace environment as well as other environments,
     due to the closure.
-    :param person: Person
+    Called as workplace_closure_routine(person), see routine_of_environments
+    :param env_names: tuple of the names of the person's environments
+    :param params: the workplace closure routine params
     :return: routine change dict, keys are environment names, values are weight multipliers.
     """
-    params = Params.loader()["interventions_routines"]["workplace_closure"]
     routine = {}
-    for env_name in person.get_routine():
+    for env_name in env_names:
         if env_name == 'workplace':
             routine['workplace'] = params["workplace"]
         else:
@@ -52,28 +79,32 @@ def workplace_closure_routine(person: Person):
     return routine
 
 
-def quarantine_routine(person: Person):
+@routine_of_environments("quarantine")
+def quarantine_routine(env_names, params):
     """
     Create a routine change that represents a person being in quarantine.
     Here we try to represent the changing (decreasing of weights) of the weight in all the environment, due to the quarantine.
-    :param person: Person
+    Called as quarantine_routine(person), see routine_of_environments
+    :param env_names: tuple of the names of the person's environments
+    :param params: the quarantine routine params
     :return: routine change dict, keys are environment names, values are weight multipliers.
     """
-    params = Params.loader()["interventions_routines"]["quarantine"]
-    return {env_name: params["all"] for env_name in person.get_routine()}
+    return {env_name: params["all"] for env_name in env_names}
 
 
-def social_distancing_routine(person: Person):
+@routine_of_environments("social_distancing")
+def social_distancing_routine(env_names, params):
     """
     Create a routine change that represents a social distancing effect on a person routine.
     Here we try to represent the changing (decreasing/ increasing of weights) of the weight in all the environment,
     due to the closure.
-    :param person: Person
+    Called as social_distancing_routine(person), see routine_of_environments
+    :param env_names: tuple of the names of the person's environments
+    :param params: the social distancing routine params
     :return: routine change dict, keys are environment names, values are weight multipliers.
     """
-    params = Params.loader()["interventions_routines"]["social_distancing"]
     routine = {}
-    for env_name in person.get_routine():
+    for env_name in env_names:
         if env_name == 'household':
             routine['household'] = params["household"]
         elif env_name == 'workplace':
@@ -85,17 +116,19 @@ def social_distancing_routine(person: Person):
     return routine
 
 
-def household_isolation_routine(person: Person):
+@routine_of_environments("household_isolation")
+def household_isolation_routine(env_names, params):
     """
     Create a routine change that represents a person being in isolation at home.
     Here we try to represent the changing (decreasing/ increasing of weights) of the weight in all the environment,
     due to the person staying at home.
-    :param person: Person
+    Called as household_isolation_routine(person), see routine_of_environments
+    :param env_names: tuple of the names of the person's environments
+    :param params: the household isolation routine params
     :return: routine change dict, keys are environment names, values are weight multipliers.
     """
-    params = Params.loader()["interventions_routines"]["household_isolation"]
     routine = {}
-    for env_name in person.get_routine():
+    for env_name in env_names:
         if env_name == 'household':
             routine['household'] = params["household"]
         else:
@@ -114,7 +147,7 @@ def city_curfew_routine(person: Person, city_name):
     params = Params.loader()["interventions_routines"]["city_curfew"]
     routine = {}
     has_free_time = False
-    for env_name, env in person._environments.items():
+    for env_name, env in person.get_environments().items():
         if env._city is None:
             continue
         if not ((env._city.get_name() == city_name) ^ (person.get_city_name() == city_name)):
@@ -209,7 +242,9 @@ class Intervention(object):
 class TimedIntervention(Intervention):
     """
     Implementation of an intervention, that is time range based. Meaning, it happens between from some start date,
-    for example, school closure on the 1.5 for 40 days
+    for example, school closure on the 1.5 for 40 days.
+    The relevant people are selected at once by a vectorized mask (see _mask),
+    and the routine change is added to all the complying people by one event, and removed by another.
     """
     __slots__ = ('_key', '_routine_generator', '_args')
 
@@ -235,28 +270,53 @@ class TimedIntervention(Intervention):
         """
         raise NotImplementedError()
 
+    def _mask(self, columns):
+        """
+        Subclasses should override this with a vectorized mask that is equivalent to _condition
+        :param columns: PeopleColumns of the world
+        :return: numpy bool array of the people that are relevant for this intervention (by their position in columns)
+        """
+        return np.fromiter((self._condition(person) for person in columns.people), dtype=bool, count=len(columns))
+
+    def complying_rows(self, world: World):
+        """
+        Select the relevant people for this intervention, and draw which of them comply.
+        There is one draw for each relevant person by the order of the people (like ArraySimulation does),
+        so a seeded run selects the same people as before the selection was vectorized.
+        :param world: World object
+        :return: numpy int array of the positions of the complying people in world.all_people()
+        """
+        rows = np.flatnonzero(self._mask(world.get_people_columns()))
+        draws = np.fromiter((random.random() for _ in range(len(rows))), dtype=np.float64, count=len(rows))
+        return rows[draws < self.compliance]
+
     def generate_events(self, world: World):
         """
-        generated events that add the relevent routine change to the people that are relevant for this intervention,
-        and events that remove it after that given duration.
+        generated an event that adds the relevent routine change to the complying people that are relevant
+        for this intervention, and an event that removes it after that given duration.
         :param world: World object
         :return: list of Event objects
         """
-        new_events = []
-        for person in world.all_people():
-            if self._condition(person):
-                if random.random() < self.compliance:
-                    curr_events = make_routine_change_events(
-                        person,
-                        self.start_date,
-                        self.end_date,
-                        self._key,
-                        self._routine_generator,
-                        self._args
-                    )
-                    for event in curr_events:
-                        new_events.append(event)
-        return new_events
+        all_people = world.get_people_columns().people
+        people = tuple(all_people[row] for row in self.complying_rows(world))
+        if not people:
+            return []
+        if self._args is None:
+            routine_changes = tuple(self._routine_generator(person) for person in people)
+        else:
+            routine_changes = tuple(self._routine_generator(person, self._args) for person in people)
+        return [
+            DayEvent(
+                date=self.start_date,
+                effect=AddRoutineChangeGroupEffect(
+                    people=people, routine_change_key=self._key, routine_change_vals=routine_changes
+                )
+            ),
+            DayEvent(
+                date=self.end_date,
+                effect=RemoveRoutineChangeGroupEffect(people=people, routine_change_key=self._key)
+            )
+        ]
 
 
 class WorkplaceClosureIntervention(TimedIntervention):
@@ -275,6 +335,9 @@ class WorkplaceClosureIntervention(TimedIntervention):
     def _condition(self, person):
         return person.has_environment('workplace')
 
+    def _mask(self, columns):
+        return columns.has_environment('workplace')
+
 
 class SocialDistancingIntervention(TimedIntervention):
     """
@@ -292,6 +355,9 @@ class SocialDistancingIntervention(TimedIntervention):
     def _condition(self, x):
         return self.min_age <= x.get_age() <= self.max_age
 
+    def _mask(self, columns):
+        return (self.min_age <= columns.ages) & (columns.ages <= self.max_age)
+
 
 class ElderlyQuarantineIntervention(TimedIntervention):
     """
@@ -309,6 +375,9 @@ class ElderlyQuarantineIntervention(TimedIntervention):
     def _condition(self, x):
         return x.get_age() >= self._min_age
 
+    def _mask(self, columns):
+        return columns.ages >= self._min_age
+
 
 class CityCurfewIntervention(TimedIntervention):
     """
@@ -324,12 +393,17 @@ class CityCurfewIntervention(TimedIntervention):
         self.city_name = city_name
 
     def _condition(self, x):
-        if all(env._city.get_name() != self.city_name for env in x._environments.values()):
+        if all(env._city.get_name() != self.city_name for env in x.get_environments().values()):
             return False
-        if all(env._city.get_name() == self.city_name for env in x._environments.values()):
+        if all(env._city.get_name() == self.city_name for env in x.get_environments().values()):
             return False
         return True
 
+    def _mask(self, columns):
+        # Only the people with some of their environments in the city and some out of it
+        num_in_city = columns.num_environments_in_city(self.city_name)
+        return (num_in_city > 0) & (num_in_city < columns.num_environments())
+
 class LockdownIntervention(TimedIntervention):
     """
     Implementation of Lockdown where everyone are at home, going out just for necessities
@@ -344,12 +418,371 @@ class LockdownIntervention(TimedIntervention):
         self.city_name = city_name
 
     def _condition(self, x):
-        if all(env._city.get_name() != self.city_name for env in x._environments.values()):
+        if all(env._city.get_name() != self.city_name for env in x.get_environments().values()):
             return False
-        if all(env._city.get_name() == self.city_name for env in x._environments.values()):
+        if all(env._city.get_name() == self.city_name for env in x.get_environments().values()):
             return False
         return True
 
+    def _mask(self, columns):
+        # Only the people with some of their environments in the city and some out of it
+        num_in_city = columns.num_environments_in_city(self.city_name)
+        return (num_in_city > 0) & (num_in_city < columns.num_environments())
+
+
+# The disease state change of becoming symptomatic, and the changes of recovering (or dying) from the symptoms
+SYMPTOMS_STATES = (DiseaseState.INCUBATINGPOSTLATENT, DiseaseState.SYMPTOMATICINFECTIOUS)
+RECOVERY_STATES = tuple(itertools.product(
+    [DiseaseState.SYMPTOMATICINFECTIOUS, DiseaseState.CRITICAL],
+    [DiseaseState.IMMUNE, DiseaseState.DECEASED]
+))
+
+
+class _StartIsolationEffect:
+    """
+    An effect which starts the isolation of a person that an _IsolationListener scheduled
+    """
+    __slots__ = ('_listener', '_person')
+
+    def __init__(self, listener, person):
+        self._listener = listener
+        self._person = person
+
+    def apply(self, simulation):
+        self._listener.start_isolation(self._person, simulation)
+
+
+class _IsolationListener(StateChangeListener):
+    """
+    Isolates the complying people when they become symptomatic, from delay_on_enter days later,
+    if that is in the time range of the intervention (or from its start, if they became symptomatic before it).
+    When exit_on_recovery is True, the isolation of a person ends when he recovers (or dies),
+    and a person that recovers before his isolation starts is not isolated.
+    Each subclass implements _isolate and _release
+    """
+    __slots__ = ('compliance', 'start_date', 'end_date', 'delay_on_enter', '_pending', '_isolated')
+
+    def __init__(self, intervention, delay_on_enter, exit_on_recovery):
+        """
+        :param intervention: the Intervention of the compliance and the time range
+        :param delay_on_enter: timedelta from the symptoms to the isolation
+        :param exit_on_recovery: bool, whether the isolation ends when the person recovers
+        """
+        super(_IsolationListener, self).__init__(
+            (SYMPTOMS_STATES,) + (RECOVERY_STATES if exit_on_recovery else ())
+        )
+        self.compliance = intervention.compliance
+        self.start_date = intervention.start_date
+        self.end_date = intervention.end_date
+        self.delay_on_enter = delay_on_enter
+        # The people whose isolation was scheduled and did not start yet, and the people in isolation
+        self._pending = set()
+        self._isolated = set()
+
+    def on_state_change(self, person, old_state, new_state, simulation):
+        if (old_state, new_state) == SYMPTOMS_STATES:
+            if random.random() >= self.compliance:
+                return
+            isolation_date = max(simulation._date + self.delay_on_enter, self.start_date)
+            if isolation_date >= self.end_date:
+                return
+            self._pending.add(person)
+            if isolation_date == simulation._date:
+                self.start_isolation(person, simulation)
+            else:
+                simulation.register_event_on_day(Event(effect=_StartIsolationEffect(self, person)), isolation_date)
+        elif person in self._isolated:
+            self._isolated.remove(person)
+            self._release(person, simulation)
+        else:
+            self._pending.discard(person)
+
+    def start_isolation(self, person, simulation):
+        """
+        Isolate a person whose isolation was scheduled, unless he recovered since
+        :param person: Person
+        :param simulation: Simulation object
+        """
+        if person not in self._pending:
+            return
+        self._pending.remove(person)
+        self._isolated.add(person)
+        self._isolate(person, simulation)
+
+    def _isolate(self, person, simulation):
+        raise NotImplementedError()
+
+    def _release(self, person, simulation):
+        raise NotImplementedError()
+
+
+class _SymptomaticIsolationListener(_IsolationListener):
+    """
+    The listener of SymptomaticIsolationIntervention, that isolates the person himself until he recovers
+    """
+    __slots__ = ()
+
+    def __init__(self, intervention):
+        super(_SymptomaticIsolationListener, self).__init__(
+            intervention, timedelta(intervention.delay), exit_on_recovery=True
+        )
+
+    def _isolate(self, person, simulation):
+        person.add_routine_change('quarantine', quarantine_routine(person))
+
+    def _release(self, person, simulation):
+        person.remove_routine_change('quarantine')
+
+
+class _HouseholdIsolationListener(_IsolationListener):
+    """
+    The listener of HouseholdIsolationIntervention, that isolates the whole house of the person,
+    until delay_on_exit days after he recovers, or after the isolation started
+    """
+    __slots__ = ('delay_on_exit', 'is_exit_after_recovery')
+
+    def __init__(self, intervention):
+        super(_HouseholdIsolationListener, self).__init__(
+            intervention, intervention.delay_on_enter, exit_on_recovery=intervention.is_exit_after_recovery
+        )
+        self.delay_on_exit = intervention.delay_on_exit
+        self.is_exit_after_recovery = intervention.is_exit_after_recovery
+
+    def _isolate(self, person, simulation):
+        household_environment = person.get_environment('household')
+        AddRoutineChangeEnvironmentEffect(
+            environment=household_environment,
+            routine_change_key='household_isolation',
+            routine_change_generator=household_isolation_routine
+        ).apply(simulation)
+        if not self.is_exit_after_recovery:
+            # The isolation ends delay_on_exit days after it starts, whether the person recovers or not
+            self._isolated.remove(person)
+            self._release(person, simulation)
+
+    def _release(self, person, simulation):
+        remove_effect = RemoveRoutineChangeEnvironmentEffect(
+            environment=person.get_environment('household'), routine_change_key='household_isolation'
+        )
+        simulation.register_event_on_day(Event(effect=remove_effect), simulation._date + self.delay_on_exit)
+
+
+class _TraceContactsEffect:
+    """
+    An effect which continues the tracing of the cases that a _ContactTracingListener could not finish on earlier days
+    """
+    __slots__ = ('_listener',)
+
+    def __init__(self, listener):
+        self._listener = listener
+
+    def apply(self, simulation):
+        self._listener.trace_scheduled(simulation)
+
+
+class _ReleaseContactsEffect:
+    """
+    An effect which ends the quarantine of a group of contacts that a _ContactTracingListener quarantined
+    """
+    __slots__ = ('_listener', '_people')
+
+    def __init__(self, listener, people):
+        self._listener = listener
+        self._people = people
+
+    def apply(self, simulation):
+        self._listener.release(self._people, simulation)
+
+
+class _ContactTracingListener(StateChangeListener):
+    """
+    The listener of ContactTracingIntervention.
+    Each person that becomes symptomatic in the time range of the intervention is a case to trace,
+    and the members of the case's environments (of the traced environment names) are his contacts.
+    A case is kept as a cursor into his contacts: the index of his environment, and the position
+    in the members of that environment. The cursor is advanced only while the case is traced,
+    so a case costs nothing when he becomes symptomatic, and the cases are traced in turn
+    until daily_capacity contacts were traced in the day, or daily_work_limit contacts were checked in it.
+    A case that is not finished is continued on the next day from its cursor.
+    A contact that is in quarantine is not traced again, and does not take from the capacity,
+    so the capacity of a day goes only to the contacts that are actually traced,
+    but it is checked, and takes from the work limit (as does the case himself).
+    A contact that shares several environments with the case is checked in each of them.
+    The complying contacts of a day are quarantined together (by one group routine change) for quarantine_duration.
+    """
+    __slots__ = (
+        'compliance', 'start_date', 'end_date', 'daily_capacity', 'daily_work_limit', 'quarantine_duration',
+        'environment_names', '_members', '_cases', '_quarantined', '_capacity_date', '_capacity_left', '_work_left',
+        '_is_scheduled'
+    )
+
+    ROUTINE_CHANGE_KEY = 'contact_tracing'
+
+    def __init__(self, intervention, members):
+        """
+        :param intervention: ContactTracingIntervention
+        :param members: dict of the traced environments to the tuples of their members
+        """
+        super(_ContactTracingListener, self).__init__((SYMPTOMS_STATES,))
+        self.compliance = intervention.compliance
+        self.start_date = intervention.start_date
+        self.end_date = intervention.end_date
+        self.daily_capacity = intervention.daily_capacity
+        self.daily_work_limit = intervention.daily_work_limit
+        self.quarantine_duration = intervention.quarantine_duration
+        self.environment_names = frozenset(intervention.environment_names)
+        self._members = members
+        # The cases to trace, each of them as a list of
+        # [case, index in case._environments, position in the members of that environment]
+        self._cases = deque()
+        self._quarantined = set()
+        self._capacity_date = None
+        self._capacity_left = 0
+        self._work_left = 0
+        self._is_scheduled = False
+
+    def on_state_change(self, person, old_state, new_state, simulation):
+        if not (self.start_date <= simulation._date < self.end_date):
+            return
+        simulation.instrumentation.add_count('tracing_cases')
+        self._cases.append([person, 0, 0])
+        self.trace(simulation)
+
+    def trace_scheduled(self, simulation):
+        """
+        Continue the tracing on the day it was scheduled for (see _TraceContactsEffect)
+        :param simulation: Simulation object
+        """
+        self._is_scheduled = False
+        self.trace(simulation)
+
+    def trace(self, simulation):
+        """
+        Trace the contacts of the cases, up to the capacity and the work that are left for today,
+        and quarantine the complying ones
+        :param simulation: Simulation object
+        """
+        today = simulation._date
+        if today >= self.end_date:
+            self._cases.clear()
+            return
+        start = simulation.instrumentation.clock()
+        if self._capacity_date != today:
+            self._capacity_date = today
+            self._capacity_left = self.daily_capacity
+            self._work_left = self.daily_work_limit
+        traced = Counter()
+        checked = 0
+        contacts_to_quarantine = []
+        while self._cases and self._capacity_left > 0 and checked < self._work_left:
+            case = self._cases[0]
+            person, environment_index, position = case
+            if environment_index >= len(person._environments):
+                self._cases.popleft()
+                continue
+            environment = person._environments[environment_index]
+            members = self._members.get(environment, ())
+            if position >= len(members):
+                case[1] = environment_index + 1
+                case[2] = 0
+                continue
+            contact = members[position]
+            case[2] = position + 1
+            checked += 1
+            if contact is person or contact in self._quarantined:
+                continue
+            traced[environment.name] += 1
+            self._capacity_left -= 1
+            if random.random() < self.compliance:
+                self._quarantined.add(contact)
+                contacts_to_quarantine.append(contact)
+        if contacts_to_quarantine:
+            people = tuple(contacts_to_quarantine)
+            AddRoutineChangeGroupEffect(
+                people=people,
+                routine_change_key=self.ROUTINE_CHANGE_KEY,
+                routine_change_vals=tuple(quarantine_routine(contact) for contact in people)
+            ).apply(simulation)
+            simulation.register_event_on_day(
+                Event(effect=_ReleaseContactsEffect(self, people)), today + self.quarantine_duration
+            )
+        if self._cases and not self._is_scheduled:
+            self._is_scheduled = True
+            simulation.register_event_on_day(Event(effect=_TraceContactsEffect(self)), today + timedelta(days=1))
+        self._work_left -= checked
+        simulation.instrumentation.add_count('contacts_checked', checked)
+        simulation.instrumentation.add_counts_by_env('contacts_traced', traced)
+        simulation.instrumentation.add_count('contacts_quarantined', len(contacts_to_quarantine))
+        simulation.instrumentation.end_section('contact_tracing', start)
+
+    def release(self, people, simulation):
+        """
+        End the quarantine of the given contacts
+        :param people: tuple of Person
+        :param simulation: Simulation object
+        """
+        RemoveRoutineChangeGroupEffect(people=people, routine_change_key=self.ROUTINE_CHANGE_KEY).apply(simulation)
+        self._quarantined.difference_update(people)
+
+
+class ContactTracingIntervention(Intervention):
+    """
+    Implementation of contact tracing: when a person becomes symptomatic, the people of his environments
+    (his household, workplace and school by default) are traced, and the complying ones are quarantined
+    for some given time. The tracers can trace up to daily_capacity contacts a day,
+    and check up to daily_work_limit contacts a day (including the ones that are already in quarantine),
+    and the cases they could not finish wait for the next days.
+    The contacts are looked up in an index of the members of the traced environments, which is built once
+    when the events are generated, and takes a reference for each membership of a person in a traced environment.
+    The work of the tracing is recorded in the instrumentation of the simulation (when it's enabled):
+    the counts of the cases, the checked contacts, the traced contacts (by environment) and the quarantined contacts,
+    and the time of the tracing, as the 'contact_tracing' section.
+    """
+    __slots__ = ('daily_capacity', 'daily_work_limit', 'quarantine_duration', 'environment_names')
+
+    def __init__(
+            self,
+            compliance: float,
+            start_date: date,
+            duration: timedelta,
+            daily_capacity: int,
+            quarantine_duration=14,  # arbitrary
+            environment_names=('household', 'workplace', 'school'),
+            daily_work_limit=None
+    ):
+        """
+        :param compliance: float between 0 to 1, the probability of a traced contact to go into quarantine
+        :param start_date: datetime.date start date
+        :param duration: timedelta duration
+        :param daily_capacity: int maximal number of contacts to trace each day
+        :param quarantine_duration: int days of the quarantine of the contacts
+        :param environment_names: tuple of the names of the environments to trace the contacts in
+        :param daily_work_limit: int maximal number of contacts to check each day, traced or not,
+        4 times daily_capacity by default
+        """
+        super(ContactTracingIntervention, self).__init__(compliance, start_date, duration)
+        self.daily_capacity = daily_capacity
+        if daily_work_limit is None:
+            daily_work_limit = 4 * daily_capacity  # arbitrary
+        self.daily_work_limit = daily_work_limit
+        self.quarantine_duration = timedelta(quarantine_duration)
+        self.environment_names = tuple(environment_names)
+
+    def generate_events(self, world: World):
+        """
+        generate the listener that traces the contacts of the people that become symptomatic,
+        and quarantines the complying contacts
+        :param world: World object
+        :return: list of new Events to register on the simulation
+        """
+        environment_names = frozenset(self.environment_names)
+        members = defaultdict(list)
+        for person in world.all_people():
+            for environment in person._environments:
+                if environment.name in environment_names:
+                    members[environment].append(person)
+        return [_ContactTracingListener(self, {environment: tuple(people) for environment, people in members.items()})]
+
 
 class SymptomaticIsolationIntervention(Intervention):
     """
@@ -371,68 +804,13 @@ class SymptomaticIsolationIntervention(Intervention):
 
     def generate_events(self, world: World):
         """
-        generate events that are applied on the person when his state changes to symptomatic,
-        and add the isolation routine. After the given duration, an event will remove the change.
+        generate the listener that isolates the complying people when their state changes to symptomatic,
+        by adding the isolation routine. When they recover (or die) the change is removed.
+        The compliance of each person is drawn when he becomes symptomatic.
         :param world: World object
         :return: list of new Events to register on the simulation
         """
-        ret = []
-        for person in world.all_people():
-            if random.random() < self.compliance:
-                add_effect = AddRoutineChangeEffect(
-                    person=person,
-                    routine_change_key='quarantine',
-                    routine_change_val=quarantine_routine(person)
-                )
-                states = (
-                    DiseaseState.INCUBATINGPOSTLATENT,
-                    DiseaseState.SYMPTOMATICINFECTIOUS
-                )
-                person._init_event(*states)
-                entry_moment = Event()
-                add_trigger = AndTrigger(
-                    AfterTrigger(entry_moment),
-                    TimeRangeTrigger(self.start_date, self.end_date)
-                )
-                add_event = Event(
-                    add_trigger, add_effect
-                )
-                entry_moment.hook(add_event)
-                day_event = DayEvent(self.start_date)  # Wasteful in memory!
-                day_event.hook(add_event)
-                ret.append(day_event)
-                if self.delay != 0:
-                    delay_time = timedelta(self.delay)
-                    person.hook_on_change(
-                        states,
-                        Event(
-                            EmptyTrigger(),
-                            DelayedEffect(entry_moment, delay_time)
-                        )
-                    )
-                else:
-                    person.hook_on_change(states, entry_moment)
-
-                remove_effect = RemoveRoutineChangeEffect(
-                    person=person, routine_change_key='quarantine'
-                )
-                state_changes = list(itertools.product(
-                    [DiseaseState.SYMPTOMATICINFECTIOUS, DiseaseState.CRITICAL],
-                    [DiseaseState.IMMUNE, DiseaseState.DECEASED]
-                ))
-                for states in state_changes:
-                    person._init_event(*states)
-                remove_trigger = AndTrigger(
-                    OrTrigger([
-                        AfterTrigger(person.state_to_events[states])
-                        for states in state_changes
-                    ]),
-                    AfterTrigger(add_event)
-                )
-                remove_event = Event(remove_trigger, remove_effect)
-                for states in state_changes:
-                    person.hook_on_change(states, remove_event)
-        return ret
+        return [_SymptomaticIsolationListener(self)]
 
 
 class HouseholdIsolationIntervention(Intervention):
@@ -469,82 +847,15 @@ class HouseholdIsolationIntervention(Intervention):
 
     def generate_events(self, world: World):
         """
-        generate events that are applied on the person when his state changes to symptomatic,
-        and add the isolation routine to the whole house. After the given duration and params,
-        an event will remove the change.
+        generate the listener that adds the isolation routine to the whole house of the complying people
+        when their state changes to symptomatic. After the given duration and params, the change is removed.
+        The compliance of each person is drawn when he becomes symptomatic.
         :param world: World object
         :return: list of new Events to register on the simulation
         """
-        ret = []
-        for person in world.all_people():
-            if random.random() < self.compliance:
-                household_environment = person.get_environment('household')
-                add_effect = AddRoutineChangeEnvironmentEffect(
-                    environment=household_environment,
-                    routine_change_key='household_isolation',
-                    routine_change_generator=household_isolation_routine
-                )
-                states = (
-                    DiseaseState.INCUBATINGPOSTLATENT,
-                    DiseaseState.SYMPTOMATICINFECTIOUS
-                )
-                person._init_event(*states)
-                entry_moment = Event()
-                add_trigger = AndTrigger(
-                    AfterTrigger(entry_moment),
-                    TimeRangeTrigger(self.start_date, self.end_date)
-                )
-                add_event = Event(
-                    add_trigger, add_effect
-                )
-                entry_moment.hook(add_event)
-                day_event = DayEvent(self.start_date)  # Wasteful in memory!
-                day_event.hook(add_event)
-                ret.append(day_event)
-                if self.delay_on_enter:
-                    delay_time = self.delay_on_enter
-                    person.hook_on_change(
-                        states,
-                        Event(
-                            EmptyTrigger(),
-                            DelayedEffect(entry_moment, delay_time)
-                        )
-                    )
-                else:
-                    person.hook_on_change(states, entry_moment)
-
-                remove_effect = RemoveRoutineChangeEnvironmentEffect(
-                    environment=household_environment, routine_change_key='household_isolation'
-                )
-                if self.is_exit_after_recovery:
-                    state_changes = list(itertools.product(
-                        [DiseaseState.SYMPTOMATICINFECTIOUS, DiseaseState.CRITICAL],
-                        [DiseaseState.IMMUNE, DiseaseState.DECEASED]
-                    ))
-                    for states in state_changes:
-                        person._init_event(*states)
-                    remove_trigger = AndTrigger(
-                        OrTrigger([
-                            AfterTrigger(person.state_to_events[states])
-                            for states in state_changes
-                        ]),
-                        AfterTrigger(add_event)
-                    )
-                    remove_event = Event(
-                        remove_trigger,
-                        DelayedEffect(Event(effect=remove_effect), self.delay_on_exit)
-                    )
-                    for states in state_changes:
-                        person.hook_on_change(states, remove_event)
-                else:
-                    remove_trigger = AfterTrigger(add_event)
-                    remove_event = Event(
-                        remove_trigger,
-                        DelayedEffect(Event(effect=remove_effect), self.delay_on_exit)
-                    )
-                    add_event.hook(remove_event)
-        return ret
-    
+        return [_HouseholdIsolationListener(self)]
+
+
 class ImmuneGeneralPopulationIntervention(Intervention):
     """
     Implementation of a policy of immune 100 (get as parameter) people a day,
@@ -2,23 +2,31 @@ from typing import Tuple
 from datetime import date, timedelta
 import random
 from collections import namedtuple
-from src.simulation.interventions.intervention import Intervention, make_routine_change_events
-from src.simulation.event import DayEvent, ChangeEnvInterventionStateEffect
+from src.simulation.interventions.intervention import Intervention, routine_of_environments
+from src.simulation.event import DayEvent, ChangeEnvInterventionStateEffect, AddActivityMultiplierEffect, \
+    RemoveActivityMultiplierEffect, AddRoutineChangeGroupEffect, RemoveRoutineChangeGroupEffect, \
+    PeriodicRoutineChangeEffect
 from src.world.environments import CityCommunity, SchoolInterventionState
-from src.world import World
-from src.simulation.params import Params
+from src.world import World, ROUTINE_CACHE
 
-def no_school_routine(person):
-    params = Params.loader()["interventions_routines"]["school_closure"]
+@routine_of_environments("school_closure")
+def no_school_routine(env_names, params):
     return {'school': params["school"], 'household': params['household'], 'city_community': params['city_community'],
             'neighborhood_community': params['neighborhood_community']}
 
-def school_isolation_intervention(person):
-    params = Params.loader()["interventions_routines"]["school_isolation"]
+@routine_of_environments("school_isolation")
+def school_isolation_intervention(env_names, params):
     return {'school': params["school"], 'household': params['household'],
             'city_community': params['city_community'], 'neighborhood_community': params['neighborhood_community']}
 
 
+def _without_environment(routine, env_name):
+    """
+    :return: the routine change without the weight of the given environment
+    """
+    return {name: val for name, val in routine.items() if name != env_name}
+
+
 AttributeAndPeriodData = namedtuple("AttributeAndPeriodData", ["attribute", "period_time"])
 
 class PartialEnvironmentIntervention(Intervention):
@@ -27,6 +35,15 @@ class PartialEnvironmentIntervention(Intervention):
     and applies some routine change to all people in them.
     The environments of that name are randomly shaffled (once per simulation),
     and each such intervention either takes the a prefix or a suffix of that order.
+    When all the people comply, the change of the weight of the environment itself is applied to the whole
+    environment as its activity multiplier (see HomogeneousEnvironment.add_activity_multiplier), so closing
+    an environment takes one event, and only the rest of the routine change (e.g. more time at home)
+    is added to its people, by one event for all of them.
+    Otherwise all of the routine change is added to the complying people, by one event for all of them,
+    so the people that do not comply keep their weight in the environment.
+    With period_data the people of the environment change their routines in turns,
+    so all of the routine change is added to each of them, by one periodic event for each group of people
+    that take the same turns (see PeriodicRoutineChangeEffect).
     """
     def __init__(
         self,
@@ -99,6 +116,51 @@ class PartialEnvironmentIntervention(Intervention):
                 ))
         return min_inside
 
+    def _make_routine(self, person):
+        """
+        :return: the routine change of the intervention for the given person
+        """
+        if self._args is None:
+            return self._routine_generator(person)
+        return self._routine_generator(person, self._args)
+
+    def _spillover_routine(self, person):
+        """
+        :return: the routine change of the intervention for the given person,
+        without the weight of the intervention's environment (which is its activity multiplier instead)
+        """
+        routine = ROUTINE_CACHE.intern_change(self._make_routine(person))
+        return ROUTINE_CACHE.generated_change(
+            (self._key, self._env_name, routine), _without_environment, routine, self._env_name
+        )
+
+    def _make_periodic_events(self, people, attribute_val):
+        """
+        creates the events of the routine change of a group of people with the same attribute, with period_data.
+        The change is on from the start date for attribute_val periods, then off for one period,
+        then on for num_possibilities - 1 periods and so on, until the end date.
+        :param people: list of Person, with the same value of the attribute
+        :param attribute_val: int value of the attribute of the people
+        :return: list of new Event objects, empty if the change is never on
+        """
+        period_time = self.period_data.period_time
+        num_possibilities = self.period_data.attribute.num_possibilities
+        if num_possibilities < 2:
+            return []
+        effect = PeriodicRoutineChangeEffect(
+            people=tuple(people),
+            routine_change_key=self._key,
+            routine_change_vals=tuple(self._make_routine(person) for person in people),
+            phase_start=self.start_date + period_time * attribute_val,
+            off_duration=period_time,
+            cycle=period_time * num_possibilities,
+            end_date=self.end_date
+        )
+        first_on_date = effect.first_on_date(self.start_date)
+        if first_on_date >= self.end_date:
+            return []
+        return [DayEvent(date=first_on_date, effect=effect)]
+
     def generate_events(self, world: World):
         """
         creates the events that make the intervention happen in the simulation.
@@ -147,42 +209,45 @@ class PartialEnvironmentIntervention(Intervention):
                     )
                 )
             if self.period_data is None:
-                for person in env._person_dict:
-                    if random.random() < self.compliance:
-                        curr_events = make_routine_change_events(
-                            person,
-                            self.start_date,
-                            self.end_date,
-                            self._key,
-                            self._routine_generator,
-                            self._args
+                people = list(env._person_dict)
+                if not people:
+                    continue
+                complying_people = tuple(person for person in people if random.random() < self.compliance)
+                if self.compliance >= 1:
+                    multiplier = self._make_routine(people[0]).get(self._env_name, 1)
+                    new_events.append(DayEvent(
+                        date=self.start_date,
+                        effect=AddActivityMultiplierEffect(environment=env, key=self._key, multiplier=multiplier)
+                    ))
+                    new_events.append(DayEvent(
+                        date=self.end_date,
+                        effect=RemoveActivityMultiplierEffect(environment=env, key=self._key)
+                    ))
+                    make_routine = self._spillover_routine
+                else:
+                    make_routine = self._make_routine
+                if complying_people:
+                    new_events.append(DayEvent(
+                        date=self.start_date,
+                        effect=AddRoutineChangeGroupEffect(
+                            people=complying_people,
+                            routine_change_key=self._key,
+                            routine_change_vals=tuple(make_routine(person) for person in complying_people)
                         )
-                        for event in curr_events:
-                            new_events.append(event)
+                    ))
+                    new_events.append(DayEvent(
+                        date=self.end_date,
+                        effect=RemoveRoutineChangeGroupEffect(people=complying_people, routine_change_key=self._key)
+                    ))
             else:
+                # The people are grouped by their attribute (their phase in the periods),
+                # and each group takes one periodic event that reschedules itself, instead of events for every period
+                groups = {}
                 for person in env._person_dict:
                     if random.random() < self.compliance:
-                        start_date = self.start_date
-                        end_date = self.start_date + self.period_data.period_time * self.period_data.attribute(person)
-                        finished = False
-                        while not finished:
-                            if end_date >= self.end_date:
-                                end_date = self.end_date
-                                finished = True
-                            if end_date > start_date:
-                                curr_events = make_routine_change_events(
-                                    person,
-                                    start_date,
-                                    end_date,
-                                    self._key,
-                                    self._routine_generator,
-                                    self._args
-                                )
-                                for event in curr_events:
-                                    new_events.append(event)
-
-                            start_date = end_date + self.period_data.period_time
-                            end_date = start_date + self.period_data.period_time * (self.period_data.attribute.num_possibilities - 1)
+                        groups.setdefault(self.period_data.attribute(person), []).append(person)
+                for attribute_val, people in groups.items():
+                    new_events.extend(self._make_periodic_events(people, attribute_val))
 
         return new_events
 
@@ -0,0 +1,201 @@
+from datetime import date, timedelta
+import random
+
+import numpy as np
+
+from src.seir import DiseaseState
+from src.simulation.interventions.intervention import Intervention
+from src.simulation.event import DayEvent, Event, apply_disease_state_transition
+from src.util.Enumerations import ORDER
+from src.world import World
+
+
+class VaccinationPlanner(object):
+    """
+    The priority queue of a vaccination campaign: the eligible people of a world in the order they are immuned.
+    The order is computed once, by sorting precomputed keys (a random draw or the age of each person,
+    or of each household when the people are taken by households), and the people are then taken from the queue
+    lazily, on the day of their dose (see next_doses).
+    People that are not susceptible on that day (e.g. they were infected meanwhile) are skipped,
+    so the doses go to the next people in the queue.
+    """
+    __slots__ = ('_people', '_queue', '_next')
+
+    def __init__(self, world, order=ORDER.NONE, by_household=False, min_age=0, city_name=None):
+        """
+        :param world: World object
+        :param order: ORDER of the people: random (NONE), or by ascending or descending age.
+        With by_household, the households are ordered by their youngest person (ASCENDING),
+        or by their oldest person (DESCENDING)
+        :param by_household: Whether all the eligible people of a household are immuned together
+        :param min_age: int minimal age of the eligible people
+        :param city_name: str name of the city of the eligible people, None for all the cities
+        """
+        columns = world.get_people_columns()
+        self._people = columns.people
+        rows = np.flatnonzero(columns.ages >= min_age)
+        if city_name is not None or by_household:
+            has_household = np.fromiter(
+                (self._people[row].has_environment('household') for row in rows), dtype=bool, count=len(rows)
+            )
+            rows = rows[has_household]
+        if city_name is not None:
+            in_city = np.fromiter(
+                (self._people[row].get_city_name() == city_name for row in rows), dtype=bool, count=len(rows)
+            )
+            rows = rows[in_city]
+        if by_household:
+            self._queue = self._household_queue(rows, columns.ages, order)
+        else:
+            self._queue = rows[self._sort_keys(columns.ages[rows], order)]
+        self._next = 0
+
+    @staticmethod
+    def _sort_keys(ages, order):
+        """
+        :param ages: numpy int array of the ages of the people (or households) to order
+        :param order: ORDER
+        :return: numpy int array of the positions of the given ages, in the order of the queue
+        """
+        if order == ORDER.ASCENDING:
+            return np.argsort(ages, kind='stable')
+        if order == ORDER.DESCENDING:
+            return np.argsort(-ages.astype(np.int64), kind='stable')
+        draws = np.fromiter((random.random() for _ in range(len(ages))), dtype=np.float64, count=len(ages))
+        return np.argsort(draws, kind='stable')
+
+    def _household_queue(self, rows, ages, order):
+        """
+        :param rows: numpy int array of the rows of the eligible people
+        :param ages: numpy int array of the ages of all the people
+        :param order: ORDER of the households
+        :return: numpy int array of the given rows, by the order of their households
+        """
+        household_codes = {}
+        codes = np.fromiter(
+            (household_codes.setdefault(id(self._people[row].get_environment('household')), len(household_codes))
+             for row in rows),
+            dtype=np.int64, count=len(rows)
+        )
+        num_households = len(household_codes)
+        if order == ORDER.DESCENDING:
+            household_ages = np.full(num_households, np.iinfo(np.int64).min, dtype=np.int64)
+            np.maximum.at(household_ages, codes, ages[rows])
+        else:
+            household_ages = np.full(num_households, np.iinfo(np.int64).max, dtype=np.int64)
+            np.minimum.at(household_ages, codes, ages[rows])
+        household_ranks = np.empty(num_households, dtype=np.int64)
+        household_ranks[self._sort_keys(household_ages, order)] = np.arange(num_households)
+        # The people of each household keep their order (a stable sort by the rank of their household)
+        return rows[np.argsort(household_ranks[codes], kind='stable')]
+
+    def __len__(self):
+        """
+        :return: int number of the eligible people (that are in the queue or were taken from it)
+        """
+        return len(self._queue)
+
+    def is_empty(self):
+        return self._next >= len(self._queue)
+
+    def next_doses(self, num_doses):
+        """
+        Take the next susceptible people from the queue
+        :param num_doses: int maximal number of people to take
+        :return: list of Person, shorter than num_doses if the queue ran out
+        """
+        people = []
+        queue = self._queue
+        while len(people) < num_doses and self._next < len(queue):
+            person = self._people[queue[self._next]]
+            self._next += 1
+            if person.get_disease_state() == DiseaseState.SUSCEPTIBLE:
+                people.append(person)
+        return people
+
+
+class _VaccinationEffect:
+    """
+    An effect which immunes the quota of a day of a vaccination campaign,
+    and registers itself again on the next day until the campaign ends
+    """
+    __slots__ = ('_planner', '_doses_per_day', '_num_remaining', '_end_date')
+
+    def __init__(self, planner, doses_per_day, num_doses, end_date):
+        """
+        :param planner: VaccinationPlanner
+        :param doses_per_day: int number of people to immune each day
+        :param num_doses: int total number of people to immune
+        :param end_date: datetime.date on which the campaign ends
+        """
+        self._planner = planner
+        self._doses_per_day = doses_per_day
+        self._num_remaining = num_doses
+        self._end_date = end_date
+
+    def apply(self, simulation):
+        today = simulation._date
+        if today >= self._end_date:
+            return
+        people = self._planner.next_doses(min(self._doses_per_day, self._num_remaining))
+        for person in people:
+            apply_disease_state_transition(person, DiseaseState.SUSCEPTIBLE, DiseaseState.IMMUNE, simulation)
+        self._num_remaining -= len(people)
+        if self._num_remaining > 0 and not self._planner.is_empty():
+            simulation.register_event_on_day(Event(effect=self), today + timedelta(days=1))
+
+
+class VaccinationCampaignIntervention(Intervention):
+    """
+    A vaccination campaign that immunes doses_per_day people a day from its start date,
+    until a given proportion (the compliance) of the eligible people were immuned, or until its end date.
+    The people are chosen by the priority order of a VaccinationPlanner (random, by age, and by household or not),
+    which is computed once when the events are generated. Each day's quota is taken from it only when the day comes,
+    by one event that registers itself again on the next day,
+    so the memory of the campaign does not depend on the length of its schedule.
+    """
+    __slots__ = ('doses_per_day', 'order', 'by_household', 'min_age', 'city_name')
+
+    def __init__(
+        self,
+        compliance: float,
+        start_date: date,
+        duration: timedelta,
+        doses_per_day: int,
+        order: ORDER = ORDER.NONE,
+        by_household: bool = False,
+        min_age: int = 0,
+        city_name: str = None
+    ):
+        """
+        :param compliance: float between 0 to 1, the proportion of the eligible people that are immuned
+        :param start_date: datetime.date of the first doses
+        :param duration: timedelta of the campaign
+        :param doses_per_day: int number of people to immune each day
+        :param order: ORDER of the people (or households), see VaccinationPlanner
+        :param by_household: Whether all the eligible people of a household are immuned together
+        :param min_age: int minimal age of the eligible people
+        :param city_name: str name of the city of the eligible people, None for all the cities
+        """
+        super(VaccinationCampaignIntervention, self).__init__(compliance, start_date, duration)
+        assert 0 <= compliance <= 1
+        self.doses_per_day = doses_per_day
+        self.order = order
+        self.by_household = by_household
+        self.min_age = min_age
+        self.city_name = city_name
+
+    def generate_events(self, world: World):
+        """
+        plans the campaign and creates the event of its first day
+        :param world: World object
+        :return: list of Event objects
+        """
+        planner = VaccinationPlanner(world, self.order, self.by_household, self.min_age, self.city_name)
+        num_doses = int(self.compliance * len(planner))
+        if num_doses == 0 or self.doses_per_day <= 0:
+            return []
+        return [DayEvent(
+            date=self.start_date,
+            effect=_VaccinationEffect(planner, self.doses_per_day, num_doses, self.end_date)
+        )]
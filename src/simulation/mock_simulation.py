@@ -36,7 +36,8 @@ class InitialStateSimulation(Simulation):
             initial_date,
             interventions=interventions,
             verbosity=verbosity,
-            outdir=outdir
+            outdir=outdir,
+            collect_hood_data=False
         )
         # structure - a dict from city to a dict of person to a list of pairs of disease states and change dates
         # {
@@ -156,27 +157,41 @@ class InitialStateSimulation(Simulation):
             p[1].states_and_dates.sort(key=lambda x: x[0])  # Sort by date
         return all_infected_for_initial_state
 
+    def _record_state_change(self, person, date, old_state, new_state):
+        """
+        Save the given disease state change of an infected person in the infected people data of his city
+        :param person: Person
+        :param date: datetime.date of the change
+        :param old_state: DiseaseState
+        :param new_state: DiseaseState
+        """
+        if person.get_disease_state() == DiseaseState.IMMUNE:
+            return
+        city = person.get_city_name()
+        if city not in self._infected_people_seir_times_per_city:
+            self._infected_people_seir_times_per_city[city] = {}
+
+        person_data = self._infected_people_seir_times_per_city[city].setdefault(
+            person,
+            self.InfectedPersonData(
+                symptomatic=False,
+                symptomatic_date=None,
+                infection_date=self._date,
+                states_and_dates=[(self._date, None, DiseaseState.LATENT)]
+            )
+        )
+        if new_state == DiseaseState.SYMPTOMATICINFECTIOUS:
+            person_data.symptomatic = True
+            person_data.symptomatic_date = date
+        person_data.states_and_dates.append((date, old_state, new_state))
+
     def register_event_on_day(self, event, date):
         for e in [event, *event.hooks]:
             if isinstance(e.effect, DiseaseStateChangeEffect):
-                person = e.effect.get_person()
-                if person.get_disease_state() != DiseaseState.IMMUNE:
-	                city = person.get_city_name()
-	                if city not in self._infected_people_seir_times_per_city:
-	                    self._infected_people_seir_times_per_city[city] = {}
-
-	                person_data = self._infected_people_seir_times_per_city[city].setdefault(
-	                    person,
-	                    self.InfectedPersonData(
-	                        symptomatic=False,
-	                        symptomatic_date=None,
-	                        infection_date=self._date,
-	                        states_and_dates=[(self._date, None, DiseaseState.LATENT)]
-	                    )
-	                )
-	                if e.effect.get_states()[1] == DiseaseState.SYMPTOMATICINFECTIOUS:
-	                    person_data.symptomatic = True
-	                    person_data.symptomatic_date = date
-	                person_data.states_and_dates.append((date, *e.effect.get_states()))
+                self._record_state_change(e.effect.get_person(), date, *e.effect.get_states())
 
         super(InitialStateSimulation, self).register_event_on_day(event, date)
+
+    def register_transition(self, transition):
+        self._record_state_change(transition.person, transition._date, transition.old_state, transition.new_state)
+        super(InitialStateSimulation, self).register_transition(transition)
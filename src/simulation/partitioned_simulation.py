@@ -0,0 +1,968 @@
+from collections import Counter
+from datetime import timedelta
+from copy import deepcopy
+import logging
+import multiprocessing as mp
+import os
+import traceback
+
+import numpy as np
+
+from src.seir import DiseaseState, sample_seir_transitions_batch
+from src.simulation.array_simulation import _NUM_STATE_VALUES, _NO_STATE, _STATE_IS_INFECTED, _STATE_IS_INFECTIOUS, \
+    compute_routine_changes, apply_routine_change, schedule_transitions, write_simulation_outputs
+from src.simulation.params import Params
+from src.simulation.simulation import ORDER
+from src.logs import Statistics, DayStatistics
+from src.util import seed
+from src.util.Enumerations import machine_type
+from src.world import ArrayWorld, PopulationCounters, RedactedPerson, RedactedPersonAndEnv
+from src.world.array_world import gather_csr_rows
+
+
+log = logging.getLogger(__name__)
+
+
+def _segment_bounds(keys):
+    """
+    :param keys: numpy array, sorted
+    :return: tuple of numpy int arrays (starts, ends) of the runs of equal keys
+    """
+    if len(keys) == 0:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+    starts = np.flatnonzero(np.concatenate([[True], keys[1:] != keys[:-1]]))
+    return starts, np.append(starts[1:], len(keys))
+
+
+def _segmented_cumsum(values, starts, ends):
+    """
+    The cumulative sums of the values in each segment [starts[i], ends[i]), added one by one from its start,
+    so the sums of a segment depend only on its own values
+    (unlike the differences of one cumsum of the whole array, which depend on the values before the segment).
+    Made for many short segments, it loops over the length of the longest segment.
+    :return: numpy float array of the cumulative sums, at the positions of the values
+    """
+    sums = np.zeros(len(values), dtype=np.float64)
+    lengths = ends - starts
+    running = np.zeros(len(starts), dtype=np.float64)
+    for offset in range(int(lengths.max()) if len(lengths) > 0 else 0):
+        has_offset = lengths > offset
+        positions = starts[has_offset] + offset
+        running[has_offset] += values[positions]
+        sums[positions] = running[has_offset]
+    return sums
+
+
+def _segmented_search(values, starts, ends, targets):
+    """
+    Binary search of many targets at once, each in its own segment of the values
+    :param values: numpy array, non decreasing in each segment
+    :param starts: numpy int array of the starts of the segments
+    :param ends: numpy int array of the ends of the (non empty) segments
+    :param targets: numpy array of the targets
+    :return: numpy int array of the first position in each segment whose value is greater than the target,
+    or the last position of the segment if there is none
+    """
+    low, high = starts.copy(), ends.copy()
+    is_active = low < high
+    while is_active.any():
+        middle = (low + high) // 2
+        is_above = values[np.where(is_active, middle, 0)] > targets
+        low = np.where(is_active & ~is_above, middle + 1, low)
+        high = np.where(is_active & is_above, middle, high)
+        is_active = low < high
+    return np.minimum(low, ends - 1)
+
+
+class _Contributions(object):
+    """
+    The infection sources of some environments, grouped by (environment, city):
+    for each group its environment, city, total weight, and the cumulative weight of its city's sources
+    before the group, and the sources of the group (by group, in CSR form) with their global rows,
+    their cumulative weights in their city, and their states and ages.
+    Every group is made by the worker of its city alone, so it does not depend on the partition,
+    and the groups of all the cities are merged by sorting them by (environment, city).
+    """
+    __slots__ = (
+        'envs',
+        'cities',
+        'weights',
+        'bases',
+        'source_ptr',
+        'source_rows',
+        'source_cums',
+        'source_states',
+        'source_ages',
+    )
+
+    def __init__(self, envs, cities, weights, bases, source_ptr, source_rows, source_cums, source_states,
+                 source_ages):
+        self.envs = envs
+        self.cities = cities
+        self.weights = weights
+        self.bases = bases
+        self.source_ptr = source_ptr
+        self.source_rows = source_rows
+        self.source_cums = source_cums
+        self.source_states = source_states
+        self.source_ages = source_ages
+
+    @classmethod
+    def empty(cls):
+        return cls(
+            np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float64),
+            np.zeros(0, dtype=np.float64), np.zeros(1, dtype=np.int64), np.zeros(0, dtype=np.int64),
+            np.zeros(0, dtype=np.float64), np.zeros(0, dtype=np.int8), np.zeros(0, dtype=np.int16)
+        )
+
+    def __len__(self):
+        return len(self.envs)
+
+    def take(self, groups):
+        """
+        :param groups: numpy int array of group indices
+        :return: _Contributions of the given groups, in the given order
+        """
+        positions = gather_csr_rows(self.source_ptr, groups)
+        counts = self.source_ptr[groups + 1] - self.source_ptr[groups]
+        return _Contributions(
+            self.envs[groups], self.cities[groups], self.weights[groups], self.bases[groups],
+            np.concatenate([[0], np.cumsum(counts)]).astype(np.int64), self.source_rows[positions],
+            self.source_cums[positions], self.source_states[positions], self.source_ages[positions]
+        )
+
+    def sorted(self):
+        """
+        :return: _Contributions of the same groups, sorted by (environment, city)
+        """
+        return self.take(np.lexsort((self.cities, self.envs)))
+
+    @classmethod
+    def concatenate(cls, parts):
+        offsets = np.cumsum([0] + [part.source_ptr[-1] for part in parts])
+        return cls(
+            np.concatenate([part.envs for part in parts]),
+            np.concatenate([part.cities for part in parts]),
+            np.concatenate([part.weights for part in parts]),
+            np.concatenate([part.bases for part in parts]),
+            np.concatenate([[0]] + [part.source_ptr[1:] + offset for part, offset in zip(parts, offsets)]),
+            np.concatenate([part.source_rows for part in parts]),
+            np.concatenate([part.source_cums for part in parts]),
+            np.concatenate([part.source_states for part in parts]),
+            np.concatenate([part.source_ages for part in parts])
+        )
+
+
+class _PartitionWorker(object):
+    """
+    Simulates the people of some of the cities of an ArrayWorld (see PartitionedArraySimulation).
+    The people are indexed by their local rows (by the order of their global rows),
+    and the environments by their global indices.
+    All the random draws of a person are made from the stream of his city, in a fixed order of the city's people,
+    so they do not depend on the other cities of the worker.
+    """
+    __slots__ = (
+        '_rows',
+        '_cities',
+        '_rngs',
+        '_ages',
+        '_infectiousness_probs',
+        '_hood_ids',
+        '_member_people',
+        '_member_envs',
+        '_member_weights',
+        '_person_ptr',
+        '_env_order',
+        '_env_ptr',
+        '_contact_probs',
+        '_env_name_codes',
+        '_env_names',
+        '_env_full_name_codes',
+        '_env_full_names',
+        '_is_shared',
+        '_machine_type',
+        '_day',
+        '_states',
+        '_last_states',
+        '_changed_rows',
+        '_transitions',
+        '_infection_records',
+        '_routine_changes',
+        '_routine_change_counts',
+        '_routine_change_values',
+        '_infection_envs',
+        '_transmitters',
+        '_infector_states',
+        '_infector_ages',
+        '_infection_days',
+        '_num_infections',
+        '_first_infectious_people',
+        '_local_contributions',
+        '_sources',
+        '_local_infection_counts',
+    )
+
+    def __init__(self, arrays, rows, is_shared, city_seed_sequences, states, last_states, changed, routine_changes):
+        """
+        :param arrays: the ArrayWorld of the whole simulation
+        :param rows: numpy int array of the global rows of the worker's people, sorted
+        :param is_shared: numpy bool array, whether each environment has members in other workers
+        :param city_seed_sequences: dict from the code of each of the worker's cities to its SeedSequence
+        :param states: numpy int array of the disease state values of the worker's people
+        :param last_states: numpy int array of their last saved state values (_NO_STATE if none)
+        :param changed: numpy int array of the local rows of the people that are changed
+        :param routine_changes: dict from day to the list of (is_add, key, local members, values) of that day
+        """
+        self._rows = rows
+        self._cities = arrays.city_codes[rows].astype(np.int64)
+        self._rngs = {city: np.random.default_rng(sequence) for city, sequence in city_seed_sequences.items()}
+        self._ages = arrays.ages[rows]
+        self._infectiousness_probs = arrays.infectiousness_probs[rows]
+        self._hood_ids = arrays.hood_ids[rows]
+        members = arrays.members_of_people(rows)
+        counts = arrays.person_ptr[rows + 1] - arrays.person_ptr[rows]
+        self._member_people = np.repeat(np.arange(len(rows)), counts)
+        self._member_envs = arrays.member_envs[members]
+        self._member_weights = arrays.member_weights[members].copy()
+        self._person_ptr = np.concatenate([[0], np.cumsum(counts)]).astype(np.int64)
+        self._env_order = np.argsort(self._member_envs, kind='stable')
+        self._env_ptr = np.concatenate(
+            [[0], np.cumsum(np.bincount(self._member_envs, minlength=arrays.num_envs))]
+        ).astype(np.int64)
+        self._contact_probs = arrays.contact_probs
+        self._env_name_codes = arrays.env_name_codes
+        self._env_names = arrays.env_names
+        self._env_full_name_codes = arrays.env_full_name_codes
+        self._env_full_names = arrays.env_full_names
+        self._is_shared = is_shared
+        self._machine_type = machine_type[Params.loader()['person']['state_macine_type']]
+        self._day = 0
+
+        num_people = len(rows)
+        self._states = states
+        self._last_states = last_states
+        self._changed_rows = [changed]
+        self._transitions = {}
+        self._infection_records = {}
+        self._routine_changes = routine_changes
+        self._routine_change_counts = {}
+        self._routine_change_values = {}
+        self._infection_envs = np.full(num_people, -1, dtype=np.int64)
+        self._transmitters = np.full(num_people, -1, dtype=np.int64)
+        self._infector_states = np.full(num_people, _NO_STATE, dtype=np.int8)
+        self._infector_ages = np.full(num_people, -1, dtype=np.int64)
+        self._infection_days = np.full(num_people, -1, dtype=np.int64)
+        self._num_infections = np.zeros(num_people, dtype=np.float64)
+        self._first_infectious_people = np.zeros(num_people, dtype=bool)
+        self._local_contributions = _Contributions.empty()
+        self._sources = None
+        self._local_infection_counts = None
+
+    def _random(self, cities):
+        """
+        :param cities: numpy int array of the cities of the draws, sorted
+        :return: numpy float array of uniform draws in [0, 1), each from the random stream of its city
+        """
+        draws = np.empty(len(cities), dtype=np.float64)
+        starts, ends = _segment_bounds(cities)
+        for start, end in zip(starts, ends):
+            draws[start:end] = self._rngs[cities[start]].random(end - start)
+        return draws
+
+    def _by_city(self, rows):
+        """
+        :param rows: numpy int array of local rows
+        :return: the rows sorted by (city, row)
+        """
+        return rows[np.lexsort((rows, self._cities[rows]))]
+
+    def infect(self, rows, env, transmitters, infector_states, infector_ages):
+        """
+        Infect the given (susceptible) people and schedule their disease transitions
+        :param rows: numpy int array of local rows, sorted by (city, row)
+        :param env: the environment index (or array of indices) where they got infected
+        :param transmitters: the global row (or array of rows) of the people who infected them, -1 if none
+        :param infector_states: the state value (or array of values) of the infectors at the infection, or _NO_STATE
+        :param infector_ages: the age (or array of ages) of the infectors, or -1
+        """
+        if len(rows) == 0:
+            return
+        assert (self._states[rows] == DiseaseState.SUSCEPTIBLE.value).all()
+        self._states[rows] = DiseaseState.LATENT.value
+        self._changed_rows.append(rows)
+        self._infection_envs[rows] = env
+        self._transmitters[rows] = transmitters
+        self._infector_states[rows] = infector_states
+        self._infector_ages[rows] = infector_ages
+        starts, ends = _segment_bounds(self._cities[rows])
+        for start, end in zip(starts, ends):
+            city_rows = rows[start:end]
+            latent_days, transition_rows, days, new_states = sample_seir_transitions_batch(
+                self._machine_type, self._ages[city_rows].astype(np.int64), self._rngs[self._cities[city_rows[0]]]
+            )
+            schedule_transitions(self._transitions, city_rows[transition_rows], self._day + days, new_states)
+            self._infection_days[city_rows] = self._day + latent_days
+            for day in np.unique(latent_days):
+                self._infection_records.setdefault(self._day + int(day), []).append(city_rows[latent_days == day])
+
+    def infect_initial(self, rows, env):
+        """
+        Infect the given people by the initial infection, see infect
+        """
+        self.infect(self._by_city(rows), env, -1, _NO_STATE, -1)
+
+    def infect_chosen(self, rows, env, transition_rows, days, new_states):
+        """
+        Infect the given people with given disease transitions (see ArraySimulation.infect_chosen_set)
+        :param rows: numpy int array of the local rows of the infected people
+        :param transition_rows: numpy int array of the local rows of the transitions
+        """
+        self._states[rows] = DiseaseState.LATENT.value
+        self._changed_rows.append(rows)
+        self._infection_envs[rows] = env
+        schedule_transitions(self._transitions, transition_rows, days, new_states)
+        for day in sorted(self._transitions.keys()):
+            if day < self._day:
+                for curr_rows, curr_new_states in self._transitions.pop(day):
+                    self._states[curr_rows] = curr_new_states
+                    self._changed_rows.append(curr_rows)
+
+    def _apply_infection_counts(self, shared_envs, shared_counts):
+        """
+        Add the smoothed number of infections of yesterday's sources (see ArraySimulation._propagate_infection),
+        once the numbers of infections in the shared environments are known
+        :param shared_envs: numpy int array of the shared environments with infections, sorted
+        :param shared_counts: numpy int array of their numbers of infections (in all the workers)
+        """
+        if self._sources is None:
+            return
+        people, envs, weights, totals = self._sources
+        local_envs, local_counts = self._local_infection_counts
+        all_envs = np.concatenate([local_envs, shared_envs])
+        order = np.argsort(all_envs, kind='stable')
+        all_envs, all_counts = all_envs[order], np.concatenate([local_counts, shared_counts])[order]
+        positions = np.minimum(np.searchsorted(all_envs, envs), max(len(all_envs) - 1, 0))
+        has_infections = (all_envs[positions] == envs) if len(all_envs) > 0 else np.zeros(len(envs), dtype=bool)
+        np.add.at(
+            self._num_infections, people[has_infections],
+            weights[has_infections] * all_counts[positions[has_infections]] / totals[has_infections]
+        )
+        self._sources = None
+
+    def begin_day(self, day, shared_envs, shared_counts):
+        """
+        Apply the day's routine changes and disease transitions, and collect the infection sources
+        :param day: int day index
+        :param shared_envs: see _apply_infection_counts, the infections of the previous day
+        :param shared_counts: see _apply_infection_counts
+        :return: _Contributions of the worker's sources in shared environments
+        """
+        self._apply_infection_counts(shared_envs, shared_counts)
+        self._day = day
+        for is_add, key, members, values in self._routine_changes.pop(day, []):
+            apply_routine_change(
+                self._member_weights, self._routine_change_counts, self._routine_change_values,
+                is_add, key, members, values
+            )
+        for rows, new_states in self._transitions.pop(day, []):
+            self._states[rows] = new_states
+            self._changed_rows.append(rows)
+
+        infectious = np.flatnonzero(_STATE_IS_INFECTIOUS[self._states])
+        members = gather_csr_rows(self._person_ptr, infectious)
+        people = self._member_people[members]
+        weights = self._infectiousness_probs[people] * \
+            np.array(DiseaseState.infectiousness_list)[self._states[people]] * \
+            self._member_weights[members]
+        members, people, weights = members[weights > 0], people[weights > 0], weights[weights > 0]
+        envs, cities = self._member_envs[members], self._cities[people]
+        order = np.lexsort((members, envs, cities))
+        people, weights, envs, cities = people[order], weights[order], envs[order], cities[order]
+        self._sources = (people, envs, weights)
+
+        cums = np.empty(len(weights), dtype=np.float64)
+        city_starts, city_ends = _segment_bounds(cities)
+        for start, end in zip(city_starts, city_ends):
+            cums[start:end] = np.cumsum(weights[start:end])
+        if len(weights) > 0:
+            starts = np.flatnonzero(np.concatenate([[True], (cities[1:] != cities[:-1]) | (envs[1:] != envs[:-1])]))
+            group_weights = np.add.reduceat(weights, starts)
+            is_city_start = np.zeros(len(weights), dtype=bool)
+            is_city_start[city_starts] = True
+            bases = np.where(is_city_start[starts], 0.0, cums[np.maximum(starts - 1, 0)])
+        else:
+            starts = np.zeros(0, dtype=np.int64)
+            group_weights = bases = np.zeros(0, dtype=np.float64)
+        contributions = _Contributions(
+            envs[starts], cities[starts], group_weights, bases, np.append(starts, len(weights)).astype(np.int64),
+            self._rows[people], cums, self._states[people], self._ages[people]
+        )
+        is_shared = self._is_shared[contributions.envs]
+        self._local_contributions = contributions.take(np.flatnonzero(~is_shared))
+        return contributions.take(np.flatnonzero(is_shared))
+
+    def propagate_and_end_day(self, shared_contributions, record_first_people):
+        """
+        Spread the infection to the worker's people, and make the worker's part of the day's statistics
+        :param shared_contributions: _Contributions of all the sources in shared environments, sorted
+        :param record_first_people: bool, whether to record the people that got infected as the first ones
+        :return: tuple of (shared environments with infections today, their numbers of infections in this worker,
+        the worker's part of the day's statistics, see _end_day)
+        """
+        contributions = _Contributions.concatenate([self._local_contributions, shared_contributions]).sorted()
+        env_starts, env_ends = _segment_bounds(contributions.envs)
+        cumulative_weights = _segmented_cumsum(contributions.weights, env_starts, env_ends)
+        env_ids = contributions.envs[env_starts]
+        total_weights = cumulative_weights[env_ends - 1]
+        if self._sources is not None:
+            people, envs, weights = self._sources
+            self._sources = (people, envs, weights, total_weights[np.searchsorted(env_ids, envs)])
+
+        infection_envs = np.zeros(0, dtype=np.int64)
+        is_active = total_weights > 0
+        env_ids, total_weights = env_ids[is_active], total_weights[is_active]
+        env_starts, env_ends = env_starts[is_active], env_ends[is_active]
+        members = self._env_order[gather_csr_rows(self._env_ptr, env_ids)]
+        if len(members) > 0:
+            env_positions = np.repeat(
+                np.arange(len(env_ids)), self._env_ptr[env_ids + 1] - self._env_ptr[env_ids]
+            )
+            people = self._member_people[members]
+            is_candidate = (self._states[people] == DiseaseState.SUSCEPTIBLE.value) & (self._member_weights[members] > 0)
+            members, people, env_positions = members[is_candidate], people[is_candidate], env_positions[is_candidate]
+            order = np.lexsort((members, env_positions, self._cities[people]))
+            members, people, env_positions = members[order], people[order], env_positions[order]
+            infection_probs = -np.expm1(
+                -self._contact_probs[env_ids[env_positions]] * total_weights[env_positions] *
+                self._member_weights[members]
+            )
+            is_infected = self._random(self._cities[people]) < infection_probs
+            people, env_positions = people[is_infected], env_positions[is_infected]
+            # A person may only be infected once, in the first environment (by index) that infected him
+            order = np.lexsort((env_positions, people))
+            people, env_positions = people[order], env_positions[order]
+            is_first = np.concatenate([[True], people[1:] != people[:-1]]) if len(people) > 0 else np.zeros(0, bool)
+            infected, env_positions = people[is_first], env_positions[is_first]
+            order = np.lexsort((infected, self._cities[infected]))
+            infected, env_positions = infected[order], env_positions[order]
+
+            # Sample the infection source of each infection: the group (city) in proportion to the groups' weights
+            # in the environment, and then the source in proportion to the weights in the group
+            cities = self._cities[infected]
+            group_draws = self._random(cities)
+            source_draws = self._random(cities)
+            groups = _segmented_search(
+                cumulative_weights, env_starts[env_positions], env_ends[env_positions],
+                group_draws * total_weights[env_positions]
+            )
+            sources = _segmented_search(
+                contributions.source_cums, contributions.source_ptr[groups], contributions.source_ptr[groups + 1],
+                contributions.bases[groups] + source_draws * contributions.weights[groups]
+            )
+            infection_envs = env_ids[env_positions]
+            self.infect(
+                infected, infection_envs, contributions.source_rows[sources], contributions.source_states[sources],
+                contributions.source_ages[sources]
+            )
+
+        envs, counts = np.unique(infection_envs, return_counts=True)
+        is_shared = self._is_shared[envs]
+        self._local_infection_counts = (envs[~is_shared], counts[~is_shared])
+        return envs[is_shared], counts[is_shared], self._end_day(record_first_people)
+
+    def _end_day(self, record_first_people):
+        """
+        Save the states of the people that changed today
+        :return: tuple of (Counter of the change in the number of people of each RedactedPerson,
+        list of the stats dicts of the infections dated to today, dict from neighborhood id to the change in its number
+        of infected people, tuple of numpy arrays (last state values, state values, ages, city codes) of the changed
+        people, whether any of the first infected people is still infected)
+        """
+        changed = np.unique(np.concatenate(self._changed_rows)) if self._changed_rows else np.zeros(0, dtype=np.int64)
+        self._changed_rows = []
+        ages = self._ages[changed].astype(np.int64)
+        states = self._states[changed]
+        last_states = self._last_states[changed]
+        person_count = Counter()
+        codes, counts = np.unique(ages * _NUM_STATE_VALUES + states, return_counts=True)
+        for code, count in zip(codes, counts):
+            person_count[RedactedPerson(int(code // _NUM_STATE_VALUES), DiseaseState(int(code % _NUM_STATE_VALUES)))] \
+                += int(count)
+        had_state = last_states != _NO_STATE
+        codes, counts = np.unique(ages[had_state] * _NUM_STATE_VALUES + last_states[had_state], return_counts=True)
+        for code, count in zip(codes, counts):
+            person_count[RedactedPerson(int(code // _NUM_STATE_VALUES), DiseaseState(int(code % _NUM_STATE_VALUES)))] \
+                -= int(count)
+
+        infected_today_stats = []
+        for row in np.concatenate(self._infection_records.pop(self._day, [np.zeros(0, dtype=np.int64)])):
+            env = self._infection_envs[row]
+            has_infector = self._infector_states[row] != _NO_STATE
+            infected_today_stats.append({
+                "infection_env_short": self._env_names[self._env_name_codes[env]],
+                "infection_env_long": self._env_full_names[self._env_full_name_codes[env]],
+                "infected_age": int(self._ages[row]),
+                "infector_age": int(self._infector_ages[row]) if has_infector else None,
+                "infector_disease_state": DiseaseState(int(self._infector_states[row])) if has_infector else None
+            })
+
+        hoods = self._hood_ids[changed]
+        deltas = _STATE_IS_INFECTED[states].astype(np.int64) - \
+            np.where(had_state, _STATE_IS_INFECTED[np.maximum(last_states, 0)], False).astype(np.int64)
+        is_relevant = (hoods >= 0) & (deltas != 0)
+        hood_deltas = Counter()
+        for hood, delta in zip(hoods[is_relevant], deltas[is_relevant]):
+            hood_deltas[int(hood)] += int(delta)
+
+        counter_changes = (last_states.astype(np.int64), states.astype(np.int64), ages, self._cities[changed])
+        self._last_states[changed] = states
+        if record_first_people:
+            self._first_infectious_people[changed[_STATE_IS_INFECTED[states]]] = True
+        first_people_infected = bool(_STATE_IS_INFECTED[self._states[self._first_infectious_people]].any())
+        return person_count, infected_today_stats, hood_deltas, counter_changes, first_people_infected
+
+    def finish(self, shared_envs, shared_counts):
+        """
+        :param shared_envs: see _apply_infection_counts, the infections of the last day
+        :param shared_counts: see _apply_infection_counts
+        :return: tuple of (Counter of RedactedPersonAndEnv of the worker's people (see Statistics.mark_ending),
+        numpy arrays of the global rows, infection days, transmitters and smoothed numbers of infections of the people)
+        """
+        self._apply_infection_counts(shared_envs, shared_counts)
+        env_codes = np.where(
+            self._infection_envs >= 0, self._env_full_name_codes[np.maximum(self._infection_envs, 0)] + 1, 0
+        )
+        num_env_codes = len(self._env_full_names) + 1
+        codes, counts = np.unique(
+            (self._ages.astype(np.int64) * _NUM_STATE_VALUES + self._states) * num_env_codes + env_codes,
+            return_counts=True
+        )
+        final_state = Counter()
+        for code, count in zip(codes, counts):
+            env_code = int(code % num_env_codes)
+            age_and_state = int(code // num_env_codes)
+            final_state[RedactedPersonAndEnv(
+                age_and_state // _NUM_STATE_VALUES,
+                DiseaseState(age_and_state % _NUM_STATE_VALUES),
+                self._env_full_names[env_code - 1] if env_code > 0 else None
+            )] = int(count)
+        return final_state, self._rows, self._infection_days, self._transmitters, self._num_infections
+
+
+def _worker_main(connection, worker):
+    """
+    The main loop of a worker process: runs the methods of the worker by the messages of the simulation
+    """
+    while True:
+        message = connection.recv()
+        if message is None:
+            break
+        name, args = message
+        try:
+            connection.send(('ok', getattr(worker, name)(*args)))
+        except Exception:
+            connection.send(('error', traceback.format_exc()))
+    connection.close()
+
+
+class _WorkerProcess(object):
+    """
+    A _PartitionWorker that runs in its own process, and is called through a pipe
+    """
+    __slots__ = ('_connection', '_process')
+
+    def __init__(self, context, worker):
+        self._connection, child_connection = context.Pipe()
+        self._process = context.Process(target=_worker_main, args=(child_connection, worker), daemon=True)
+        self._process.start()
+        child_connection.close()
+
+    def send(self, name, args):
+        self._connection.send((name, args))
+
+    def recv(self):
+        status, result = self._connection.recv()
+        if status == 'error':
+            raise RuntimeError("A partition worker failed:\n" + result)
+        return result
+
+    def close(self):
+        self._connection.send(None)
+        self._process.join()
+
+
+class _InProcessWorker(object):
+    """
+    A _PartitionWorker that runs in the process of the simulation, with the interface of _WorkerProcess
+    """
+    __slots__ = ('_worker', '_result')
+
+    def __init__(self, worker):
+        self._worker = worker
+        self._result = None
+
+    def send(self, name, args):
+        self._result = getattr(self._worker, name)(*args)
+
+    def recv(self):
+        result, self._result = self._result, None
+        return result
+
+    def close(self):
+        pass
+
+
+class PartitionedArraySimulation(object):
+    """
+    An alternative to ArraySimulation for a World of many cities (e.g. the entire country),
+    which splits the people by the cities of their households between several worker processes.
+    Each worker simulates its own people in all of their environments, in the same model as ArraySimulation,
+    and the environments with members in several workers (workplaces, since the other environments are
+    within a city) are synchronized once a day in two exchanges through pipes:
+    1. The workers send their infection sources in the shared environments, and get the merged sources of all the
+    workers, so each worker infects its people with the total weights of the environments.
+    2. The workers send their numbers of infections in the shared environments (for the smoothed R of the sources)
+    and their parts of the day's statistics, which are merged here.
+    The random draws of each city are made from its own stream (see seed.py), and the sources are merged in the
+    order of (environment, city), so the results do not depend on the number of workers, or on which cities
+    each worker got.
+    Unlike ArraySimulation, the infector's disease state in the infection statistics is his state at the infection.
+
+    Currently supports the same interventions and initial infections as ArraySimulation.
+    """
+    __slots__ = (
+        '_verbosity',
+        '_arrays',
+        '_date',
+        '_initial_date',
+        '_day',
+        'interventions',
+        'stats',
+        'counters',
+        'stop_early',
+        'stop_condition',
+        'last_day_to_record_r',
+        'num_r_days',
+        'initial_infection_doc',
+        'num_days_to_run',
+        '_seed_sequence',
+        '_partition_of_city',
+        '_partition_rows',
+        '_initial_states',
+        '_workers',
+        '_shared_infections',
+        '_first_people_infected',
+        '_counter_city_indices',
+    )
+
+    def __init__(self, world, initial_date, interventions=None, stop_early=None, verbosity=False,
+                 outdir=os.path.join(os.path.dirname(os.path.dirname(__file__)), 'outputs'), collect_hood_data=True,
+                 stop_condition=None, num_workers=None, seed_sequence=None):
+        """
+        :param world: The World object that this simulation will run on (converted to an ArrayWorld)
+        :param initial_date: The starting date for the simulation
+        :param interventions: A list of the interventions applied in this simulation
+        :param stop_early: see Simulation
+        :param verbosity: Whether or not this simulation should print debug info
+        :param outdir: The path of the directory output files
+        should be written into
+        :param collect_hood_data: see Simulation
+        :param stop_condition: see Simulation
+        :param num_workers: int number of worker processes, the number of CPUs if None.
+        With 1 worker (or when running inside a daemonic process, like the workers of a multiprocessing pool),
+        the partition is simulated in this process (run() runs the tasks of this engine outside of its pool)
+        :param seed_sequence: numpy SeedSequence of the random stream of the simulation (see seed.seed_sequence),
+        if None it is seeded from the global numpy random generator
+        """
+        if interventions is None:
+            interventions = []
+        if num_workers is None:
+            num_workers = os.cpu_count()
+        if seed_sequence is None:
+            seed_sequence = np.random.SeedSequence(np.random.randint(2 ** 32, size=4, dtype=np.uint32))
+        self._verbosity = verbosity
+        self._arrays = arrays = ArrayWorld.from_world(world)
+        self._date = initial_date
+        self._initial_date = deepcopy(initial_date)
+        self._day = 0
+        self._seed_sequence = seed_sequence
+        self.interventions = interventions
+        self.stats = Statistics(outdir, world, collect_hood_data)
+        self.counters = PopulationCounters(world)
+        self._counter_city_indices = np.array(
+            [self.counters.city_index(city_name) for city_name in arrays.city_names], dtype=np.int64
+        )
+        for intervention in interventions:
+            self.stats.add_intervention(intervention)
+
+        self.stop_early = stop_early
+        self.stop_condition = stop_condition
+        self.last_day_to_record_r = None
+        self.num_r_days = None
+        if self.stop_early is not None:
+            name_stop, self.num_r_days = self.stop_early
+            self.last_day_to_record_r = initial_date + timedelta(days=self.num_r_days)
+            assert name_stop == "r", "Other premature stops are not yet supported"
+        self.initial_infection_doc = None
+        self.num_days_to_run = None
+        self._shared_infections = (np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64))
+        self._first_people_infected = False
+
+        people = world.all_people()
+        self._initial_states = np.array([p.get_disease_state().value for p in people], dtype=np.int8)
+        last_states = np.array([
+            _NO_STATE if p.get_last_state() is None else p.get_last_state().disease_state.value for p in people
+        ], dtype=np.int8)
+        is_changed = np.array([p._changed for p in people], dtype=bool)
+        routine_changes = []
+        interventions_rng = np.random.default_rng(seed.sub_sequence(seed_sequence, 'interventions'))
+        for intervention in interventions:
+            members, values = compute_routine_changes(arrays, intervention, people, interventions_rng)
+            routine_changes.append(((intervention.start_date - initial_date).days, True, intervention._key, members, values))
+            routine_changes.append(((intervention.end_date - initial_date).days, False, intervention._key, members, None))
+
+        self._partition_of_city = self._partition_cities(arrays, num_workers)
+        num_partitions = int(self._partition_of_city.max()) + 1
+        partition_of_person = self._partition_of_city[arrays.city_codes]
+        self._partition_rows = [np.flatnonzero(partition_of_person == partition) for partition in range(num_partitions)]
+        member_partitions = partition_of_person[arrays.member_people]
+        lowest = np.full(arrays.num_envs, num_partitions, dtype=np.int64)
+        highest = np.full(arrays.num_envs, -1, dtype=np.int64)
+        np.minimum.at(lowest, arrays.member_envs, member_partitions)
+        np.maximum.at(highest, arrays.member_envs, member_partitions)
+        is_shared = highest > lowest
+
+        workers = []
+        for partition, rows in enumerate(self._partition_rows):
+            partition_members = arrays.members_of_people(rows)
+            worker_routine_changes = {}
+            for day, is_add, key, members, values in routine_changes:
+                is_own = member_partitions[members] == partition
+                worker_routine_changes.setdefault(day, []).append((
+                    is_add, key, np.searchsorted(partition_members, members[is_own]),
+                    None if values is None else values[is_own]
+                ))
+            cities = np.flatnonzero(self._partition_of_city == partition)
+            workers.append(_PartitionWorker(
+                arrays, rows, is_shared,
+                {int(city): seed.sub_sequence(seed_sequence, 'city', arrays.city_names[city]) for city in cities},
+                self._initial_states[rows].copy(), last_states[rows].copy(), np.flatnonzero(is_changed[rows]),
+                worker_routine_changes
+            ))
+        if num_partitions > 1 and mp.current_process().daemon:
+            log.warning(
+                "PartitionedArraySimulation runs in a daemonic process, which can't start worker processes, "
+                "so its %d partitions are simulated in this process", num_partitions
+            )
+        if num_partitions == 1 or mp.current_process().daemon:
+            self._workers = [_InProcessWorker(worker) for worker in workers]
+        else:
+            start_methods = mp.get_all_start_methods()
+            # With fork the workers get their partitions without pickling them
+            context = mp.get_context('fork' if 'fork' in start_methods else 'spawn')
+            self._workers = [_WorkerProcess(context, worker) for worker in workers]
+
+    @staticmethod
+    def _partition_cities(arrays, num_partitions):
+        """
+        Split the cities between the partitions, so the partitions have about the same number of member entries:
+        each city (from the largest) goes to the partition that has the least members so far
+        :return: numpy int array of the partition of each city code
+        """
+        city_sizes = np.bincount(arrays.city_codes[arrays.member_people], minlength=len(arrays.city_names))
+        num_partitions = max(1, min(num_partitions, len(arrays.city_names)))
+        partition_sizes = np.zeros(num_partitions, dtype=np.int64)
+        partition_of_city = np.zeros(len(arrays.city_names), dtype=np.int64)
+        for city in np.argsort(-city_sizes, kind='stable'):
+            partition = int(np.argmin(partition_sizes))
+            partition_of_city[city] = partition
+            partition_sizes[partition] += city_sizes[city]
+        # Drop the partitions that got no cities
+        used = np.unique(partition_of_city)
+        return np.searchsorted(used, partition_of_city)
+
+    @property
+    def num_partitions(self):
+        return len(self._workers)
+
+    def _call(self, name, args_of_workers):
+        """
+        Run a method on all the workers at once
+        :param args_of_workers: list of the args tuple of each worker
+        :return: list of the results of the workers
+        """
+        for worker, args in zip(self._workers, args_of_workers):
+            worker.send(name, args)
+        return [worker.recv() for worker in self._workers]
+
+    def _call_all(self, name, *args):
+        return self._call(name, [args] * len(self._workers))
+
+    def close(self):
+        """
+        Stop the worker processes
+        """
+        for worker in self._workers:
+            worker.close()
+        self._workers = []
+
+    def _rows_by_partition(self, rows):
+        """
+        :param rows: numpy int array of global rows
+        :return: list of the numpy arrays of the local rows of the given rows in each partition
+        """
+        partitions = self._partition_of_city[self._arrays.city_codes[rows]]
+        return [
+            np.searchsorted(partition_rows, rows[partitions == partition])
+            for partition, partition_rows in enumerate(self._partition_rows)
+        ]
+
+    def infect_random_set(self, num_infected: int, infection_doc: str, per_to_immune=0.0, Immune_compliance: float = 1,
+                          order: ORDER = ORDER.NONE, city_name=None, min_age=0, people_per_day=1):
+        """
+        Infect a uniformly random initial set of susceptible people (see Simulation.infect_random_set)
+        Immunization is not supported yet.
+        """
+        assert isinstance(num_infected, int)
+        assert self.initial_infection_doc is None
+        if per_to_immune:
+            raise NotImplementedError("PartitionedArraySimulation does not support immunization")
+        self.initial_infection_doc = infection_doc
+        is_candidate = self._initial_states == DiseaseState.SUSCEPTIBLE.value
+        if city_name is not None:
+            is_candidate &= self._arrays.city_codes == self._arrays.city_names.index(city_name)
+        candidates = np.flatnonzero(is_candidate)
+        rng = np.random.default_rng(seed.sub_sequence(self._seed_sequence, 'initial_infection'))
+        rows = np.sort(rng.choice(candidates, min(num_infected, len(candidates)), replace=False))
+        self._call('infect_initial', [
+            (partition_rows, self._arrays.initial_group_index) for partition_rows in self._rows_by_partition(rows)
+        ])
+
+    def infect_chosen_set(self, infection_datas, infection_doc):
+        """
+        Infect a chosen and specific set of people, with given seir times (see Simulation.infect_chosen_set)
+        :param infection_datas: list of (id, date, seir_times) for each person to infect
+        :param infection_doc: str to doc the infection for inputs file
+        """
+        assert self.initial_infection_doc is None
+        self.initial_infection_doc = infection_doc
+        id_to_row = {person_id: row for row, person_id in enumerate(self._arrays.person_ids)}
+        rows, days, new_states = [], [], []
+        infected = []
+        for person_id, infection_date, seir_times in infection_datas:
+            row = id_to_row[person_id]
+            infected.append(row)
+            day = (infection_date - self._initial_date).days
+            for i in range(1, len(seir_times)):
+                day += seir_times[i - 1][1].days
+                rows.append(row)
+                days.append(day)
+                new_states.append(seir_times[i][0].value)
+        infected = np.array(infected, dtype=np.int64)
+        rows = np.array(rows, dtype=np.int64)
+        days = np.array(days, dtype=np.int64)
+        new_states = np.array(new_states, dtype=np.int8)
+        transition_partitions = self._partition_of_city[self._arrays.city_codes[rows]]
+        self._call('infect_chosen', [
+            (
+                infected_rows, self._arrays.initial_group_index, np.searchsorted(partition_rows, rows[is_own]),
+                days[is_own], new_states[is_own]
+            )
+            for partition, (partition_rows, infected_rows) in enumerate(
+                zip(self._partition_rows, self._rows_by_partition(infected))
+            )
+            for is_own in [transition_partitions == partition]
+        ])
+
+    def simulate_day(self):
+        """
+        Simulate one day of the simulation, in the same steps as ArraySimulation.simulate_day,
+        with the workers synchronized on the shared environments (see the class doc)
+        """
+        shared_contributions = self._call_all('begin_day', self._day, *self._shared_infections)
+        merged = _Contributions.concatenate(shared_contributions).sorted()
+        record_first_people = self.last_day_to_record_r is not None and self._date <= self.last_day_to_record_r
+        results = self._call_all('propagate_and_end_day', merged, record_first_people)
+
+        shared_envs = np.concatenate([envs for envs, _, _ in results])
+        shared_counts = np.concatenate([counts for _, counts, _ in results])
+        envs, inverse = np.unique(shared_envs, return_inverse=True)
+        self._shared_infections = (envs, np.bincount(inverse, weights=shared_counts, minlength=len(envs)).astype(np.int64))
+
+        person_count = Counter()
+        infected_today_stats = []
+        hood_deltas = Counter()
+        self._first_people_infected = False
+        for _, _, (worker_person_count, worker_infected_stats, worker_hood_deltas, counter_changes,
+                   first_people_infected) in results:
+            person_count.update(worker_person_count)
+            infected_today_stats.extend(worker_infected_stats)
+            hood_deltas.update(worker_hood_deltas)
+            last_states, states, ages, cities = counter_changes
+            self.counters.update_from_arrays(last_states, states, ages, self._counter_city_indices[cities])
+            self._first_people_infected |= first_people_infected
+        self.counters.end_day()
+        if self._verbosity and self._date.weekday() == 6:
+            log.info("------ day-{}: disease state ------------".format(self._date))
+            log.info(self.counters.state_counts())
+
+        daily_data = DayStatistics.from_counts(self._date, person_count, infected_today_stats)
+        self.stats.add_daily_data_from_hood_deltas(
+            daily_data, {hood: delta for hood, delta in hood_deltas.items() if delta != 0}
+        )
+        self._date += timedelta(days=1)
+        self._day += 1
+
+    def first_people_are_done(self):
+        """
+        see Simulation.first_people_are_done
+        """
+        if self.stop_early is None:
+            return False
+        return not self._first_people_infected
+
+    def should_stop(self):
+        """
+        see Simulation.should_stop
+        """
+        return self.stop_condition is not None and bool(self.stop_condition(self.counters))
+
+    def run_simulation(self, num_days, name, datas_to_plot=None, run_simulation=None, extensionsList=None):
+        """
+        The main loop of the simulation, see Simulation.run_simulation
+        Extensions are not supported, since they work on Person objects.
+        The worker processes are stopped at the end of the run.
+        """
+        assert self.num_days_to_run is None
+        if extensionsList:
+            raise NotImplementedError("PartitionedArraySimulation does not support extensions")
+        self.num_days_to_run = num_days
+        if datas_to_plot is None:
+            datas_to_plot = dict()
+        log.info("Starting simulation {} with {} partitions".format(name, self.num_partitions))
+        try:
+            for day in range(num_days):
+                self.simulate_day()
+                if self.stats.is_static() or self.first_people_are_done() or self.should_stop():
+                    if self._verbosity:
+                        log.info('simulation stopping after {} days'.format(day))
+                    break
+            results = self._call_all('finish', *self._shared_infections)
+        finally:
+            self.close()
+
+        num_people = self._arrays.num_people
+        infection_days = np.full(num_people, -1, dtype=np.int64)
+        transmitters = np.full(num_people, -1, dtype=np.int64)
+        num_infections = np.zeros(num_people, dtype=np.float64)
+        final_state = Counter()
+        for worker_final_state, rows, worker_infection_days, worker_transmitters, worker_num_infections in results:
+            final_state.update(worker_final_state)
+            infection_days[rows] = worker_infection_days
+            transmitters[rows] = worker_transmitters
+            num_infections[rows] = worker_num_infections
+        self.stats.mark_ending_from_counts(final_state)
+        self.stats.calc_r0_data_from_arrays(
+            self._initial_date, infection_days, transmitters, num_infections, self.num_r_days
+        )
+        write_simulation_outputs(self, self.stats, name, datas_to_plot)
@@ -1,27 +1,28 @@
 from copy import deepcopy
 from collections import Counter
 from datetime import timedelta
-from enum import Enum
 from functools import cmp_to_key
 import logging
 import os
 import random as random
 
+import numpy as np
+
 from src.seir import seir_times
 from src.seir.disease_state import DiseaseState
-from src.simulation.event import DayEvent
-from src.logs import Statistics, DayStatistics
-from src.world import Person
+from src.simulation.checkpoint import dump_checkpoint, load_checkpoint_file, dumps_checkpoint, loads_checkpoint
+from src.simulation.event import DayEvent, DiseaseStateTransition, StateChangeListener, \
+    apply_disease_state_transition
+from src.simulation.transition_queue import TransitionQueue
+from src.logs import Statistics, DayStatistics, DayInstrumentation, MemoryCensus
+from src.simulation.params import Params
+from src.world import Person, PopulationCounters, ROUTINE_CACHE
 from src.world.environments import InitialGroup,Household
+from src.util.Enumerations import ORDER
 
 
 log = logging.getLogger(__name__)
 
-class ORDER(Enum):
-    NONE =0,
-    ASCENDING=1,
-    DESCENDING=2,
-
 class Simulation(object):
     """
     An object which runs a single simulation, holding a world,
@@ -35,17 +36,27 @@ class Simulation(object):
         '_initial_date',
         'interventions',
         '_events',
+        '_transitions',
+        'state_change_listeners',
         'stats',
+        'counters',
         'stop_early',
+        'stop_condition',
         'last_day_to_record_r',
         'num_r_days',
         'first_infectious_people',
         'initial_infection_doc',
-        'num_days_to_run'
+        'num_days_to_run',
+        'num_days_simulated',
+        '_stopped',
+        '_extensions',
+        'instrumentation',
+        'memory_census'
     )
 
     def __init__(self, world, initial_date, interventions=None, stop_early=None, verbosity=False,
-                 outdir=os.path.join(os.path.dirname(os.path.dirname(__file__)), 'outputs')):
+                 outdir=os.path.join(os.path.dirname(os.path.dirname(__file__)), 'outputs'), collect_hood_data=True,
+                 stop_condition=None, instrument=False, memory_census_days=None):
         """
         :param world: The World object that this simulation will run on
         :param initial_date: The starting date for the simulation
@@ -58,6 +69,16 @@ class Simulation(object):
         :param verbosity: Whether or not this simulation should print debug info
         :param outdir: The path of the directory output files
         should be written into
+        :param collect_hood_data: Whether the statistics should save the number of infected people
+        in each neighborhood on each day
+        :param stop_condition: A function that gets the PopulationCounters of this simulation
+        at the end of each day, and returns True if the simulation should stop
+        (a module level function if the simulation should be checkpointed, see save_checkpoint)
+        :param instrument: Whether to record the time and the work of each phase of each day
+        (see DayInstrumentation), they are written next to the statistics when the run finishes
+        :param memory_census_days: An iterable of the numbers of days at whose end a census of the memory is taken
+        (see MemoryCensus, 1 is the end of the first day), None for no census.
+        The censuses are written next to the statistics when the run finishes
         """
         if interventions is None:
             interventions = []
@@ -67,7 +88,11 @@ class Simulation(object):
         self._initial_date = deepcopy(initial_date)
         self.interventions = interventions
         self._events = {}
-        self.stats = Statistics(outdir, world)
+        self._transitions = TransitionQueue(self._initial_date)
+        # dict from (old_state, new_state) to the list of the StateChangeListeners of that change
+        self.state_change_listeners = {}
+        self.stats = Statistics(outdir, world, collect_hood_data)
+        self.counters = PopulationCounters(world)
         # It's important that we sign people up before we init interventions!
         self._world.sign_all_people_up_to_environments()
         for intervention in interventions:
@@ -75,6 +100,7 @@ class Simulation(object):
 
         # attributes relevant for computing R data
         self.stop_early = stop_early
+        self.stop_condition = stop_condition
         self.last_day_to_record_r = None
         self.num_r_days = None
         if self.stop_early is not None:
@@ -85,6 +111,11 @@ class Simulation(object):
 
         self.initial_infection_doc = None
         self.num_days_to_run = None
+        self.num_days_simulated = 0
+        self._stopped = False
+        self._extensions = []
+        self.instrumentation = DayInstrumentation(instrument)
+        self.memory_census = MemoryCensus(memory_census_days) if memory_census_days is not None else None
 
         # save all the events that create the interventions behavior on the simulation
         for inter in self.interventions:
@@ -93,43 +124,65 @@ class Simulation(object):
     def simulate_day(self):
         """
         Simulate one day of the simulation. Does this in four steps:
-        1. Apply or remove registered events
-        (either applying intervention effects or
-        advancing the disease states of people)
+        1. Apply the disease state changes and the registered events of the day
+        (advancing the disease states of people or applying intervention effects)
         2. register people who changed weights to their environments
-        3. spread the infection throughout the environments
-        4. register the changes to the Statistics object
+        3. spread the infection throughout the (active) environments
+        4. register the changes to the Statistics object and the PopulationCounters
+        The time and the work of each step are recorded by self.instrumentation (when it's enabled)
         """
-        if self._date in self._events:
-            self._events[self._date].apply(self)
-            del self._events[self._date]
+        instrumentation = self.instrumentation
+        instrumentation.start_day(self._date)
+        num_transitions, num_events = self._apply_events_of_day(self._date)
+        instrumentation.end_phase('apply_events')
 
-        changed_population = [
-            person for person in self._world.all_people() if person._changed
-        ]
-
-        for individual in changed_population:
+        changed_people = self._world.changed_people()
+        for individual in changed_people:
             individual.register_to_daily_environments()
+        instrumentation.end_phase('register_routines')
 
-        for env in self._world.all_environments:
+        active_environments = self._world.active_environments()
+        for env in active_environments:
             self.register_events(env.propagate_infection(self._date))
+        instrumentation.end_phase('propagate_infection')
+
+        changed_population = self._world.changed_people()
+        if instrumentation.enabled:
+            instrumentation.add_count('transitions_applied', num_transitions)
+            instrumentation.add_count('events_applied', num_events)
+            instrumentation.add_count('people_registered', len(changed_people))
+            instrumentation.add_count('people_changed', len(changed_population))
+            instrumentation.add_counts_by_env(
+                'environments_propagated', Counter(env.name for env in active_environments)
+            )
+            instrumentation.add_counts_by_env('infections', Counter(
+                person.get_infection_data().environment.name for person in changed_population
+                if person.get_disease_state() == DiseaseState.LATENT and
+                person.get_last_state() is not None and
+                person.get_last_state().disease_state == DiseaseState.SUSCEPTIBLE
+            ))
+            instrumentation.end_phase('instrumentation')
 
-        changed_population = [
-            person for person in self._world.all_people() if person._changed
-        ]
+        for person in changed_population:
+            self.counters.update_person(person)
+        self.counters.end_day()
+        instrumentation.end_phase('update_counters')
 
         if self._verbosity and self._date.weekday() == 6:
             log.info("------ day-{}: disease state ------------".format(self._date))
-            log.info(Counter([person.get_disease_state() for person in self._world.all_people()]))
+            log.info(self.counters.state_counts())
             log.info("------ Infected by environments ----------")
             log.info(Counter([person.get_infection_data().environment.name for person in self._world.all_people() if
                               person.get_disease_state().is_infected() and person.get_infection_data()]))
+            instrumentation.end_phase('verbose_log')
 
         daily_data = DayStatistics(
             self._date,
             changed_population
         )
+        instrumentation.end_phase('day_statistics')
         self.stats.add_daily_data(daily_data,self._world)
+        instrumentation.end_phase('add_daily_data')
         for person in changed_population:
             person.save_state()
 
@@ -137,8 +190,41 @@ class Simulation(object):
             for person in changed_population:
                 if person.is_infected:
                     self.first_infectious_people.add(person)
+        instrumentation.end_phase('save_states')
+        instrumentation.end_day()
         self._date += timedelta(days=1)
 
+    def _apply_events_of_day(self, date):
+        """
+        Apply the disease state changes and then the events that are registered on the given date.
+        The changes are kept apart from the DayEvents (see TransitionQueue), so they are no longer interleaved
+        with the events by the order of their registration: all the changes of the date are applied first,
+        so an event of the date sees the disease states of that day, whenever the changes were registered.
+        Applying them may register more of them on the same date, so this repeats until there are none left.
+        :param date: datetime Date
+        :return: tuple of ints (number of disease state changes, number of events) that were applied
+        """
+        num_transitions = num_events = 0
+        while date in self._transitions or date in self._events:
+            transitions = self._transitions.pop(date)
+            num_transitions += len(transitions)
+            for person_id, old_state, new_state in transitions:
+                apply_disease_state_transition(
+                    self._world.get_person_from_id(person_id), old_state, new_state, self
+                )
+            if date in self._events:
+                day_event = self._events.pop(date)
+                num_events += len(day_event.hooks)
+                day_event.apply(self)
+        return num_transitions, num_events
+
+    def register_transition(self, transition):
+        """
+        Schedule the given disease state change on the simulation's transition queue
+        :param transition: DiseaseStateTransition
+        """
+        self._transitions.push(transition._date, transition.person.get_id(), transition.old_state, transition.new_state)
+
     def register_event_on_day(self, event, date):
         """
         hook the given event to the given date, so in that day this event will happen.
@@ -152,12 +238,21 @@ class Simulation(object):
     def register_events(self, event_list):
         """
         Add all the given events to their dates on the simulation.
-        This applies only to DayEvents that need to be triggered on a specific date.
+        This applies only to DayEvents that need to be triggered on a specific date,
+        to DiseaseStateTransitions, which are kept in the transition queue,
+        and to StateChangeListeners, which are notified of the changes they listen to.
         :param event_list: list of Event objects
         """
         if not isinstance(event_list, list):
             event_list = [event_list]
         for event in event_list:
+            if isinstance(event, DiseaseStateTransition):
+                self.register_transition(event)
+                continue
+            if isinstance(event, StateChangeListener):
+                for states in event.states:
+                    self.state_change_listeners.setdefault(states, []).append(event)
+                continue
             assert isinstance(event, DayEvent), \
                 'Unexpected event type: {}'.format(type(event))
             self.register_event_on_day(event, event._date)
@@ -354,6 +449,101 @@ class Simulation(object):
             return False
         return all((not person.is_infected) for person in self.first_infectious_people)
 
+    def _get_checkpoint(self):
+        """
+        :return: dict of everything that is needed to continue this simulation from the end of the current day
+        with the same results as an uninterrupted run
+        """
+        return {
+            'simulation': self,
+            'registries_order': self._world.get_registries_order(),
+            'params': Params.loader(),
+            'random_state': random.getstate(),
+            'numpy_random_state': np.random.get_state(),
+        }
+
+    @staticmethod
+    def _from_checkpoint(checkpoint):
+        """
+        :param checkpoint: dict made by _get_checkpoint (and pickled)
+        :return: the Simulation of the checkpoint, after restoring the state of the random generators
+        """
+        assert checkpoint['params'] == Params.loader(), \
+            "Trying to load a checkpoint corresponding to different params!"
+        simulation = checkpoint['simulation']
+        simulation._world.restore_registries_order(*checkpoint['registries_order'])
+        random.setstate(checkpoint['random_state'])
+        np.random.set_state(checkpoint['numpy_random_state'])
+        return simulation
+
+    def save_checkpoint(self, path):
+        """
+        Save everything that is needed to continue this simulation from the end of the current day
+        with the same results as an uninterrupted run:
+        the simulation itself (the world, the pending events and transitions, the statistics, the extensions...),
+        the order of the changed people and active environments of the world and the state of the random generators.
+        The file is written by dump_checkpoint, so a crash while writing it never destroys the previous checkpoint.
+        :param path: str path of the checkpoint file
+        """
+        dump_checkpoint(self._get_checkpoint(), path, self._world.all_people())
+
+    @staticmethod
+    def load_checkpoint(path):
+        """
+        Load a simulation saved by save_checkpoint and restore the state of the random generators,
+        call resume_simulation on it to continue the run.
+        The params that are loaded should be the same as the ones of the saved simulation.
+        :param path: str path of the checkpoint file
+        :return: Simulation object
+        """
+        return Simulation._from_checkpoint(load_checkpoint_file(path))
+
+    def snapshot(self):
+        """
+        Save the state of this simulation in memory, like save_checkpoint.
+        Branches of the run can be made from it with from_snapshot (e.g. scenarios that differ only in
+        interventions that start after this day), instead of simulating the shared days again for each of them.
+        :return: bytes
+        """
+        return dumps_checkpoint(self._get_checkpoint(), self._world.all_people())
+
+    @staticmethod
+    def from_snapshot(snapshot, outdir=None, interventions=()):
+        """
+        Make a new copy of a simulation from its snapshot, and restore the state of the random generators,
+        so every copy continues with the same random numbers.
+        Call resume_simulation on it to continue the run.
+        :param snapshot: bytes made by snapshot
+        :param outdir: the path of the directory the output files of the copy should be written into,
+        None for the directory of the original simulation
+        :param interventions: list of interventions to add to the copy, see add_interventions
+        :return: Simulation object
+        """
+        simulation = Simulation._from_checkpoint(loads_checkpoint(snapshot))
+        if outdir is not None:
+            simulation.stats.set_output_path(outdir)
+        simulation.add_interventions(interventions)
+        return simulation
+
+    def add_interventions(self, interventions):
+        """
+        Add interventions to the simulation during its run (e.g. to a branch made with from_snapshot).
+        The interventions can not start before the current date of the simulation.
+        :param interventions: list of Intervention objects
+        """
+        for intervention in interventions:
+            assert intervention.start_date >= self._date, \
+                "Intervention starts on {}, before the current date {}".format(intervention.start_date, self._date)
+            self.interventions.append(intervention)
+            self.stats.add_intervention(intervention)
+            self.register_events(intervention.generate_events(self._world))
+
+    def should_stop(self):
+        """
+        checks the stop_condition given to this simulation on the current PopulationCounters
+        """
+        return self.stop_condition is not None and bool(self.stop_condition(self.counters))
+
     def infect_chosen_set(self, infection_datas, infection_doc):
         """
         Infect a chosen and specific set of people, given to the function, and register the events.
@@ -369,14 +559,14 @@ class Simulation(object):
             self.register_events(events)
 
         original_date = self._date
-        for date in sorted(self._events.keys()):
+        for date in sorted(set(self._events.keys()) | set(self._transitions.dates())):
             if date < original_date:
                 self._date = date
-                self._events[date].apply(self)
-                del self._events[date]
+                self._apply_events_of_day(date)
         self._date = original_date
 
-    def run_simulation(self, num_days, name, datas_to_plot=None,run_simulation = None,extensionsList = None):
+    def run_simulation(self, num_days, name, datas_to_plot=None,run_simulation = None,extensionsList = None,
+                       checkpoint_path=None, checkpoint_every=None):
         """
         This main loop of the simulation.
         It advances the simulation day by day and saves,
@@ -387,36 +577,87 @@ class Simulation(object):
         :param datas_to_plot: Indicates what sort of data we wish to plot
         and save at the end of the simulation.
         :param Extension: user's class that contains function that is called at the end of each day
+        :param checkpoint_path: str path of a checkpoint file to save every checkpoint_every days,
+        the run can be continued from it with load_checkpoint and resume_simulation
+        :param checkpoint_every: int number of days between checkpoints
         """
-        assert self.num_days_to_run is None
-        self.num_days_to_run = num_days
-        if datas_to_plot is None:
-            datas_to_plot = dict()
+        self.start_run(num_days, extensionsList)
         log.info("Starting simulation " + name)
+        self.simulate_days(num_days, checkpoint_path, checkpoint_every)
+        self.finish_run(name, datas_to_plot)
+
+    def resume_simulation(self, name, datas_to_plot=None, checkpoint_path=None, checkpoint_every=None):
+        """
+        Continue the main loop of a simulation that was loaded from a checkpoint or a snapshot
+        (see load_checkpoint and from_snapshot) from the day after it was saved, with the same extensions,
+        and save the output data when it finishes.
+        :param name: str - The name of this simulation, see run_simulation
+        :param datas_to_plot: see run_simulation
+        :param checkpoint_path: see run_simulation
+        :param checkpoint_every: see run_simulation
+        """
+        assert self.num_days_to_run is not None, "Only a simulation that was started can be resumed"
+        log.info("Resuming simulation {} after {} days".format(name, self.num_days_simulated))
+        self.simulate_days(self.num_days_to_run - self.num_days_simulated, checkpoint_path, checkpoint_every)
+        self.finish_run(name, datas_to_plot)
 
-        extensions = []
+    def start_run(self, num_days, extensionsList=None):
+        """
+        Start a run of the main loop, without simulating any day yet (see run_simulation)
+        :param num_days: int - The number of days to run
+        :param extensionsList: list of the names of the extensions to use, see run_simulation
+        """
+        assert self.num_days_to_run is None
+        self.num_days_to_run = num_days
+        self._extensions = []
         if extensionsList != None:
             for ExtName in extensionsList:
                 mod  = __import__('src.extensions.' + ExtName,fromlist=[ExtName])
                 ExtensionType = getattr(mod,ExtName)
-                extensions = extensions + [ExtensionType(self)]
-            
+                self._extensions = self._extensions + [ExtensionType(self)]
 
-        for day in range(num_days):
-            for ext in extensions:
+    def simulate_days(self, num_days, checkpoint_path=None, checkpoint_every=None):
+        """
+        Simulate the next days of a started run (see start_run), with its extensions,
+        until num_days were simulated, the run reached its number of days or one of its stopping conditions holds.
+        :param num_days: int - The maximal number of days to simulate
+        :param checkpoint_path: see run_simulation
+        :param checkpoint_every: see run_simulation
+        """
+        assert self.num_days_to_run is not None, "The run was not started"
+        assert (checkpoint_path is None) == (checkpoint_every is None), \
+            "checkpoint_path and checkpoint_every should be given together"
+        last_day = min(self.num_days_simulated + num_days, self.num_days_to_run)
+        while not self._stopped and self.num_days_simulated < last_day:
+            day = self.num_days_simulated
+            for ext in self._extensions:
                 ext.start_of_day_processing()
 
             self.simulate_day()
             #Call Extension function at the end of the day
-            for ext in extensions:
+            for ext in self._extensions:
                 ext.end_of_day_processing()
-                
-            if self.stats.is_static() or self.first_people_are_done():
+            self.num_days_simulated += 1
+            if self.memory_census is not None:
+                self.memory_census.on_day_end(self.num_days_simulated, self._date - timedelta(days=1))
+
+            if self.stats.is_static() or self.first_people_are_done() or self.should_stop():
                 if self._verbosity:
                     log.info('simulation stopping after {} days'.format(day))
+                self._stopped = True
                 break
-                
 
+            if checkpoint_path is not None and self.num_days_simulated % checkpoint_every == 0:
+                self.save_checkpoint(checkpoint_path)
+
+    def finish_run(self, name, datas_to_plot=None):
+        """
+        Save the output data of the run to the relevant files, see run_simulation
+        :param name: str - The name of this simulation
+        :param datas_to_plot: see run_simulation
+        """
+        if datas_to_plot is None:
+            datas_to_plot = dict()
         self.stats.mark_ending(self._world.all_people())
         self.stats.calc_r0_data(self._world.all_people(), self.num_r_days)
         self.stats.dump('statistics.pkl')
@@ -432,4 +673,11 @@ class Simulation(object):
         self.stats.write_daily_delta('daily_delta')
         self.stats.write_inputs(self)
         self.stats.write_interventions_inputs_csv()
+        if self.instrumentation.enabled:
+            self.stats.write_instrumentation(self.instrumentation)
+        if self._verbosity:
+            log.info("Routine cache: {}".format(ROUTINE_CACHE.get_stats()))
+        if self.memory_census is not None:
+            self.stats.write_memory_census(self.memory_census)
+            MemoryCensus.stop_tracing()
         
\ No newline at end of file
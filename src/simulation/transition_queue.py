@@ -0,0 +1,71 @@
+from array import array
+from datetime import timedelta
+
+from src.seir import DiseaseState
+
+_STATE_BY_VALUE = {state.value: state for state in DiseaseState}
+
+
+class TransitionQueue(object):
+    """
+    A calendar queue of the scheduled disease state changes of a simulation.
+    The changes are kept in buckets by their day offset from the initial date,
+    and each bucket is three flat arrays - the person ids, the old states and the new states (by value),
+    instead of an event object per change.
+    """
+    __slots__ = ('_initial_date', '_buckets', '_size')
+
+    def __init__(self, initial_date):
+        """
+        :param initial_date: datetime.date, day offsets are counted from it
+        """
+        self._initial_date = initial_date
+        self._buckets = {}
+        self._size = 0
+
+    def _day_of(self, date):
+        return (date - self._initial_date).days
+
+    def push(self, date, person_id, old_state, new_state):
+        """
+        Schedule a disease state change
+        :param date: datetime.date of the change
+        :param person_id: int id of the person
+        :param old_state: DiseaseState
+        :param new_state: DiseaseState
+        """
+        day = self._day_of(date)
+        bucket = self._buckets.get(day)
+        if bucket is None:
+            bucket = self._buckets[day] = (array('q'), array('b'), array('b'))
+        bucket[0].append(person_id)
+        bucket[1].append(old_state.value)
+        bucket[2].append(new_state.value)
+        self._size += 1
+
+    def pop(self, date):
+        """
+        Remove and return all the changes of the given date, in the order they were pushed
+        :param date: datetime.date
+        :return: list of (person_id, old_state, new_state)
+        """
+        bucket = self._buckets.pop(self._day_of(date), None)
+        if bucket is None:
+            return []
+        self._size -= len(bucket[0])
+        return [
+            (person_id, _STATE_BY_VALUE[old_value], _STATE_BY_VALUE[new_value])
+            for person_id, old_value, new_value in zip(*bucket)
+        ]
+
+    def dates(self):
+        """
+        :return: sorted list of the dates that have scheduled changes
+        """
+        return [self._initial_date + timedelta(days=day) for day in sorted(self._buckets)]
+
+    def __contains__(self, date):
+        return self._day_of(date) in self._buckets
+
+    def __len__(self):
+        return self._size
@@ -2,4 +2,23 @@ from enum import Enum
 
 class machine_type(Enum):
     SIR = 1 
-    SIRS = 2
\ No newline at end of file
+    SIRS = 2
+
+
+class SimulationEngine(Enum):
+    """
+    The implementation that runs a simulation job: Simulation (Person objects and events),
+    ArraySimulation (numpy arrays) or PartitionedArraySimulation (numpy arrays, split by city between processes)
+    """
+    OBJECTS = 1
+    ARRAYS = 2
+    PARTITIONED = 3
+
+
+class ORDER(Enum):
+    """
+    The order in which people (or households) are chosen, e.g. to be immuned: random, by ascending or descending age
+    """
+    NONE =0,
+    ASCENDING=1,
+    DESCENDING=2,
@@ -1,11 +1,17 @@
 from src.util.distribution import Distribution, DiscreteDistribution
 from src.util.divide_array import divide_array, divide_weighted_array
-from src.util.Enumerations import machine_type
+from src.util.indexed_set import IndexedSet
+from src.util.weighted_sampler import WeightedSampler
+from src.util.Enumerations import machine_type, SimulationEngine, ORDER
 
 __all__ = [
     'Distribution',
     'DiscreteDistribution',
     'divide_array',
     'divide_weighted_array',
+    'IndexedSet',
+    'WeightedSampler',
     'machine_type',
+    'SimulationEngine',
+    'ORDER',
 ]
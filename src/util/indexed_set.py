@@ -0,0 +1,49 @@
+import random as _random
+
+
+class IndexedSet(object):
+    """
+    A set that also keeps its items in a list,
+    so adding, removing and membership are O(1), and sampling k uniform items is O(k).
+    """
+    __slots__ = ('_items', '_indices')
+
+    def __init__(self, items=()):
+        self._items = []
+        self._indices = {}
+        for item in items:
+            self.add(item)
+
+    def add(self, item):
+        if item in self._indices:
+            return
+        self._indices[item] = len(self._items)
+        self._items.append(item)
+
+    def discard(self, item):
+        """
+        Remove the item if it is in the set, by moving the last item to its place
+        """
+        index = self._indices.pop(item, None)
+        if index is None:
+            return
+        last = self._items.pop()
+        if index < len(self._items):
+            self._items[index] = last
+            self._indices[last] = index
+
+    def sample(self, k):
+        """
+        :param k: int, at most the size of the set
+        :return: list of k distinct items, chosen uniformly
+        """
+        return [self._items[i] for i in _random.sample(range(len(self._items)), k)]
+
+    def __contains__(self, item):
+        return item in self._indices
+
+    def __iter__(self):
+        return iter(self._items)
+
+    def __len__(self):
+        return len(self._items)
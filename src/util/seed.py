@@ -1,3 +1,4 @@
+import hashlib
 import random
 import numpy as np
 
@@ -14,3 +15,65 @@ def set_random_seed():
         random.seed(CONSTANT_SEED)
         np.random.seed(CONSTANT_SEED)
 
+
+def new_entropy():
+    """
+    The root entropy of a run, all the random streams of the run are derived from it (see seed_sequence).
+    :return: CONSTANT_SEED, or if it is None, a fresh entropy from the OS
+    (it is written to the inputs.txt of each simulation to be able to repeat the run, see Statistics.set_random_seed)
+    """
+    if CONSTANT_SEED is not None:
+        return CONSTANT_SEED
+    return np.random.SeedSequence().entropy
+
+
+def _stream_key(key):
+    """
+    Converts a key of a random stream to a non negative int, that does not change between processes and runs
+    (unlike hash() of a str)
+    """
+    if isinstance(key, (int, np.integer)) and not isinstance(key, bool) and key >= 0:
+        return int(key)
+    return int.from_bytes(hashlib.sha256(repr(key).encode()).digest()[:16], 'little')
+
+
+def seed_sequence(entropy, *keys):
+    """
+    Derives an independent random stream from the root entropy by a path of keys,
+    e.g. seed_sequence(entropy, 'my_job', 'sample_3', 'simulation').
+    The stream depends only on the entropy and the keys, and not on the order in which streams are made,
+    or on the process that makes them, so every job, replicate, city, etc. that has its own keys gets
+    the same random numbers whether the run is serial, parallel or in a different order.
+    :param entropy: int root entropy (see new_entropy)
+    :param keys: the path of the stream, ints, strs or other objects with a stable repr
+    :return: numpy SeedSequence
+    """
+    return np.random.SeedSequence(entropy, spawn_key=tuple(_stream_key(key) for key in keys))
+
+
+def sub_sequence(sequence, *keys):
+    """
+    :param sequence: numpy SeedSequence of a stream
+    :return: numpy SeedSequence of the sub stream of the given keys,
+    i.e sub_sequence(seed_sequence(entropy, *keys1), *keys2) is seed_sequence(entropy, *(keys1 + keys2))
+    """
+    return np.random.SeedSequence(
+        sequence.entropy, spawn_key=tuple(sequence.spawn_key) + tuple(_stream_key(key) for key in keys)
+    )
+
+
+def make_generator(entropy, *keys):
+    """
+    :return: numpy Generator of the stream of the given keys (see seed_sequence)
+    """
+    return np.random.default_rng(seed_sequence(entropy, *keys))
+
+
+def seed_global_generators(sequence):
+    """
+    Seeds the global generators of the random and numpy.random modules, that most of the code draws from,
+    with a random stream
+    :param sequence: numpy SeedSequence (see seed_sequence)
+    """
+    random.seed(int.from_bytes(sequence.generate_state(8).tobytes(), 'little'))
+    np.random.set_state(np.random.RandomState(np.random.MT19937(sequence)).get_state())
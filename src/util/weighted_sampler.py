@@ -0,0 +1,136 @@
+import random as _random
+
+
+class WeightedSampler(object):
+    """
+    A dynamic distribution on items, where the probability of each item is proportional to its weight.
+    It is based on a Fenwick (binary indexed) tree, so setting or removing the weight of an item
+    and sampling an item take O(log n), and the distribution never has to be rebuilt from scratch
+    when the weights change.
+    Removed items leave free slots in the tree, which are reused by the next added items.
+    """
+    __slots__ = ('_tree', '_weights', '_items', '_indices', '_free_indices', '_num_updates')
+
+    def __init__(self):
+        # _tree is 1-based, _tree[i] holds the sum of the weights in the slots (i - lowbit(i), i]
+        self._tree = [0.0]
+        self._weights = []
+        self._items = []
+        self._indices = {}
+        self._free_indices = []
+        self._num_updates = 0
+
+    def _add(self, index, delta):
+        i = index + 1
+        tree = self._tree
+        size = len(tree)
+        while i < size:
+            tree[i] += delta
+            i += i & -i
+        self._num_updates += 1
+
+    def _prefix_sum(self, num_slots):
+        total = 0.0
+        i = num_slots
+        tree = self._tree
+        while i > 0:
+            total += tree[i]
+            i -= i & -i
+        return total
+
+    def _new_index(self):
+        if self._free_indices:
+            return self._free_indices.pop()
+        index = len(self._weights)
+        self._weights.append(0.0)
+        self._items.append(None)
+        i = index + 1
+        self._tree.append(self._prefix_sum(i - 1) - self._prefix_sum(i - (i & -i)))
+        return index
+
+    def _rebuild(self):
+        """
+        Build the tree again from the weights, to drop the floating point errors of many updates
+        """
+        tree = [0.0] + list(self._weights)
+        size = len(tree)
+        for i in range(1, size):
+            parent = i + (i & -i)
+            if parent < size:
+                tree[parent] += tree[i]
+        self._tree = tree
+        self._num_updates = 0
+
+    def set(self, item, weight):
+        """
+        Set (or add) the weight of the given item
+        :param item: hashable object
+        :param weight: non negative float
+        """
+        assert weight >= 0
+        index = self._indices.get(item)
+        if index is None:
+            index = self._new_index()
+            self._indices[item] = index
+            self._items[index] = item
+        if weight != self._weights[index]:
+            self._add(index, weight - self._weights[index])
+            self._weights[index] = weight
+        if self._num_updates > 2 * len(self._weights) + 64:
+            self._rebuild()
+
+    def remove(self, item):
+        """
+        Remove the given item, if it is in the distribution
+        """
+        index = self._indices.pop(item, None)
+        if index is None:
+            return
+        if self._weights[index] != 0:
+            self._add(index, -self._weights[index])
+            self._weights[index] = 0.0
+        self._items[index] = None
+        self._free_indices.append(index)
+
+    def total(self):
+        """
+        :return: The sum of the weights of all the items
+        """
+        return self._prefix_sum(len(self._weights))
+
+    def sample(self):
+        """
+        :return: A random item, chosen with probability proportional to its weight. The total weight must be positive.
+        """
+        target = _random.random() * self.total()
+        tree = self._tree
+        size = len(tree)
+        position = 0
+        step = 1 << (size - 1).bit_length()
+        while step:
+            next_position = position + step
+            if next_position < size and tree[next_position] <= target:
+                position = next_position
+                target -= tree[position]
+            step >>= 1
+        index = min(position, len(self._weights) - 1)
+        if self._weights[index] <= 0:
+            # Only possible due to floating point errors
+            self._rebuild()
+            return self.sample()
+        return self._items[index]
+
+    def get_weight(self, item):
+        return self._weights[self._indices[item]]
+
+    def items(self):
+        """
+        :return: iterator of (item, weight) pairs
+        """
+        return ((item, self._weights[index]) for item, index in self._indices.items())
+
+    def __contains__(self, item):
+        return item in self._indices
+
+    def __len__(self):
+        return len(self._indices)
@@ -1,16 +1,28 @@
 from src.world.person import Person, RedactedPerson, RedactedPersonAndEnv
+from src.world.environment_schema import EnvironmentSchema
+from src.world.routine_cache import FrozenRoutine, RoutineCache, ROUTINE_CACHE
+from src.world.people_columns import PeopleColumns
 from src.world.world import World
 from src.world.infection_data import InfectionData
 import src.world.city_data
 import src.world.population_generation
 import src.world.environments
+from src.world.array_world import ArrayWorld
+from src.world.population_counters import PopulationCounters
 
 __all__ = [
     'Person',
     'RedactedPerson',
     'RedactedPersonAndEnv',
+    'EnvironmentSchema',
+    'FrozenRoutine',
+    'RoutineCache',
+    'ROUTINE_CACHE',
+    'PeopleColumns',
     'World',
     'InfectionData',
+    'ArrayWorld',
+    'PopulationCounters',
     'city_data',
     'population_generation',
     'environments'
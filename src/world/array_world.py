@@ -0,0 +1,158 @@
+import numpy as np
+
+from src.world.environments import InitialGroup
+
+
+def gather_csr_rows(ptr, rows):
+    """
+    Returns the positions of all the entries of the given rows of a CSR (compressed sparse row) structure,
+    concatenated by the order of the rows.
+    :param ptr: numpy int array, row i spans the positions ptr[i]:ptr[i+1]
+    :param rows: numpy int array of row indices
+    :return: numpy int array of positions
+    """
+    starts = ptr[rows]
+    counts = ptr[rows + 1] - starts
+    total = int(counts.sum())
+    if total == 0:
+        return np.zeros(0, dtype=np.int64)
+    return np.repeat(starts - (np.cumsum(counts) - counts), counts) + np.arange(total)
+
+
+class ArrayWorld(object):
+    """
+    A struct-of-arrays snapshot of a World, used by ArraySimulation.
+    People and environments are indexed by their position (row) in the arrays rather than by objects.
+    Each (person, environment) pair of the population is a 'member' entry,
+    and the members are held both by person (person_ptr) and by environment (env_ptr, env_order),
+    in CSR (compressed sparse row) form.
+    The last environment is always the initial group, that has no members.
+    """
+    __slots__ = (
+        'num_people',
+        'person_ids',
+        'ages',
+        'infectiousness_probs',
+        'city_codes',
+        'city_names',
+        'hood_ids',
+        'num_envs',
+        'env_name_codes',
+        'env_names',
+        'env_full_name_codes',
+        'env_full_names',
+        'contact_probs',
+        'initial_group_index',
+        'member_people',
+        'member_envs',
+        'member_weights',
+        'person_ptr',
+        'env_ptr',
+        'env_order',
+        '_env_name_to_code',
+    )
+
+    @classmethod
+    def from_world(cls, world):
+        """
+        Build the arrays of the given World.
+        The routine weights of the members are taken from the people's current routines.
+        :param world: World object
+        :return: ArrayWorld
+        """
+        self = cls()
+        people = world.all_people()
+        self.num_people = len(people)
+        self.person_ids = np.array([p.get_id() for p in people], dtype=np.int64)
+        self.ages = np.array([p.get_age() for p in people], dtype=np.int16)
+        self.infectiousness_probs = np.array([p._infectiousness_prob for p in people], dtype=np.float64)
+
+        city_names = {}
+        city_codes = []
+        for person in people:
+            city_name = person.get_city_name() if person.has_environment('household') else None
+            city_codes.append(city_names.setdefault(city_name, len(city_names)))
+        self.city_codes = np.array(city_codes, dtype=np.int32)
+        self.city_names = list(city_names)
+        self.hood_ids = np.array([
+            p.get_neighberhood().get_neighborhood_id() if p.get_neighberhood() is not None else -1
+            for p in people
+        ], dtype=np.int64)
+
+        env_id_to_index = {}
+        environments = []
+
+        def env_index(env):
+            if env._id not in env_id_to_index:
+                env_id_to_index[env._id] = len(environments)
+                environments.append(env)
+            return env_id_to_index[env._id]
+
+        for env in world.all_environments:
+            env_index(env)
+        member_people, member_envs, member_weights = [], [], []
+        person_counts = np.zeros(self.num_people, dtype=np.int64)
+        for row, person in enumerate(people):
+            routine = person.get_routine()
+            for env_name, env in person.get_environments().items():
+                member_people.append(row)
+                member_envs.append(env_index(env))
+                member_weights.append(routine[env_name])
+            person_counts[row] = len(routine)
+        self.initial_group_index = env_index(InitialGroup.initial_group())
+        self.num_envs = len(environments)
+
+        self._env_name_to_code = {}
+        self.env_name_codes = np.array([
+            self._env_name_to_code.setdefault(env.name, len(self._env_name_to_code)) for env in environments
+        ], dtype=np.int16)
+        self.env_names = list(self._env_name_to_code)
+        full_name_to_code = {}
+        self.env_full_name_codes = np.array([
+            full_name_to_code.setdefault(env._full_name, len(full_name_to_code)) for env in environments
+        ], dtype=np.int32)
+        self.env_full_names = list(full_name_to_code)
+        self.contact_probs = np.array([
+            getattr(env, '_contact_prob_between_each_two_people', 0.0) for env in environments
+        ], dtype=np.float64)
+
+        self.member_people = np.array(member_people, dtype=np.int64)
+        self.member_envs = np.array(member_envs, dtype=np.int64)
+        self.member_weights = np.array(member_weights, dtype=np.float64)
+        self.person_ptr = np.concatenate([[0], np.cumsum(person_counts)])
+        self.env_order = np.argsort(self.member_envs, kind='stable')
+        self.env_ptr = np.concatenate([[0], np.cumsum(np.bincount(self.member_envs, minlength=self.num_envs))])
+        return self
+
+    def members_of_people(self, rows):
+        """
+        :param rows: numpy int array of person rows
+        :return: the member entries of the given people
+        """
+        return gather_csr_rows(self.person_ptr, rows)
+
+    def members_of_environments(self, envs):
+        """
+        :param envs: numpy int array of environment indices
+        :return: the member entries of the given environments, ordered by environment
+        """
+        return self.env_order[gather_csr_rows(self.env_ptr, envs)]
+
+    def member_index(self, row, env_name):
+        """
+        :param row: the person's row
+        :param env_name: short environment name, e.g. 'household'
+        :return: The member entry of the person in the environment of that name, or -1 if there is none
+        """
+        code = self._env_name_to_code.get(env_name)
+        if code is None:
+            return -1
+        for member in range(self.person_ptr[row], self.person_ptr[row + 1]):
+            if self.env_name_codes[self.member_envs[member]] == code:
+                return member
+        return -1
+
+    def __repr__(self):
+        return "ArrayWorld(num_people={}, num_envs={}, num_members={})".format(
+            self.num_people, self.num_envs, len(self.member_people)
+        )
@@ -0,0 +1,51 @@
+class EnvironmentSchema(object):
+    """
+    The names of the environments of a person (household, neighborhood_community, city_community, school, workplace...),
+    in the order they were added to him, and the index of each of them.
+    Schemas are interned, there is one schema object for each sequence of names (see get),
+    so all the people of a world with the same kinds of environments share one schema,
+    and each person only holds his environments (and his routine weights) as tuples in the order of his schema.
+    """
+    __slots__ = ('names', 'index', 'neighborhood_index')
+
+    _schemas = {}
+
+    def __init__(self, names):
+        """
+        Should not be called directly, use get
+        :param names: tuple of the str names of the environments
+        """
+        assert len(set(names)) == len(names), "Got duplicate environment names"
+        self.names = names
+        self.index = {name: i for i, name in enumerate(names)}
+        self.neighborhood_index = self.index.get('neighborhood_community')
+
+    @classmethod
+    def get(cls, names):
+        """
+        :param names: iterable of the str names of the environments
+        :return: the EnvironmentSchema of these names
+        """
+        names = tuple(names)
+        schema = cls._schemas.get(names)
+        if schema is None:
+            schema = cls._schemas[names] = cls(names)
+        return schema
+
+    def extended(self, name):
+        """
+        :param name: str name of an environment that is not in this schema
+        :return: the EnvironmentSchema of the names of this schema followed by the given name
+        """
+        assert name not in self.index, "Environment '%s' is already in the schema" % name
+        return self.get(self.names + (name,))
+
+    def __len__(self):
+        return len(self.names)
+
+    def __reduce__(self):
+        # Unpickled schemas are interned as well
+        return EnvironmentSchema.get, (self.names,)
+
+    def __repr__(self):
+        return 'EnvironmentSchema{}'.format(self.names)
@@ -24,7 +24,7 @@ class Environment(object):
     """
     Represents a place where a group of people can interact and infect each other.
     """
-    __slots__ = ('_id', '_attributes', '_full_name')
+    __slots__ = ('_id', '_attributes', '_full_name', '_active_registry')
     num_total_environments = 0
 
     def __init__(self, full_name):
@@ -35,6 +35,8 @@ class Environment(object):
         self._id = Environment.num_total_environments  # Used only for debugging purposes
         self._attributes = {}
         self._full_name = full_name
+        # The dict of active environments of the World this environment belongs to (set by the World)
+        self._active_registry = None
         Environment.num_total_environments += 1
 
     def __repr__(self):
@@ -49,6 +51,21 @@ class Environment(object):
         """
         raise NotImplementedError()
 
+    def is_active(self):
+        """
+        Whether the infection may propagate in this environment today.
+        Environments that don't track their infectious people are always considered active.
+        :return: bool
+        """
+        return True
+
+    def init_after_load(self):
+        """
+        Called when the World of this environment is unpickled (e.g. from the population cache),
+        to rebuild any state that populations cached by older versions don't have.
+        """
+        pass
+
     def propagate_infection(self, date):
         """
         Needs to be implemented for every subclass
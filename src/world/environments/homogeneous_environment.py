@@ -1,8 +1,13 @@
 import random
 from math import exp
 
+import numpy as np
+
 from src.world.environments.environment import Environment
-from src.util import Distribution
+from src.util import IndexedSet, WeightedSampler
+
+# Groups of susceptible people smaller than this draw the infection person by person
+SPARSE_SAMPLING_MIN_GROUP_SIZE = 16
 
 
 class HomogeneousEnvironment(Environment):
@@ -16,7 +21,10 @@ class HomogeneousEnvironment(Environment):
     __slots__ = (
         '_person_dict',
         '_infectious_people_and_weights',
-        '_contact_prob_between_each_two_people'
+        '_susceptible_people_by_weight',
+        '_contact_prob_between_each_two_people',
+        '_activity_multipliers',
+        '_activity_multiplier'
     )
 
     def __init__(self, contact_prob_between_each_two_people : float, full_name=None):
@@ -24,9 +32,16 @@ class HomogeneousEnvironment(Environment):
             full_name = self.name
         super(HomogeneousEnvironment, self).__init__(full_name)
         self._person_dict = {}
-        self._infectious_people_and_weights = {}
+        # The infectious people that come to the environment and their weights as infection sources
+        self._infectious_people_and_weights = WeightedSampler()
+        # The susceptible people that come to the environment, grouped by their weight
+        self._susceptible_people_by_weight = {}
         self._contact_prob_between_each_two_people = \
             contact_prob_between_each_two_people
+        # The multipliers of the activity of the whole environment by their keys (None when there are none),
+        # and their product, see add_activity_multiplier
+        self._activity_multipliers = None
+        self._activity_multiplier = 1
 
     def sign_up_for_today(self, person, weight):
         """
@@ -34,25 +49,124 @@ class HomogeneousEnvironment(Environment):
         This amount (weight) is based to 1 and may change with interventions.
         If the weight is zero, this person won't go to this rnviroment until a further change.
         """
+        self._discard_susceptible(person)
         if person.is_dead:
             self._person_dict.pop(person, None)
-            self._infectious_people_and_weights.pop(person, None)
+            self._infectious_people_and_weights.remove(person)
+            self._update_active_registry()
             return
 
         if person.is_infectious:
             total_weight = person.get_prob_to_infect_on_contact() * weight
-            self._infectious_people_and_weights[person] = total_weight
+            self._infectious_people_and_weights.set(person, total_weight)
         else:
-            self._infectious_people_and_weights.pop(person, None)
+            self._infectious_people_and_weights.remove(person)
+        self._update_active_registry()
 
         self._person_dict[person] = weight
+        if person.is_susceptible and weight > 0:
+            if weight not in self._susceptible_people_by_weight:
+                self._susceptible_people_by_weight[weight] = IndexedSet()
+            self._susceptible_people_by_weight[weight].add(person)
+
+    def _discard_susceptible(self, person):
+        """
+        Remove the person from the group of susceptible people of the weight he is signed up with
+        """
+        weight = self._person_dict.get(person)
+        group = self._susceptible_people_by_weight.get(weight)
+        if group is None:
+            return
+        group.discard(person)
+        if len(group) == 0:
+            del self._susceptible_people_by_weight[weight]
+
+    def add_activity_multiplier(self, key, multiplier):
+        """
+        Multiply the activity of the whole environment (e.g. close a school), as if the weights of all the people
+        that come to it were multiplied by the given multiplier, without changing the routines of the people.
+        This takes O(1), unlike a routine change of each of its people.
+        The multipliers of different keys multiply each other.
+        :param key: str key of the multiplier (e.g. the key of the intervention)
+        :param multiplier: float multiplier, 0 means nobody comes to the environment
+        """
+        if self._activity_multipliers is None:
+            self._activity_multipliers = {}
+        assert key not in self._activity_multipliers, \
+            "Activity multiplier '%s' is already set on %s" % (key, self)
+        self._activity_multipliers[key] = multiplier
+        self._update_activity_multiplier()
+
+    def remove_activity_multiplier(self, key):
+        """
+        Remove an activity multiplier that was added by add_activity_multiplier
+        :param key: str key of the multiplier
+        """
+        assert self._activity_multipliers is not None and key in self._activity_multipliers, \
+            "Activity multiplier '%s' is not set on %s" % (key, self)
+        del self._activity_multipliers[key]
+        if not self._activity_multipliers:
+            self._activity_multipliers = None
+        self._update_activity_multiplier()
+
+    def get_activity_multiplier(self):
+        """
+        :return: the product of the activity multipliers of the environment (1 when there are none)
+        """
+        return self._activity_multiplier
+
+    def _update_activity_multiplier(self):
+        multiplier = 1
+        if self._activity_multipliers is not None:
+            # Multiplied in a fixed order, so the product does not depend on the order they were added
+            for key in sorted(self._activity_multipliers):
+                multiplier *= self._activity_multipliers[key]
+        self._activity_multiplier = multiplier
+
+    def is_active(self):
+        """
+        The infection can only propagate here if someone infectious signed up
+        :return: bool
+        """
+        return len(self._infectious_people_and_weights) > 0
+
+    def _update_active_registry(self):
+        """
+        Register this environment as active in its World when it has infectious people, and unregister it otherwise,
+        so the simulation visits only the environments where the infection can spread.
+        """
+        if self._active_registry is None:
+            return
+        if len(self._infectious_people_and_weights) > 0:
+            self._active_registry[self._id] = self
+        else:
+            self._active_registry.pop(self._id, None)
+
+    def init_after_load(self):
+        if isinstance(self._infectious_people_and_weights, dict):
+            infectious_people_and_weights = self._infectious_people_and_weights
+            self._infectious_people_and_weights = WeightedSampler()
+            for person, weight in infectious_people_and_weights.items():
+                self._infectious_people_and_weights.set(person, weight)
+        if not hasattr(self, '_susceptible_people_by_weight'):
+            self._susceptible_people_by_weight = {}
+            for person, weight in self._person_dict.items():
+                if person.is_susceptible and weight > 0:
+                    if weight not in self._susceptible_people_by_weight:
+                        self._susceptible_people_by_weight[weight] = IndexedSet()
+                    self._susceptible_people_by_weight[weight].add(person)
+        if not hasattr(self, '_activity_multiplier'):
+            self._activity_multipliers = None
+            self._activity_multiplier = 1
 
     def clear(self):
         """
         Kick all the peole out of the environment
         """
         self._person_dict = {}
-        self._infectious_people_and_weights = {}
+        self._infectious_people_and_weights = WeightedSampler()
+        self._susceptible_people_by_weight = {}
+        self._update_active_registry()
 
     def propagate_infection(self, date):
         """
@@ -65,34 +179,39 @@ class HomogeneousEnvironment(Environment):
         hence the probability for person j to not get infected is exp(-sum_{i}{contact_prob * w_i * w_j * inf_i})
         which is exp(-sum_{i}{contact_prob * w_i * inf_i})**w_j. We define the 'weightess non infection prob'
         as exp(-sum_{i}{contact_prob * w_i * inf_i}).
+        An activity multiplier m of the environment (see add_activity_multiplier) multiplies all the weights,
+        so it multiplies the sum by m**2.
+        All the susceptible people of the same weight have the same infection probability,
+        so the number of infected people of each weight is drawn from a binomial distribution,
+        and then they are chosen uniformly (see _sample_infected_people).
         See the specification document for more details.
         """
         if len(self._infectious_people_and_weights) == 0:
             return []
+        activity_multiplier = self._activity_multiplier
+        if activity_multiplier == 0:
+            return []
 
-        total_infected_weights = sum(self._infectious_people_and_weights.values(), 0.0)
+        total_infected_weights = self._infectious_people_and_weights.total()
 
         log_weightless_non_infection_prob = \
-            - self._contact_prob_between_each_two_people * total_infected_weights
+            - self._contact_prob_between_each_two_people * activity_multiplier * activity_multiplier * \
+            total_infected_weights
         weightless_non_infection_prob = exp(log_weightless_non_infection_prob)
 
-        infection_source_distribution = Distribution(
-            list(self._infectious_people_and_weights.keys()),
-            list(self._infectious_people_and_weights.values()),
-            check_sum=False,
-            is_singleton=True
-        )
         new_events = []
         num_infections = 0
-        for person, weight in self._person_dict.items():
-            if person.is_susceptible:
-                infection_prob = 1 - (weightless_non_infection_prob ** weight)
-                if random.random() < infection_prob:
-                    num_infections += 1
-                    infection_source = infection_source_distribution.sample()
-                    # print("propagate_infection calling infect_and_get_events for id:{} date:{}".format(person.get_id(),date))
-                    curr_events = person.infect_and_get_events(date, self, infection_source)
-                    new_events += curr_events
+        for weight, group in list(self._susceptible_people_by_weight.items()):
+            infection_prob = 1 - (weightless_non_infection_prob ** weight)
+            for person in self._sample_infected_people(group, infection_prob):
+                # The person may have been infected in another environment today
+                # (and he leaves the group only when he signs up again)
+                if not person.is_susceptible or self._person_dict.get(person) != weight:
+                    continue
+                num_infections += 1
+                infection_source = self._infectious_people_and_weights.sample()
+                curr_events = person.infect_and_get_events(date, self, infection_source)
+                new_events += curr_events
 
         if num_infections > 0:
             for p, weight in self._infectious_people_and_weights.items():
@@ -100,6 +219,21 @@ class HomogeneousEnvironment(Environment):
 
         return new_events
 
+    @staticmethod
+    def _sample_infected_people(group, infection_prob):
+        """
+        Choose the people of the group that get infected, when each of them is infected with the given probability.
+        In large groups the number of infected people is drawn from a binomial distribution
+        and then they are sampled uniformly, which has the same distribution as a draw per person,
+        but takes time proportional to the number of infections.
+        :param group: IndexedSet of people
+        :param infection_prob: float
+        :return: list of people
+        """
+        if len(group) < SPARSE_SAMPLING_MIN_GROUP_SIZE:
+            return [person for person in group if random.random() < infection_prob]
+        return group.sample(np.random.binomial(len(group), infection_prob))
+
     def get_people(self):
         """
         Returns an iterator of the people that come to the environment
@@ -0,0 +1,101 @@
+import numpy as np
+
+
+class PeopleColumns(object):
+    """
+    A columnar (struct of arrays) index of the people of a World, by their position in World.all_people(),
+    for selecting groups of people with vectorized masks (e.g. the people that an intervention applies to)
+    instead of a condition on each person.
+    It is built from the people's ages and environments, so it should only be made after the population is generated,
+    see World.get_people_columns.
+    """
+    __slots__ = (
+        'people',
+        'ages',
+        '_schema_codes',
+        '_schema_names',
+        '_environment_masks',
+        '_member_people',
+        '_member_city_codes',
+        '_city_codes',
+        '_environments_in_city'
+    )
+
+    def __init__(self, people):
+        """
+        :param people: list of Person
+        """
+        self.people = people
+        self.ages = np.fromiter((person.get_age() for person in people), dtype=np.int16, count=len(people))
+        # The people with the same environment names share one (interned) tuple of names,
+        # so the masks of the environments are computed once for each tuple and not once for each person
+        schema_codes = {}
+        self._schema_codes = np.fromiter(
+            (schema_codes.setdefault(person.get_environment_names(), len(schema_codes)) for person in people),
+            dtype=np.int32, count=len(people)
+        )
+        self._schema_names = list(schema_codes)
+        self._environment_masks = {}
+        # The city of each (person, environment) member, see _init_members
+        self._member_people = None
+        self._member_city_codes = None
+        self._city_codes = None
+        self._environments_in_city = {}
+
+    def __len__(self):
+        return len(self.people)
+
+    def has_environment(self, name):
+        """
+        :param name: str name of an environment (e.g. 'workplace')
+        :return: numpy bool array of the people that have an environment of that name
+        """
+        mask = self._environment_masks.get(name)
+        if mask is None:
+            by_schema = np.array([name in names for names in self._schema_names], dtype=bool)
+            mask = self._environment_masks[name] = by_schema[self._schema_codes]
+        return mask
+
+    def num_environments(self):
+        """
+        :return: numpy int array of the number of environments of each person
+        """
+        return np.array([len(names) for names in self._schema_names], dtype=np.int32)[self._schema_codes]
+
+    def num_environments_in_city(self, city_name):
+        """
+        :param city_name: str name of a city
+        :return: numpy int array of the number of environments of each person that are in the given city
+        """
+        counts = self._environments_in_city.get(city_name)
+        if counts is None:
+            self._init_members()
+            code = self._city_codes.get(city_name)
+            if code is None:
+                counts = np.zeros(len(self.people), dtype=np.int32)
+            else:
+                counts = np.bincount(
+                    self._member_people[self._member_city_codes == code], minlength=len(self.people)
+                ).astype(np.int32)
+            self._environments_in_city[city_name] = counts
+        return counts
+
+    def _init_members(self):
+        """
+        Make the arrays of the city of each environment of each person (-1 for environments without a city),
+        on the first query of the cities
+        """
+        if self._member_people is not None:
+            return
+        self._city_codes = {}
+        member_people = []
+        member_city_codes = []
+        for row, person in enumerate(self.people):
+            for env in person.get_environments().values():
+                city = getattr(env, '_city', None)
+                member_people.append(row)
+                member_city_codes.append(
+                    -1 if city is None else self._city_codes.setdefault(city.get_name(), len(self._city_codes))
+                )
+        self._member_people = np.array(member_people, dtype=np.int64)
+        self._member_city_codes = np.array(member_city_codes, dtype=np.int32)
@@ -3,35 +3,49 @@ from collections import namedtuple
 from copy import copy
 from datetime import date, timedelta
 from enum import Enum
+from types import MappingProxyType
 import numpy as _np
 
 from src.simulation.event import (
     Event,
-    DayEvent,
     EmptyTrigger,
-    DiseaseStateChangeEffect
+    DiseaseStateChangeEffect,
+    DiseaseStateTransition
 )
 from src.seir import DiseaseState,sample_seir_times
 from src.simulation.params import Params
 from src.util.Enumerations import machine_type
+from src.world.environment_schema import EnvironmentSchema
 from src.world.infection_data import InfectionData
+from src.world.routine_cache import ROUTINE_CACHE
 
 
 RedactedPerson = namedtuple("RedactedPerson", ("age", "disease_state"))
 RedactedPersonAndEnv = namedtuple("RedactedPersonAndEnv", ("age", "disease_state", "infection_env_source"))
 
+# What the dicts of a person that were never used (events, routine changes) look like from outside
+_EMPTY_DICT = MappingProxyType({})
+# There are few different states, so all the people share the same objects of each of them
+_interned_states = {}
+
 class Person(object):
     """
     A person in the simulation.
     A person has a daily routine, that states what are the environments he visits on the next day.
     Also, he has disease state that indicates wht stage of the disease he's at.
     See the design document for more details
+    There are millions of people in a simulation, so a person is compact:
+    his environments are a tuple in the order of his (shared) EnvironmentSchema,
+    his routine weights are None as long as they are all 1 (no routine changes), and a shared tuple otherwise,
+    his routine changes are shared as well (see RoutineCache),
+    and the dicts of his events and routine changes are only allocated when something is added to them.
     """
     __slots__ = (
         '_changed',
         '_age',
+        '_schema',
         '_environments',
-        '_current_routine',
+        '_routine_weights',
         '_infectiousness_prob',
         '_disease_state',
         'is_susceptible',
@@ -39,15 +53,15 @@ class Person(object):
         'is_infectious',
         'is_infected',
         '_id',
-        'state_to_events',
-        'routine_change_multiplicities',
-        'routine_changes',
+        '_state_to_events',
+        '_routine_change_multiplicities',
+        '_routine_changes',
         '_infection_data',
         '_num_infections',
         'last_state',
         '_seir_times',
         'state_machine_type',
-        '_my_neighborhood',
+        '_changed_registry',
     )
     num_people_so_far = 0
 
@@ -62,9 +76,10 @@ class Person(object):
         if not environments:
             environments = []
         self._age = age
-        assert len(set([env.name for env in environments])) == len(environments), "Got duplicate environment names"
-        self._environments = {env.name: env for env in environments}
-        self._current_routine = {env_name: 1 for env_name in self._environments}
+        self._schema = EnvironmentSchema.get(env.name for env in environments)
+        self._environments = tuple(environments)
+        # None when all the weights are 1
+        self._routine_weights = None
         params = Params.loader()['person']
         self._infectiousness_prob = \
             min(params['base_infectiousness'] * \
@@ -87,24 +102,51 @@ class Person(object):
         self.state_machine_type = machine_type[str_type]
         self._id = Person.num_people_so_far
         # hold all the events that are triggered by some disease state(s) change(s), like isolation when symptomatic
-        self.state_to_events = {}
+        # (None until the first one is hooked, see state_to_events)
+        self._state_to_events = None
         # The following counts the number of different interventions that force each routine change on this person.
         # For instance, I might be in quarantine because I'm old and because I'm symptomatic.
         # Without this counter, people could go into quarantine because they're old, get symptoms during quarantine,
         # then go out of quarantine when the symptoms pass.
-        self.routine_change_multiplicities = {}
-        self.routine_changes = {}
+        # (both are None while there are no routine changes, see routine_changes)
+        self._routine_change_multiplicities = None
+        self._routine_changes = None
         self._infection_data = None
         # Table that currespond to seir times and events so it will be easier to mange
         self._seir_times= None
-        self._my_neighborhood = None
         self._num_infections = 0
+        # The dict of changed people of the World this person belongs to (set by the World)
+        self._changed_registry = None
         #if StartAsRecovered:
         #    self.last_state =RedactedPerson(self.get_age(), self.get_disease_state())
         #else:
         self.last_state = None
         Person.num_people_so_far += 1
 
+    @property
+    def state_to_events(self):
+        """
+        :return: dict from (old state, new state) to the Event that is applied on this change of disease state
+        (a read only empty dict if no event was hooked on this person)
+        """
+        return self._state_to_events if self._state_to_events is not None else _EMPTY_DICT
+
+    @property
+    def routine_changes(self):
+        """
+        :return: dict from the key of each routine change on this person to the routine change
+        (a read only empty dict if there are none, see add_routine_change)
+        """
+        return self._routine_changes if self._routine_changes is not None else _EMPTY_DICT
+
+    @property
+    def routine_change_multiplicities(self):
+        """
+        :return: dict from the key of each routine change on this person to the number of times it was added
+        (a read only empty dict if there are none, see add_routine_change)
+        """
+        return self._routine_change_multiplicities if self._routine_change_multiplicities is not None else _EMPTY_DICT
+
     def _init_event(self, old_state, new_state):
         """
         Init the state_to_events dict at the key (old_state, new_state), so we can hook other events here.
@@ -112,9 +154,11 @@ class Person(object):
         :param new_state: the new disease state the person is changing to
         """
         states = old_state, new_state
-        if states in self.state_to_events:
+        if self._state_to_events is None:
+            self._state_to_events = {}
+        elif states in self._state_to_events:
             return
-        self.state_to_events[states] = Event(
+        self._state_to_events[states] = Event(
             trigger=EmptyTrigger(),
             effect=DiseaseStateChangeEffect(
                 person=self,
@@ -130,9 +174,11 @@ class Person(object):
         :return: new_person
         """
         new_person = copy(self)
-        new_person.state_to_events = {}
-        new_person.routine_change_multiplicities = {}
-        new_person.routine_changes = {}
+        new_person._state_to_events = None
+        new_person._routine_change_multiplicities = None
+        new_person._routine_changes = None
+        new_person._routine_weights = None
+        new_person._changed_registry = None
         return new_person
 
     def hook_on_change(self, states, event):
@@ -142,22 +188,22 @@ class Person(object):
         :param event: the event to apply when the state change happen
         """
         self._init_event(*states)
-        self.state_to_events[states].hook(event)
+        self._state_to_events[states].hook(event)
 
     def add_environment(self, environment):
         """
         Adds a new environment to the person, and also to he's routine.
         This should only be called when generating a population! not mid-simulation!
         """
-        assert environment.name not in self._current_routine
-        if environment.name == "neighborhood_community":
-            self._my_neighborhood = environment
-        self._environments[environment.name] = environment
-        self._current_routine[environment.name] = 1
+        self._schema = self._schema.extended(environment.name)
+        self._environments += (environment,)
+        if self._routine_changes is not None:
+            self._routine_weights = ROUTINE_CACHE.routine_weights(self._schema, self._routine_changes)
         self._change()
 
     def get_neighberhood(self):
-        return self._my_neighborhood
+        index = self._schema.neighborhood_index
+        return self._environments[index] if index is not None else None
 
     def get_age(self):
         """
@@ -168,8 +214,23 @@ class Person(object):
     def get_routine(self):
         """
         get person's routine
+        :return: a new dict from the name of each of the person's environments to its weight
+        """
+        if self._routine_weights is None:
+            return dict.fromkeys(self._schema.names, 1)
+        return dict(zip(self._schema.names, self._routine_weights))
+
+    def get_environment_names(self):
         """
-        return self._current_routine
+        :return: tuple of the names of the person's environments (shared by the people with the same environments)
+        """
+        return self._schema.names
+
+    def get_environments(self):
+        """
+        :return: a new dict from the name of each of the person's environments to the environment
+        """
+        return dict(zip(self._schema.names, self._environments))
 
     def get_environment(self, name):
         """
@@ -177,8 +238,8 @@ class Person(object):
         :param name: string that states the environment name
         :return: environment object
         """
-        assert name in self._environments, "Unknown environment: '%s'" % name
-        return self._environments[name]
+        assert name in self._schema.index, "Unknown environment: '%s'" % name
+        return self._environments[self._schema.index[name]]
 
     def has_environment(self, name):
         """
@@ -186,7 +247,7 @@ class Person(object):
         :param name: string - the environment name
         :return: bool
         """
-        return name in self._environments
+        return name in self._schema.index
 
     def register_to_daily_environments(self):
         """
@@ -195,8 +256,19 @@ class Person(object):
         """
         if not self._changed:
             return
-        for env_name, env in self._environments.items():
-            env.sign_up_for_today(self, self._current_routine[env_name])
+        self.sign_up_to_daily_environments()
+
+    def sign_up_to_daily_environments(self):
+        """
+        Sign up for all of the person's environments according to the weights in his routine,
+        whether he changed or not (e.g. after the environments were cleared, see World.sign_all_people_up_to_environments)
+        """
+        if self._routine_weights is None:
+            for env in self._environments:
+                env.sign_up_for_today(self, 1)
+        else:
+            for env, weight in zip(self._environments, self._routine_weights):
+                env.sign_up_for_today(self, weight)
 
     def _change(self):
         """
@@ -209,6 +281,8 @@ class Person(object):
         self.is_dead = self._disease_state.is_dead()
         # print("in _change id:{} is_susceptible:{}".format(self.get_id(),self.is_susceptible))
         self._changed = True
+        if self._changed_registry is not None:
+            self._changed_registry[self._id] = self
 
     def get_prob_to_infect_on_contact(self):
         """
@@ -249,7 +323,8 @@ class Person(object):
         Returns the person age and disease state
         :return: tuple of int and diseaseState
         """
-        return RedactedPerson(self.get_age(), self.get_disease_state())
+        state = RedactedPerson(self.get_age(), self.get_disease_state())
+        return _interned_states.setdefault(state, state)
 
     def save_state(self):
         """
@@ -257,6 +332,8 @@ class Person(object):
         """
         self.last_state = self.get_state()
         self._changed = False
+        if self._changed_registry is not None:
+            self._changed_registry.pop(self._id, None)
 
     def get_last_state(self):
         """
@@ -281,16 +358,16 @@ class Person(object):
         """
         clears all person's events
         """
-        self.state_to_events = {}
+        self._state_to_events = None
 
     def gen_and_register_events_from_seir_times(self, date, states_and_times):
         """
         Create all the disease course (timeline) of this person -
-        makes day events to each disease state, as the person goes from being infected,
+        makes a DiseaseStateTransition to each disease state, as the person goes from being infected,
         all the way to immunity/death (being removed)
         :param date: current date to start the seir times from
         :param states_and_times: disease states and their duration
-        :return: all new events to add, that change the person's disease state
+        :return: all new DiseaseStateTransitions to register, that change the person's disease state
         """
         events = []
         last_state = self._disease_state
@@ -300,10 +377,7 @@ class Person(object):
             curr_date += states_and_times[i - 1][1]
             old_state = last_state
             new_state = states_and_times[i][0]
-            new_event = DayEvent(curr_date)
-            self._init_event(old_state, new_state)
-            new_event.hook(self.state_to_events[(old_state, new_state)])
-            events.append(new_event)
+            events.append(DiseaseStateTransition(curr_date, self, old_state, new_state))
             last_state = states_and_times[i][0]
         assert states_and_times[-1][1] is None
         return events
@@ -450,14 +524,23 @@ class Person(object):
 
 
     def add_routine_change(self, key, value):
-        if key in self.routine_changes:
-            assert key in self.routine_change_multiplicities
-            self.routine_change_multiplicities[key] += 1
-            assert self.routine_changes[key] == value
+        """
+        add a routine change with the given key to the person's routine changes and update the routine.
+        :param key: str, key to the routine change
+        :param value: dict from environment name to weight multiplier, it is kept as a shared FrozenRoutine
+        """
+        value = ROUTINE_CACHE.intern_change(value)
+        if self._routine_changes is not None and key in self._routine_changes:
+            assert key in self._routine_change_multiplicities
+            self._routine_change_multiplicities[key] += 1
+            assert self._routine_changes[key] == value
         else:
             assert key not in self.routine_change_multiplicities
-            self.routine_changes[key] = value
-            self.routine_change_multiplicities[key] = 1
+            if self._routine_changes is None:
+                self._routine_changes = {}
+                self._routine_change_multiplicities = {}
+            self._routine_changes[key] = value
+            self._routine_change_multiplicities[key] = 1
             self.update_routine()
 
     def remove_routine_change(self, key):
@@ -469,29 +552,29 @@ class Person(object):
             self.routine_changes) + str(self)
         assert key in self.routine_change_multiplicities, "key " + str(key) + \
             " not in routine change multiplicities " + str(self.routine_changes) + str(self)
-        self.routine_change_multiplicities[key] -= 1
-        if self.routine_change_multiplicities[key] == 0:
-            self.routine_changes.pop(key, None)
-            self.routine_change_multiplicities.pop(key, None)
+        self._routine_change_multiplicities[key] -= 1
+        if self._routine_change_multiplicities[key] == 0:
+            self._routine_changes.pop(key, None)
+            self._routine_change_multiplicities.pop(key, None)
+            if not self._routine_changes:
+                self._routine_changes = self._routine_change_multiplicities = None
             self.update_routine()
 
     def update_routine(self):
         """
         multiply all the routine changes, in order to get the current routine.
         """
-        new_routine = {env_name: 1 for env_name in self._environments}
-        for change in self.routine_changes.values():
-            for env_name, val in change.items():
-                assert env_name in new_routine, "environment '%s' isn't in routine %s" % (env_name, self._environments)
-                new_routine[env_name] *= val
-        self._current_routine = new_routine
+        if self._routine_changes is None:
+            self._routine_weights = None
+        else:
+            self._routine_weights = ROUTINE_CACHE.routine_weights(self._schema, self._routine_changes)
         self._change()
 
     def get_city_name(self):
         """
         return person's city name
         """
-        return self._environments["household"]._city.english_name.lower()
+        return self.get_environment("household")._city.english_name.lower()
 
     def __repr__(self):
         return (
@@ -502,10 +585,10 @@ class Person(object):
                 self._age,
                 self._infectiousness_prob,
                 self._disease_state,
-                self._current_routine,
+                self.get_routine(),
                 self.routine_changes,
                 self.state_to_events,
-                self._environments
+                self.get_environments()
         )
 
     def __hash__(self):
@@ -0,0 +1,213 @@
+from collections import Counter
+
+import numpy as np
+
+from src.seir import DiseaseState
+
+_NUM_STATE_VALUES = max(state.value for state in DiseaseState) + 1
+_INFECTED_STATE_VALUES = [state.value for state in DiseaseState if state.is_infected()]
+
+
+class PopulationCounters(object):
+    """
+    Live counts of the people of a world by disease state, 10 years age group and city,
+    kept in a small numpy array of shape (disease state values, age groups, cities).
+    The simulation moves the people that changed each day between the cells
+    (see Simulation.simulate_day), so the counts are always those of the last saved states,
+    and querying them never touches the Person objects.
+    People without a household are counted under the city None.
+    The counts of the last HISTORY_DAYS days are also kept in ring buffers of shape (days, disease state values, cities),
+    so the rolling incidence (the number of people that entered each state each day)
+    and prevalence (the number of people in each state at the end of each day) are read without scanning anything
+    (see daily_entries and daily_counts). The simulation ends each day with end_day.
+    """
+    __slots__ = ('_counts', '_city_index', '_entries_history', '_counts_history', '_num_days')
+
+    NUM_AGE_GROUPS = 11  # 0-9, 10-19, ..., 90-99 and 100+
+    HISTORY_DAYS = 28
+
+    def __init__(self, world):
+        """
+        :param world: World object, its people are counted by their last saved states
+        """
+        self._city_index = {}
+        people = world.all_people()
+        for person in people:
+            self._city_index.setdefault(self.city_name_of(person), len(self._city_index))
+        self._counts = np.zeros((_NUM_STATE_VALUES, self.NUM_AGE_GROUPS, max(len(self._city_index), 1)), dtype=np.int64)
+        for person in people:
+            last_state = person.get_last_state()
+            if last_state is not None:
+                self._counts[self._cell_of(person, last_state.disease_state)] += 1
+        history_shape = (self.HISTORY_DAYS, _NUM_STATE_VALUES, self._counts.shape[2])
+        # Row (day % HISTORY_DAYS) of each buffer holds the counts of that day (day 0 is the first simulated day)
+        self._entries_history = np.zeros(history_shape, dtype=np.int64)
+        self._counts_history = np.zeros(history_shape, dtype=np.int64)
+        self._num_days = 0
+
+    @staticmethod
+    def city_name_of(person):
+        """
+        :return: The name of the city of the given person's household, or None if it has none
+        """
+        if not person.has_environment('household'):
+            return None
+        return person.get_city_name()
+
+    @classmethod
+    def age_group_index(cls, age):
+        """
+        :param age: int age (or age category, i.e 0, 10, 20...)
+        :return: The index of its age group in the counts array
+        """
+        return min(age // 10, cls.NUM_AGE_GROUPS - 1)
+
+    def city_index(self, city_name):
+        """
+        :param city_name: str city name (or None)
+        :return: The index of the city in the counts array
+        """
+        return self._city_index[city_name.lower() if city_name is not None else None]
+
+    def city_names(self):
+        return list(self._city_index)
+
+    def _cell_of(self, person, disease_state):
+        return (
+            disease_state.value,
+            self.age_group_index(person.get_age()),
+            self._city_index[self.city_name_of(person)]
+        )
+
+    def update_person(self, person):
+        """
+        Move a changed person from the cell of its last saved state to the cell of its current state.
+        Should be called once for each changed person, before its state is saved.
+        :param person: Person object
+        """
+        last_state = person.get_last_state()
+        disease_state = person.get_disease_state()
+        if last_state is not None:
+            self._counts[self._cell_of(person, last_state.disease_state)] -= 1
+        cell = self._cell_of(person, disease_state)
+        self._counts[cell] += 1
+        if last_state is None or last_state.disease_state != disease_state:
+            self._entries_history[self._num_days % self.HISTORY_DAYS, cell[0], cell[2]] += 1
+
+    def update_from_arrays(self, old_state_values, new_state_values, ages, city_indices):
+        """
+        Move many people between the cells at once (see ArraySimulation)
+        :param old_state_values: numpy int array of the last saved state values, negative for no state
+        :param new_state_values: numpy int array of the current state values
+        :param ages: numpy int array of the people's ages
+        :param city_indices: numpy int array of the indices of the people's cities (see city_index)
+        """
+        age_groups = np.minimum(np.asarray(ages, dtype=np.int64) // 10, self.NUM_AGE_GROUPS - 1)
+        had_state = old_state_values >= 0
+        np.subtract.at(
+            self._counts, (old_state_values[had_state], age_groups[had_state], city_indices[had_state]), 1
+        )
+        np.add.at(self._counts, (new_state_values, age_groups, city_indices), 1)
+        entered = old_state_values != new_state_values
+        np.add.at(
+            self._entries_history[self._num_days % self.HISTORY_DAYS],
+            (new_state_values[entered], city_indices[entered]), 1
+        )
+
+    def end_day(self):
+        """
+        Record the counts at the end of the current day in the history, and start the history of the next day.
+        Should be called once at the end of each simulated day, after all the people that changed were updated.
+        """
+        self._counts_history[self._num_days % self.HISTORY_DAYS] = self._counts.sum(axis=1)
+        self._num_days += 1
+        self._entries_history[self._num_days % self.HISTORY_DAYS] = 0
+
+    def num_days(self):
+        """
+        :return: int number of days that ended (see end_day)
+        """
+        return self._num_days
+
+    def _history_sum(self, history, state_values, num_days, city_name):
+        """
+        :return: The sum of the given states over the last num_days days that ended (and the given city) in the history
+        """
+        assert 1 <= num_days <= self.HISTORY_DAYS, "Only the last {} days are kept".format(self.HISTORY_DAYS)
+        if self._num_days < num_days:
+            return 0
+        rows = np.arange(self._num_days - num_days, self._num_days) % self.HISTORY_DAYS
+        history = history[rows][:, state_values]
+        if city_name is not None:
+            return int(history[:, :, self.city_index(city_name)].sum())
+        return int(history.sum())
+
+    def daily_entries(self, state_values, num_days=1, city_name=None):
+        """
+        The rolling incidence: the number of people that entered the given states in the last days
+        (e.g. the new infections are the entries to DiseaseState.LATENT)
+        :param state_values: numpy int array (or list) of DiseaseState values
+        :param num_days: int number of the last days that ended (at most HISTORY_DAYS)
+        :param city_name: str city name, None for all the cities
+        :return: int number of entries, 0 if fewer days than num_days ended
+        """
+        return self._history_sum(self._entries_history, state_values, num_days, city_name)
+
+    def daily_counts(self, state_values, num_days=1, city_name=None):
+        """
+        The rolling prevalence: the sum of the numbers of people in the given states at the end of the last days
+        :param state_values: numpy int array (or list) of DiseaseState values
+        :param num_days: int number of the last days that ended (at most HISTORY_DAYS)
+        :param city_name: str city name, None for all the cities
+        :return: int sum of the counts, 0 if fewer days than num_days ended
+        """
+        return self._history_sum(self._counts_history, state_values, num_days, city_name)
+
+    def count(self, states=None, age_group=None, city_name=None):
+        """
+        Count the people that match all the given filters
+        :param states: DiseaseState or iterable of DiseaseStates, None for all the states
+        :param age_group: int age category (i.e 0, 10, 20...), None for all the ages
+        :param city_name: str city name, None for all the cities
+        :return: int number of people
+        """
+        counts = self._counts
+        if city_name is not None:
+            counts = counts[:, :, self.city_index(city_name)]
+        else:
+            counts = counts.sum(axis=2)
+        if age_group is not None:
+            counts = counts[:, self.age_group_index(age_group)]
+        else:
+            counts = counts.sum(axis=1)
+        if states is None:
+            return int(counts.sum())
+        if isinstance(states, DiseaseState):
+            return int(counts[states.value])
+        return int(sum(counts[state.value] for state in states))
+
+    def count_alive(self, age_group=None, city_name=None):
+        return self.count(age_group=age_group, city_name=city_name) - \
+            self.count(DiseaseState.DECEASED, age_group=age_group, city_name=city_name)
+
+    def count_infected(self, age_group=None, city_name=None):
+        return self.count(
+            [DiseaseState(value) for value in _INFECTED_STATE_VALUES], age_group=age_group, city_name=city_name
+        )
+
+    def state_counts(self, city_name=None):
+        """
+        :param city_name: str city name, None for all the cities
+        :return: Counter from DiseaseState to the number of people in it
+        """
+        counts = Counter({state: self.count(state, city_name=city_name) for state in DiseaseState})
+        return +counts
+
+    def as_array(self):
+        """
+        :return: A copy of the counts array, indexed by (disease state value, age group index, city index)
+        """
+        return self._counts.copy()
+
+    def __repr__(self):
+        return "PopulationCounters({})".format(dict(self.state_counts()))
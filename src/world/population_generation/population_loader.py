@@ -10,6 +10,8 @@ log = logging.getLogger(__name__)
 
 OUTPUT_DIR_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.dirname(__file__)))), 'serializing')
 OUTPUT_NAME = 'population'
+# Bumped whenever the pickled layout of the people or the environments changes, so old cached worlds are not loaded
+POPULATION_FORMAT_VERSION = 2
 
 MIN_CITY_SIZE = 1500
 
@@ -43,7 +45,9 @@ class PopulationLoader(object):
         :param scale: The scale by which to multiply the city size
         :return: The path that this serialized file should be saved to
         """
-        filename = "%s_%s_%s_%s%s.pkl" % (OUTPUT_NAME, city_name, is_smart, scale, self.added_description)
+        filename = "%s_v%d_%s_%s_%s%s.pkl" % (
+            OUTPUT_NAME, POPULATION_FORMAT_VERSION, city_name, is_smart, scale, self.added_description
+        )
         return os.path.join(self.output_dir, filename)
 
     def _save_to_file(self, world, is_smart):
@@ -0,0 +1,150 @@
+class FrozenRoutine(dict):
+    """
+    An immutable (and hashable) routine change: a dict from environment name to weight multiplier.
+    The routine changes of the people are shared between them (see RoutineCache), so they must not be changed.
+    """
+    __slots__ = ('_hash',)
+
+    def __init__(self, routine):
+        """
+        :param routine: dict (or iterable of pairs) from environment name to weight multiplier
+        """
+        super(FrozenRoutine, self).__init__(routine)
+        self._hash = hash(frozenset(self.items()))
+
+    def __hash__(self):
+        return self._hash
+
+    def _immutable(self, *args, **kwargs):
+        raise TypeError("A FrozenRoutine can't be changed")
+
+    __setitem__ = __delitem__ = clear = pop = popitem = setdefault = update = _immutable
+
+    def __reduce__(self):
+        return FrozenRoutine, (dict(self),)
+
+
+class _CacheTable(object):
+    """
+    A dict of cached values that counts its hits and misses
+    """
+    __slots__ = ('values', 'hits', 'misses')
+
+    def __init__(self):
+        self.values = {}
+        self.hits = 0
+        self.misses = 0
+
+    def get_stats(self):
+        """
+        :return: dict of the number of hits, misses and entries of the table, and its hit rate
+        """
+        lookups = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'size': len(self.values),
+            'hit_rate': self.hits / lookups if lookups else 0.0
+        }
+
+
+class RoutineCache(object):
+    """
+    A flyweight cache of the routines of the people.
+    The same routine changes (e.g. social distancing) and the same combinations of them
+    (e.g. social distancing and symptomatic isolation) recur across huge numbers of people,
+    so they share immutable objects instead of each of them holding (and computing) its own:
+    1. changes: every routine change that is added to a person is interned as a FrozenRoutine
+    2. generated: the routine changes that a routine generator makes from the names of a person's environments
+    and the params (see generated_change), so the generator does not build a new dict for each person
+    3. weights: the routine weights of a person (see Person.update_routine),
+    by his EnvironmentSchema and the (unordered) set of his active routine changes
+    """
+    __slots__ = ('_changes', '_generated', '_weights')
+
+    def __init__(self):
+        self._changes = _CacheTable()
+        self._generated = _CacheTable()
+        self._weights = _CacheTable()
+
+    def intern_change(self, change):
+        """
+        :param change: dict from environment name to weight multiplier
+        :return: the shared FrozenRoutine that is equal to the given change (the change itself if it's a FrozenRoutine)
+        """
+        if type(change) is FrozenRoutine:
+            return change
+        table = self._changes
+        key = tuple(change.items())
+        frozen = table.values.get(key)
+        if frozen is None:
+            table.misses += 1
+            frozen = table.values[key] = FrozenRoutine(change)
+        else:
+            table.hits += 1
+        return frozen
+
+    def generated_change(self, key, make_change, *args):
+        """
+        :param key: hashable key of everything the change depends on (the routine name, environment names, params...)
+        :param make_change: function that makes the routine change dict from the given args, called on a miss
+        :param args: the args of make_change
+        :return: the shared FrozenRoutine of the key
+        """
+        table = self._generated
+        change = table.values.get(key)
+        if change is None:
+            table.misses += 1
+            change = table.values[key] = self.intern_change(make_change(*args))
+        else:
+            table.hits += 1
+        return change
+
+    def routine_weights(self, schema, routine_changes):
+        """
+        :param schema: the EnvironmentSchema of a person
+        :param routine_changes: dict from the key of each active routine change to its FrozenRoutine
+        :return: tuple of the weights of the environments of the schema, the product of the active routine changes
+        """
+        table = self._weights
+        if len(routine_changes) == 1:
+            # The common case, that does not need a set
+            key = (schema,) + next(iter(routine_changes.items()))
+        else:
+            key = (schema, frozenset(routine_changes.items()))
+        weights = table.values.get(key)
+        if weights is None:
+            table.misses += 1
+            index = schema.index
+            new_weights = [1] * len(schema)
+            # The changes are multiplied in a fixed order, so the weights do not depend on the order they were added
+            for _, change in sorted(routine_changes.items(), key=lambda item: repr(item[0])):
+                for env_name, val in change.items():
+                    assert env_name in index, "environment '%s' isn't in routine %s" % (env_name, schema.names)
+                    new_weights[index[env_name]] *= val
+            weights = table.values[key] = tuple(new_weights)
+        else:
+            table.hits += 1
+        return weights
+
+    def get_stats(self):
+        """
+        :return: dict from the name of each table of the cache (see the class doc) to its stats (see _CacheTable)
+        """
+        return {
+            'changes': self._changes.get_stats(),
+            'generated': self._generated.get_stats(),
+            'weights': self._weights.get_stats(),
+        }
+
+    def clear(self):
+        """
+        Drop all the cached routines and reset the stats
+        """
+        self._changes = _CacheTable()
+        self._generated = _CacheTable()
+        self._weights = _CacheTable()
+
+
+# The routine cache of all the people of the process
+ROUTINE_CACHE = RoutineCache()
@@ -1,9 +1,21 @@
+from src.world.people_columns import PeopleColumns
+
+
 
 class World(object):
     """
     The World class holds all the people and their environments for the simulation.
     """
-    __slots__ = ('_people_dict', 'all_environments', '_city_name_to_env', '_generating_city_name', '_generating_scale')
+    __slots__ = (
+        '_people_dict',
+        '_changed_people',
+        '_active_environments',
+        'all_environments',
+        '_city_name_to_env',
+        '_generating_city_name',
+        '_generating_scale',
+        '_people_columns'
+    )
 
     def __init__(self, all_people, all_environments, generating_city_name, generating_scale):
         """
@@ -16,10 +28,79 @@ class World(object):
         and all the environments shrinks as well.
         """
         self._people_dict = {p.get_id(): p for p in all_people}
+        self._init_changed_people()
         self.all_environments = all_environments
+        self._init_active_environments()
         self._init_city_name_to_env_dict()
         self._generating_city_name = generating_city_name.lower()
         self._generating_scale = generating_scale
+        self._people_columns = None
+
+    def _init_changed_people(self):
+        """
+        Build the dict of changed people (by id) and let every person keep it up to date,
+        so the simulation can visit only the people that changed instead of the whole population.
+        """
+        self._changed_people = {}
+        for person in self._people_dict.values():
+            person._changed_registry = self._changed_people
+            if person._changed:
+                self._changed_people[person.get_id()] = person
+
+    def __getstate__(self):
+        return {
+            name: getattr(self, name) for name in self.__slots__
+            if name not in ('_changed_people', '_active_environments', '_people_columns')
+        }
+
+    def __setstate__(self, state):
+        """
+        Restore a pickled World (e.g. a cached population),
+        rebuilding the changed people and active environments dicts from the people and environments themselves
+        """
+        if isinstance(state, tuple):
+            # Pickled before World defined __getstate__: (dict_state, slots_state)
+            state = state[1]
+        for name, value in state.items():
+            setattr(self, name, value)
+        for env in self.all_environments:
+            env.init_after_load()
+        self._people_columns = None
+        self._init_changed_people()
+        self._init_active_environments()
+
+    def _init_active_environments(self):
+        """
+        Build the dict of active environments (by id), the ones with infectious people signed up,
+        and let every environment keep it up to date.
+        """
+        self._active_environments = {}
+        for env in self.all_environments:
+            env._active_registry = self._active_environments
+            if env.is_active():
+                self._active_environments[env._id] = env
+
+    def get_registries_order(self):
+        """
+        The order of the changed people and the active environments affects the order of the random draws of a day,
+        and it is lost when the World is pickled (see __setstate__).
+        :return: tuple of the list of the changed people ids and the list of the active environment ids, in order
+        """
+        return list(self._changed_people), list(self._active_environments)
+
+    def restore_registries_order(self, changed_people_ids, active_environment_ids):
+        """
+        Reorder the changed people and the active environments (in place, the people and environments keep them),
+        e.g. after loading a checkpoint of a simulation
+        :param changed_people_ids: list of the changed people ids, see get_registries_order
+        :param active_environment_ids: list of the active environment ids, see get_registries_order
+        """
+        for registry, ids in ((self._changed_people, changed_people_ids),
+                              (self._active_environments, active_environment_ids)):
+            assert set(registry) == set(ids), "The registry does not match the given order"
+            items = dict(registry)
+            registry.clear()
+            registry.update((item_id, items[item_id]) for item_id in ids)
 
     def _init_city_name_to_env_dict(self):
         """
@@ -46,9 +127,14 @@ class World(object):
         For all the people in the world, register to their environments.
         The registration happens according to the person's routine
         This is needed for the infection to spread.
+        All the people are registered, changed or not, since the environments may have been cleared
+        (see SmartInitialInfectionParams.infect_simulation).
+        The environments may be shared with another World (see InitialStateSimulation),
+        so they are bound back to this World first.
         """
+        self._init_active_environments()
         for person in self.all_people():
-            person.register_to_daily_environments()
+            person.sign_up_to_daily_environments()
 
     def get_all_city_communities(self):
         """
@@ -68,6 +154,13 @@ class World(object):
         """
         return list(self._city_name_to_env.keys())
 
+    def active_environments(self):
+        """
+        return a list of the environments that currently have infectious people
+        :return: list of Environment
+        """
+        return list(self._active_environments.values())
+
     def num_people(self):
         """
         number (int) of people in the world
@@ -81,6 +174,29 @@ class World(object):
         """
         return list(self._people_dict.values())
 
+    def get_people_columns(self):
+        """
+        The columnar index of the people of the world, by their position in all_people,
+        for selecting groups of people with vectorized masks. It is made on the first call.
+        :return: PeopleColumns
+        """
+        if self._people_columns is None:
+            self._people_columns = PeopleColumns(self.all_people())
+        return self._people_columns
+
+    def changed_people(self):
+        """
+        return a list of the people that changed since their state was last saved
+        :return: list of Person
+        """
+        return list(self._changed_people.values())
+
+    def num_changed_people(self):
+        """
+        number (int) of people that changed since their state was last saved
+        """
+        return len(self._changed_people)
+
     def get_person_from_id(self, person_id):
         """
         return person that has the given id
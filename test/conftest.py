@@ -1,11 +1,46 @@
 import os
 import json
+import random
+import numpy as np
 import pytest
 from shutil import rmtree
 
+from src.seir import DiseaseState
+from src.util import Distribution
 from src.world.city_data import get_city_list_from_dem_xls
+from src.world.city_data.city import City, CityFields
+from src.world.population_generation import generate_city
 from src.simulation.params import Params
 
+TEST_CITY_NAME = 'test_city'
+
+# Rough demographics of an Israeli city, so the test worlds have realistic households, schools and workplaces
+_AGE_SEGMENTS = [(0, 9), (10, 19), (20, 29), (30, 39), (40, 49), (50, 59), (60, 69), (70, 79), (80, 99)]
+_AGE_PROBS = [0.19, 0.17, 0.14, 0.13, 0.12, 0.09, 0.08, 0.05, 0.03]
+_HOUSEHOLD_SIZE_SEGMENTS = [(1, 1), (2, 2), (3, 3), (4, 4), (5, 5), (6, 7)]
+_HOUSEHOLD_SIZE_PROBS = [0.2, 0.24, 0.17, 0.17, 0.13, 0.09]
+
+
+def make_test_city(population, name=TEST_CITY_NAME):
+    """
+    Make a City with fixed demographic distributions, without reading the demographic xls file.
+    Only the fields that the naive population generation uses are set.
+    :param population: int number of people in the city
+    :param name: str english name of the city
+    :return: City object
+    """
+    fields = dict.fromkeys(CityFields)
+    fields.update(
+        town_symbol=0,
+        hebrew_name=name,
+        english_name=name,
+        population=population,
+        age_distribution=Distribution(_AGE_SEGMENTS, _AGE_PROBS),
+        household_size_distribution=Distribution(_HOUSEHOLD_SIZE_SEGMENTS, _HOUSEHOLD_SIZE_PROBS)
+    )
+    return City(**fields)
+
+
 class Helpers:
     @staticmethod
     def clean_outputs():
@@ -21,6 +56,21 @@ class Helpers:
 def helpers():
     return Helpers
     
+@pytest.fixture
+def local_random_seed():
+    """
+    Seeds the global random generators for one test, and restores their states after it,
+    so the test neither depends on the random draws of the tests before it nor changes them for the tests after it
+    """
+    random_state = random.getstate()
+    np_random_state = np.random.get_state()
+    random.seed(0)
+    np.random.seed(0)
+    yield
+    random.setstate(random_state)
+    np.random.set_state(np_random_state)
+
+
 @pytest.fixture
 def cities():
     file_path = os.path.dirname(__file__) + "/../src/config.json"
@@ -47,6 +97,29 @@ def params(params_path):
     return Params.loader()
 
 
+@pytest.fixture
+def loaded_params(params_path):
+    """
+    Loads the params file of the config in place of the loaded params (as the jobs of run_utils do)
+    """
+    Params.load_from(params_path, override=True)
+    DiseaseState.init_infectiousness_list()
+    return Params.loader()
+
+
+@pytest.fixture
+def generated_world(loaded_params):
+    """
+    A World of a test city of about 2000 people (see make_test_city), generated by the naive population generation
+    from a fixed seed, with all its people signed up to their environments
+    """
+    random.seed(0)
+    np.random.seed(0)
+    world = generate_city(make_test_city(2000), is_smart_household_generation=False, scaling=1.0)
+    world.sign_all_people_up_to_environments()
+    return world
+
+
 def pytest_addoption(parser):
     parser.addoption(
         "--runslow", action="store_true", default=False, help="run slow tests"
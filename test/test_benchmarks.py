@@ -0,0 +1,27 @@
+from benchmarks.benchmark_simulation import benchmark_world_size, compare_results, load_params, split_by_prevalence
+
+
+def test_benchmark_is_reproducible():
+    """
+    Runs the benchmarks twice on a small synthetic world,
+    and checks that both runs simulate the same epidemic and time all the benchmarks
+    """
+    load_params()
+    results = [benchmark_world_size(2000, seed=3, max_days=30) for _ in range(2)]
+    assert results[0]['num_people'] == results[1]['num_people'] >= 2000
+    assert results[0]['peak_infected'] == results[1]['peak_infected']
+    assert results[0]['days_simulated'] == results[1]['days_simulated']
+    timings = results[0]['timings']
+    assert set(timings) == {'generate_world', 'sign_up', 'simulate_day', 'finish_run', 'generate_events'}
+    assert timings['simulate_day']['all']['num_days'] == results[0]['days_simulated']
+    assert 'HouseholdIsolationIntervention' in timings['generate_events']
+
+
+def test_compare_benchmark_results():
+    """
+    Checks that only the timings that got slower by more than the threshold are reported as regressions
+    """
+    baseline = {'sizes': {'10000': {'timings': {'sign_up': 1.0, 'simulate_day': {'peak': {'median': 2.0}}}}}}
+    current = {'sizes': {'10000': {'timings': {'sign_up': 1.1, 'simulate_day': {'peak': {'median': 3.0}}}}}}
+    assert compare_results(baseline, current, threshold=0.2) == [('10000', 'simulate_day.peak.median', 2.0, 3.0)]
+    assert split_by_prevalence([1, 5, 10, 4, 1]) == {'first_day': [0], 'low': [], 'peak': [0, 1, 2, 3, 4], 'late': [4]}
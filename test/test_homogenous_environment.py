@@ -10,6 +10,9 @@ from src.world.person import Person
 from src.world.population_generation import population_loader
 from src.world.environments.homogeneous_environment import HomogeneousEnvironment
 from src.world.environments import NeighborhoodCommunity
+from src.world.world import World
+from src.world.environments.household import Household
+from src.util import IndexedSet
 
 def test_propagate_infection(params_path):
     """
@@ -121,4 +124,45 @@ def test_neiborhoods_diff_IDs():
     for env in my_world.all_environments:
         if env.name == "neighborhood_community":
             sample.append(env)
-    assert not(sample[0].get_neighborhood_id() == sample[1].get_neighborhood_id())
\ No newline at end of file
+    assert not(sample[0].get_neighborhood_id() == sample[1].get_neighborhood_id())
+
+def test_active_environments(params_path):
+    """
+    Tests that the world only lists the environments that have infectious people signed up
+    """
+    Params.load_from(params_path)
+    DiseaseState.init_infectiousness_list()
+    envs = [Household(city=None, contact_prob_between_each_two_people=0.5) for _ in range(3)]
+    people = [Person(30) for _ in range(3)]
+    for person, env in zip(people, envs):
+        person.add_environment(env)
+    my_world = World(people, envs, "test", 1)
+    my_world.sign_all_people_up_to_environments()
+    assert my_world.active_environments() == []
+
+    people[1].set_disease_state(DiseaseState.ASYMPTOMATICINFECTIOUS)
+    people[1].register_to_daily_environments()
+    assert my_world.active_environments() == [envs[1]]
+
+    people[1].set_disease_state(DiseaseState.IMMUNE)
+    people[1].register_to_daily_environments()
+    assert my_world.active_environments() == []
+
+
+def test_sparse_infection_sampling():
+    """
+    Tests that sampling the infected people of a large group (binomial count and then uniform choice)
+    infects each person with the given probability
+    """
+    group = IndexedSet(range(1000))
+    infection_prob = 0.05
+    loops = 400
+    counts = [0] * len(group)
+    for _ in range(loops):
+        infected = HomogeneousEnvironment._sample_infected_people(group, infection_prob)
+        assert len(set(infected)) == len(infected)
+        for person in infected:
+            counts[person] += 1
+    expected = len(group) * infection_prob * loops
+    assert abs(sum(counts) - expected) < 5 * expected ** 0.5
+    assert max(counts) < 3 * infection_prob * loops
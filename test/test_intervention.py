@@ -3,18 +3,22 @@ import json
 import os
 import pytest
 import random
-from test.conftest import helpers
+from test.conftest import helpers, make_test_city, TEST_CITY_NAME
 
 from src.run_utils import SimpleJob, run, INITIAL_DATE
 from src.seir import daysdelta
 from src.seir.disease_state import DiseaseState
-from src.simulation.event import DayEvent
+from src.simulation.event import DayEvent, DiseaseStateTransition, IncidenceTrigger, PrevalenceTrigger, \
+    StateChangeListener, apply_disease_state_transition
 from src.simulation.interventions import *
+from src.simulation.interventions.partial_environment_intervention import PartialEnvironmentIntervention
 from src.simulation.initial_infection_params import SmartInitialInfectionParams
 from src.simulation.params import Params
 from src.simulation.simulation import Simulation
+from src.util import ORDER
 from src.logs import Statistics
 from src.world import Person,World
+from src.world.environments import EnvironmentalAttribute, School
 from src.world.environments.household import Household
 
 
@@ -110,6 +114,159 @@ def test_school_isolation_intervention_simulation():
     summary = results.get_summary_data_for_age_group((4, 12))
     assert summary["Total infected in school"] + summary["Total infected in initial_group"] == summary["Total infected"]
 
+def test_school_closure_activity_multiplier(generated_world):
+    """
+    Test that a school closure closes each school by its activity multiplier,
+    adds only the rest of the closure routine (e.g. more time at home) to the students, and undoes both at its end
+    """
+    intervention = SchoolClosureIntervention(
+        start_date=INITIAL_DATE,
+        duration=timedelta(10),
+        compliance=1.0,
+        proportion_of_envs=1.0,
+        city_name=TEST_CITY_NAME,
+        age_segment=(3, 17)
+    )
+    events = intervention.generate_events(generated_world)
+    for event in events:
+        if event._date == intervention.start_date:
+            event.effect.apply(None)
+    closed = [env for env in generated_world.all_environments if isinstance(env, School) and env.get_activity_multiplier() != 1]
+    assert len(closed) > 0
+    # The state, the activity multiplier and the routine change of the students, each added and removed
+    assert len(events) == 6 * len(closed)
+    for school in closed:
+        assert school.get_activity_multiplier() == 0
+        assert school.propagate_infection(INITIAL_DATE) == []
+        for person in school.get_people():
+            routine = person.get_routine()
+            assert routine['school'] == 1
+            assert routine['household'] == 1.5
+
+    for event in events:
+        if event._date == intervention.end_date:
+            event.effect.apply(None)
+    for school in closed:
+        assert school.get_activity_multiplier() == 1
+        for person in school.get_people():
+            assert set(person.get_routine().values()) == {1}
+
+
+def test_partial_compliance_school_closure(local_random_seed, generated_world):
+    """
+    Test that a school closure with partial compliance does not close the schools by their activity multipliers,
+    but changes the whole routine of only the complying students,
+    and that a closure whose routine generator makes plain dicts (that are not interned) works
+    """
+    intervention = SchoolClosureIntervention(
+        start_date=INITIAL_DATE,
+        duration=timedelta(10),
+        compliance=0.5,
+        proportion_of_envs=1.0,
+        city_name=TEST_CITY_NAME,
+        age_segment=(3, 17)
+    )
+    events = intervention.generate_events(generated_world)
+    for event in events:
+        if event._date == intervention.start_date:
+            event.effect.apply(None)
+    schools = [env for env in generated_world.all_environments if isinstance(env, School) and intervention._condition(env)]
+    assert len(schools) > 0
+    students = [person for school in schools for person in school.get_people()]
+    assert all(school.get_activity_multiplier() == 1 for school in schools)
+    complying = [person for person in students if 'school_closure' in person.routine_changes]
+    assert 0 < len(complying) < len(students)
+    for person in students:
+        assert person.get_routine()['school'] == (0 if person in complying else 1)
+    for event in events:
+        if event._date == intervention.end_date:
+            event.effect.apply(None)
+
+    dict_intervention = PartialEnvironmentIntervention(
+        start_date=INITIAL_DATE,
+        duration=timedelta(10),
+        compliance=1.0,
+        proportion_of_envs=1.0,
+        city_name=TEST_CITY_NAME,
+        env_name='school',
+        age_segment=(3, 17),
+        key='dict_closure',
+        take_first=True,
+        routine_generator=lambda person: {'school': 0, 'household': 1.5}
+    )
+    for event in dict_intervention.generate_events(generated_world):
+        if event._date == dict_intervention.start_date:
+            event.effect.apply(None)
+    assert all(school.get_activity_multiplier() == 0 for school in schools)
+    for person in students:
+        assert person.get_routine()['household'] == 1.5
+
+
+def test_periodic_school_closure(generated_world):
+    """
+    Test that a periodic school closure makes one event for each group of students that take the same turns,
+    and that each student is closed in his turns (by the attribute of his household) until the closure ends
+    """
+    attribute = EnvironmentalAttribute('household', 'last name', 2)
+    period_time = timedelta(3)
+    intervention = SchoolClosureIntervention(
+        start_date=INITIAL_DATE,
+        duration=timedelta(14),
+        compliance=1.0,
+        proportion_of_envs=1.0,
+        city_name=TEST_CITY_NAME,
+        age_segment=(0, 99),
+        period_data=AttributeAndPeriodData(attribute, period_time)
+    )
+    my_simulation = Simulation(world=generated_world, initial_date=INITIAL_DATE, interventions=[intervention])
+    schools = [env for env in generated_world.all_environments if isinstance(env, School) and env.get_people()]
+    # The state of each school is changed and restored, and each of its two groups takes one periodic event
+    assert len(intervention.generate_events(generated_world)) <= 4 * len(schools)
+    students = [person for school in schools for person in school.get_people()]
+    assert len(students) > 0
+    for day in range(16):
+        my_simulation.simulate_day()
+        for person in students:
+            # The change is off for one period in every num_possibilities periods, starting at the attribute's period
+            offset = day - attribute(person) * period_time.days
+            expected = day < 14 and (offset < 0 or offset % (2 * period_time.days) >= period_time.days)
+            assert ('school_closure' in person.routine_changes) == expected
+
+
+def test_timed_intervention_masks(generated_world):
+    """
+    Test that the vectorized masks of the timed interventions select the same people as their conditions,
+    and that the routine change is added to all the complying people by one event and removed by another
+    """
+    # Some of the workplaces are out of the city, so some of the people are affected by a curfew or a lockdown
+    other_city = make_test_city(10, name='other')
+    for workplace in [env for env in generated_world.all_environments if env.name == 'workplace'][:5]:
+        workplace._city = other_city
+    people = generated_world.all_people()
+    columns = generated_world.get_people_columns()
+    interventions = [
+        WorkplaceClosureIntervention(INITIAL_DATE, timedelta(10), compliance=0.5),
+        SocialDistancingIntervention(INITIAL_DATE, timedelta(10), compliance=0.5, age_range=(20, 60)),
+        ElderlyQuarantineIntervention(INITIAL_DATE, timedelta(10), compliance=0.5, min_age=70),
+        CityCurfewIntervention(TEST_CITY_NAME, INITIAL_DATE, timedelta(10), compliance=0.5),
+        LockdownIntervention(TEST_CITY_NAME, INITIAL_DATE, timedelta(10), compliance=0.5),
+    ]
+    for intervention in interventions:
+        mask = intervention._mask(columns)
+        assert list(mask) == [intervention._condition(person) for person in people]
+        assert mask.any()
+
+    intervention = interventions[1]
+    events = intervention.generate_events(generated_world)
+    assert len(events) == 2
+    events[0].effect.apply(None)
+    distancing = [person for person in people if 'social_distancing' in person.routine_changes]
+    assert 0 < len(distancing) < intervention._mask(columns).sum()
+    assert all(intervention._condition(person) for person in distancing)
+    events[1].effect.apply(None)
+    assert all('social_distancing' not in person.routine_changes for person in people)
+
+
 def test_SymptomaticIsolationIntervention_Genarete_events(helpers):
     #pretesting
     helpers.clean_outputs()
@@ -138,15 +295,109 @@ def test_SymptomaticIsolationIntervention_Genarete_events(helpers):
     lst =  my_intervention.generate_events(small_world)
     #Assert results 
     assert lst is not None
-    assert len(lst) == 3
-    for i in range(1):
-        assert isinstance(lst[i],DayEvent)
+    assert len(lst) == 1
+    assert isinstance(lst[0], StateChangeListener)
     for person in persons_arr:
-        assert len(list(person.state_to_events.keys())) == (1+4)
+        assert len(person.state_to_events) == 0
     
     my_simulation.run_simulation(name="test",num_days = 60)
     
     
+def test_isolation_starts_on_symptoms(loaded_params):
+    """
+    Test that the isolation interventions make no events on the people in advance,
+    and isolate a person and his household when he becomes symptomatic, until he recovers
+    """
+
+    household = Household(city=make_test_city(2), contact_prob_between_each_two_people=0)
+    persons_arr = list(map(Person, [10, 40]))
+    for person in persons_arr:
+        person.add_environment(household)
+    small_world = World(
+        all_people=persons_arr,
+        all_environments=[household],
+        generating_city_name="test",
+        generating_scale=1)
+    interventions = [
+        SymptomaticIsolationIntervention(compliance=1, start_date=INITIAL_DATE, duration=daysdelta(40), delay=0),
+        HouseholdIsolationIntervention(
+            compliance=1, start_date=INITIAL_DATE, duration=daysdelta(40),
+            delay_on_enter=0, delay_on_exit=0, is_exit_after_recovery=True
+        )
+    ]
+    my_simulation = Simulation(world=small_world, initial_date=INITIAL_DATE, interventions=interventions)
+    for person in persons_arr:
+        assert len(person.state_to_events) == 0
+
+    sick, other = persons_arr
+    sick._disease_state = DiseaseState.INCUBATINGPOSTLATENT
+    sick._change()
+    my_simulation.register_events([
+        DiseaseStateTransition(
+            INITIAL_DATE, sick, DiseaseState.INCUBATINGPOSTLATENT, DiseaseState.SYMPTOMATICINFECTIOUS
+        ),
+        DiseaseStateTransition(
+            INITIAL_DATE + daysdelta(2), sick, DiseaseState.SYMPTOMATICINFECTIOUS, DiseaseState.IMMUNE
+        )
+    ])
+    my_simulation.simulate_day()
+    assert set(sick.routine_changes) == {'quarantine', 'household_isolation'}
+    assert set(other.routine_changes) == {'household_isolation'}
+    my_simulation.simulate_day()
+    my_simulation.simulate_day()
+    for person in persons_arr:
+        assert len(person.routine_changes) == 0
+
+
+def test_adaptive_intervention(local_random_seed, loaded_params):
+    """
+    Test that an adaptive intervention turns its intervention on when the count of the last day crosses
+    the threshold, and off when it falls back, and that the incidence of each day is counted
+    """
+
+    household = Household(city=make_test_city(2), contact_prob_between_each_two_people=0)
+    persons_arr = list(map(Person, [10, 40]))
+    for person in persons_arr:
+        person.add_environment(household)
+    small_world = World(
+        all_people=persons_arr,
+        all_environments=[household],
+        generating_city_name="test",
+        generating_scale=1)
+    symptomatic = PrevalenceTrigger(DiseaseState.SYMPTOMATICINFECTIOUS, threshold=0.5)
+    intervention = AdaptiveIntervention(
+        SocialDistancingIntervention(INITIAL_DATE, daysdelta(40), compliance=1, age_range=(0, 99)),
+        activate_trigger=symptomatic,
+        deactivate_trigger=PrevalenceTrigger(DiseaseState.SYMPTOMATICINFECTIOUS, threshold=0.5, above=False)
+    )
+    my_simulation = Simulation(world=small_world, initial_date=INITIAL_DATE, interventions=[intervention])
+
+    sick = persons_arr[0]
+    sick._disease_state = DiseaseState.INCUBATINGPOSTLATENT
+    sick._change()
+    my_simulation.register_events([
+        DiseaseStateTransition(
+            INITIAL_DATE, sick, DiseaseState.INCUBATINGPOSTLATENT, DiseaseState.SYMPTOMATICINFECTIOUS
+        ),
+        DiseaseStateTransition(
+            INITIAL_DATE + daysdelta(2), sick, DiseaseState.SYMPTOMATICINFECTIOUS, DiseaseState.IMMUNE
+        )
+    ])
+    # The counts of a day are read on the next day
+    active_days = []
+    for _ in range(5):
+        my_simulation.simulate_day()
+        active_days.append(all('social_distancing' in person.routine_changes for person in persons_arr))
+        assert all(('social_distancing' in person.routine_changes) == active_days[-1] for person in persons_arr)
+    assert active_days == [False, True, True, False, False]
+    assert symptomatic.average(my_simulation) == 0
+    # The only new symptomatic person was on the first day
+    assert IncidenceTrigger(DiseaseState.SYMPTOMATICINFECTIOUS, threshold=0.1, num_days=5).trigger(my_simulation)
+    assert not IncidenceTrigger(DiseaseState.SYMPTOMATICINFECTIOUS, threshold=0.1, num_days=4).trigger(my_simulation)
+    assert my_simulation.counters.daily_entries([DiseaseState.IMMUNE.value], num_days=3) == 1
+    assert my_simulation.counters.daily_entries([DiseaseState.SYMPTOMATICINFECTIOUS.value], num_days=5) == 1
+
+
 def test_ImmuneGeneralPopulationIntervention():
     #pretesting
     config_path = os.path.join(os.path.dirname(__file__),"..","src","config.json")
@@ -180,7 +431,7 @@ def test_ImmuneGeneralPopulationIntervention():
     assert lst is not None
     assert len(lst) == 2
     for i in range(1):
-        assert isinstance(lst[i],DayEvent)
+        assert isinstance(lst[i],DiseaseStateTransition)
     
     my_simulation.simulate_day()
     cnt_immune = sum([1 for p in persons_arr if p.get_disease_state()==DiseaseState.IMMUNE])
@@ -264,4 +515,143 @@ def test_ImmuneByHouseholdIntervention():
     cnt_immune = sum([1 for p in persons_arr if p.get_disease_state()==DiseaseState.IMMUNE])
     assert cnt_immune == 5 
     my_simulation.simulate_day()
-    
\ No newline at end of file
+    
+
+
+def test_vaccination_campaign(local_random_seed, loaded_params):
+    """
+    Test that a vaccination campaign immunes its daily quota by the priority order of the households,
+    and skips the people that are not susceptible on the day of their dose
+    """
+
+    city = make_test_city(2)
+    households = [Household(city=city, contact_prob_between_each_two_people=0) for _ in range(3)]
+    ages_by_household = [[30, 5], [70, 40], [20, 25]]
+    persons_arr = []
+    for household, ages in zip(households, ages_by_household):
+        for age in ages:
+            person = Person(age)
+            person.add_environment(household)
+            persons_arr.append(person)
+    small_world = World(
+        all_people=persons_arr,
+        all_environments=households,
+        generating_city_name="test",
+        generating_scale=1)
+    person_by_age = {person.get_age(): person for person in persons_arr}
+    person_by_age[20]._disease_state = DiseaseState.IMMUNE
+
+    intervention = VaccinationCampaignIntervention(
+        compliance=1, start_date=INITIAL_DATE, duration=daysdelta(10), doses_per_day=2,
+        order=ORDER.DESCENDING, by_household=True, min_age=18
+    )
+    planner = VaccinationPlanner(small_world, ORDER.DESCENDING, by_household=True, min_age=18)
+    # The households are ordered by their oldest person, and only the adults are eligible
+    assert [person.get_age() for person in planner.next_doses(5)] == [70, 40, 30, 25]
+    my_simulation = Simulation(world=small_world, initial_date=INITIAL_DATE, interventions=[intervention])
+
+    immune_ages = []
+    for _ in range(3):
+        my_simulation.simulate_day()
+        immune_ages.append(sorted(
+            person.get_age() for person in persons_arr
+            if person.get_disease_state() == DiseaseState.IMMUNE and person.get_age() != 20
+        ))
+    assert immune_ages == [[40, 70], [25, 30, 40, 70], [25, 30, 40, 70]]
+
+
+def test_contact_tracing(local_random_seed, loaded_params):
+    """
+    Test that contact tracing quarantines the household of a symptomatic person,
+    traces at most daily_capacity contacts a day (continuing on the next day) without counting the contacts
+    that are already in quarantine, accounts the work in the instrumentation,
+    and releases the contacts at the end of their quarantine
+    """
+
+    city = make_test_city(2)
+    sick_household = Household(city=city, contact_prob_between_each_two_people=0)
+    other_household = Household(city=city, contact_prob_between_each_two_people=0)
+    sick, *contacts = [Person(age) for age in [40, 10, 35, 12]]
+    other, other_contact = Person(50), Person(55)
+    for person in [sick] + contacts:
+        person.add_environment(sick_household)
+    for person in [other, other_contact]:
+        person.add_environment(other_household)
+    persons_arr = [sick] + contacts + [other, other_contact]
+    small_world = World(
+        all_people=persons_arr,
+        all_environments=[sick_household, other_household],
+        generating_city_name="test",
+        generating_scale=1)
+    intervention = ContactTracingIntervention(
+        compliance=1, start_date=INITIAL_DATE, duration=daysdelta(20), daily_capacity=2, quarantine_duration=3
+    )
+    my_simulation = Simulation(world=small_world, initial_date=INITIAL_DATE, interventions=[intervention], instrument=True)
+    for person in [sick, contacts[0], other]:
+        person._disease_state = DiseaseState.INCUBATINGPOSTLATENT
+        person._change()
+    my_simulation.register_events([
+        DiseaseStateTransition(INITIAL_DATE, sick, DiseaseState.INCUBATINGPOSTLATENT, DiseaseState.SYMPTOMATICINFECTIOUS),
+        DiseaseStateTransition(
+            INITIAL_DATE + daysdelta(1), contacts[0], DiseaseState.INCUBATINGPOSTLATENT, DiseaseState.SYMPTOMATICINFECTIOUS
+        )
+    ])
+
+    quarantined = []
+    for _ in range(5):
+        my_simulation.simulate_day()
+        quarantined.append({person for person in persons_arr if 'contact_tracing' in person.routine_changes})
+    # The first case has 3 contacts, so it takes 2 days to trace them with a capacity of 2.
+    # On the second day the second case (one of them) takes the rest of the capacity for the first case,
+    # and on the third day his other contacts are already in quarantine, so they are not traced
+    assert len(quarantined[0]) == 2 and quarantined[0] < set(contacts)
+    assert quarantined[1] == quarantined[2] == set(contacts) | {sick}
+    assert quarantined[3] == quarantined[1] - quarantined[0]
+    assert quarantined[4] == set()
+    days = my_simulation.instrumentation.get_days()
+    assert [day['counts'].get('contacts_traced', 0) for day in days] == [2, 2, 0, 0, 0]
+    assert days[1]['counts']['contacts_traced.household'] == 2
+    assert [day['counts'].get('tracing_cases', 0) for day in days] == [1, 1, 0, 0, 0]
+    # The cases themselves and their quarantined contacts are checked too
+    assert [day['counts'].get('contacts_checked', 0) for day in days] == [3, 2, 3, 0, 0]
+    assert 'contact_tracing' in days[0]['section_seconds']
+
+    # A case outside of a day (e.g. of the initial infection) is traced, and not recorded in the instrumentation
+    apply_disease_state_transition(
+        other, DiseaseState.INCUBATINGPOSTLATENT, DiseaseState.SYMPTOMATICINFECTIOUS, my_simulation
+    )
+    assert 'contact_tracing' in other_contact.routine_changes
+    assert len(my_simulation.instrumentation.get_days()) == 5
+
+
+def test_contact_tracing_work_limit(local_random_seed, loaded_params):
+    """
+    Test that contact tracing checks at most daily_work_limit contacts a day, even when the capacity is not used up
+    """
+
+    city = make_test_city(2)
+    household = Household(city=city, contact_prob_between_each_two_people=0)
+    sick, *contacts = [Person(age) for age in [40, 10, 35, 12, 45, 70]]
+    for person in [sick] + contacts:
+        person.add_environment(household)
+    small_world = World(
+        all_people=[sick] + contacts,
+        all_environments=[household],
+        generating_city_name="test",
+        generating_scale=1)
+    intervention = ContactTracingIntervention(
+        compliance=1, start_date=INITIAL_DATE, duration=daysdelta(20), daily_capacity=10, daily_work_limit=3
+    )
+    my_simulation = Simulation(world=small_world, initial_date=INITIAL_DATE, interventions=[intervention], instrument=True)
+    sick._disease_state = DiseaseState.INCUBATINGPOSTLATENT
+    sick._change()
+    my_simulation.register_events(
+        DiseaseStateTransition(INITIAL_DATE, sick, DiseaseState.INCUBATINGPOSTLATENT, DiseaseState.SYMPTOMATICINFECTIOUS)
+    )
+
+    for _ in range(3):
+        my_simulation.simulate_day()
+    days = my_simulation.instrumentation.get_days()
+    assert [day['counts'].get('contacts_checked', 0) for day in days] == [3, 3, 0]
+    assert [day['counts'].get('contacts_traced', 0) for day in days] == [2, 3, 0]
+    assert all('contact_tracing' in person.routine_changes for person in contacts)
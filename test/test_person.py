@@ -1,15 +1,18 @@
 from datetime import timedelta
 import os
 import json
+import pickle
+import pytest
 import random
 from functools import cmp_to_key
 
 from src.run_utils import INITIAL_DATE
 from src.seir import DiseaseState
-from src.simulation.event import DayEvent
+from src.simulation.event import DayEvent, Event
 from src.simulation.params import Params
 from src.simulation.simulation import Simulation
-from src.world import Person,world
+from src.world import Person,world, FrozenRoutine, RoutineCache
+from src.world.environments import InitialGroup, Household, NeighborhoodCommunity
 
 
 def test_immune_and_get_events1():
@@ -236,3 +239,97 @@ def test_sortPersonsDescending():
     persons_arr = sorted(persons_arr,key = cmp_to_key(Person.person_comperator_DESCENDING))
     for i in range (1,20):
         assert persons_arr[i-1].get_age() >= persons_arr[i].get_age()
+
+
+def test_disease_state_transitions_queue():
+    config_path = os.path.join(os.path.dirname(__file__),"..","src","config.json")
+    with open(config_path) as json_data_file:
+        ConfigData = json.load(json_data_file)
+        paramsDataPath = ConfigData['ParamsFilePath']
+    Params.load_from(os.path.join(os.path.dirname(__file__),"..","src", paramsDataPath), override=True)
+
+    p = Person(30)
+    small_world = world.World(
+        all_people = [p],
+        all_environments=[],
+        generating_city_name = "test",
+        generating_scale = 1)
+    my_simulation = Simulation(world = small_world, initial_date= INITIAL_DATE,interventions=[])
+    events = p.infect_and_get_events(INITIAL_DATE, InitialGroup.initial_group(), seir_times= \
+        ((DiseaseState.LATENT,timedelta(2)),(DiseaseState.ASYMPTOMATICINFECTIOUS,timedelta(3)),(DiseaseState.IMMUNE,None)))
+    my_simulation.register_events(events)
+    assert len(my_simulation._transitions) == 2
+    assert p.state_to_events == {}
+    expected_states = [DiseaseState.LATENT] * 2 + [DiseaseState.ASYMPTOMATICINFECTIOUS] * 3 + [DiseaseState.IMMUNE]
+    for expected_state in expected_states:
+        my_simulation.simulate_day()
+        assert p.get_disease_state() == expected_state
+    assert len(my_simulation._transitions) == 0
+
+
+def test_compact_person_layout():
+    """
+    Checks that people with the same environments share their schema and routine weights,
+    and that their event and routine change dicts are only allocated while something is in them
+    """
+    config_path = os.path.join(os.path.dirname(__file__),"..","src","config.json")
+    with open(config_path) as json_data_file:
+        ConfigData = json.load(json_data_file)
+        paramsDataPath = ConfigData['ParamsFilePath']
+    Params.load_from(os.path.join(os.path.dirname(__file__),"..","src", paramsDataPath), override=True)
+
+    hood = NeighborhoodCommunity(city=None, contact_prob_between_each_two_people=1)
+    people = [Person(30), Person(40)]
+    for person in people:
+        person.add_environment(Household(city=None, contact_prob_between_each_two_people=1))
+        person.add_environment(hood)
+    p, other = people
+    assert p._schema is other._schema
+    assert p.get_environment_names() == ('household', 'neighborhood_community')
+    assert p.get_neighberhood() is hood
+    assert p.get_routine() == {'household': 1, 'neighborhood_community': 1}
+    assert p.routine_changes == {} and p._routine_changes is None
+
+    for person in people:
+        person.add_routine_change('isolation', {'household': 2, 'neighborhood_community': 0.5})
+    p.add_routine_change('isolation', {'household': 2, 'neighborhood_community': 0.5})
+    assert p.get_routine() == {'household': 2, 'neighborhood_community': 0.5}
+    assert p._routine_weights is other._routine_weights
+    p.remove_routine_change('isolation')
+    assert p.routine_change_multiplicities == {'isolation': 1}
+    p.remove_routine_change('isolation')
+    assert p.get_routine() == {'household': 1, 'neighborhood_community': 1}
+    assert p._routine_changes is None and p._routine_weights is None
+
+    assert p.state_to_events == {}
+    p.hook_on_change((DiseaseState.SUSCEPTIBLE, DiseaseState.LATENT), Event())
+    assert len(p.state_to_events) == 1
+    assert pickle.loads(pickle.dumps(p))._schema is p._schema
+
+
+def test_routine_cache():
+    """
+    Checks that people with the same environments and routine changes share their routine objects,
+    that the routine weights do not depend on the order of the changes, and that the cache counts its hits
+    """
+    cache = RoutineCache()
+    schema = Person(30)._schema.extended('household').extended('workplace')
+    distancing = cache.intern_change({'household': 1.25, 'workplace': 0.5})
+    isolation = cache.intern_change({'household': 2, 'workplace': 0})
+    assert cache.intern_change({'household': 1.25, 'workplace': 0.5}) is distancing
+    assert distancing == {'household': 1.25, 'workplace': 0.5}
+    with pytest.raises(TypeError):
+        distancing['household'] = 1
+    assert pickle.loads(pickle.dumps(distancing)) == distancing
+
+    weights = cache.routine_weights(schema, {'distancing': distancing, 'isolation': isolation})
+    assert weights == (2.5, 0)
+    assert cache.routine_weights(schema, {'isolation': isolation, 'distancing': distancing}) is weights
+    assert cache.generated_change(('distancing', schema.names), dict, {'household': 1.25, 'workplace': 0.5}) \
+        is distancing
+    assert cache.generated_change(('distancing', schema.names), dict, {}) is distancing
+    stats = cache.get_stats()
+    assert stats['weights'] == {'hits': 1, 'misses': 1, 'size': 1, 'hit_rate': 0.5}
+    assert stats['changes']['hits'] == 2 and stats['generated']['hits'] == 1
+    assert isinstance(distancing, FrozenRoutine)
+
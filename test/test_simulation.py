@@ -1,10 +1,26 @@
+import copy
+import json
 import pytest
 import os
+import random
+from collections import Counter
+from datetime import timedelta
+
+import numpy as np
 
 from src.seir import DiseaseState
 from src.simulation.initial_infection_params import NaiveInitialInfectionParams
-from src.run_utils import SimpleJob, run
-from src.logs import Statistics
+from src.run_utils import SimpleJob, RepeatJob, BranchingJob, run, INITIAL_DATE
+from src.simulation.interventions.intervention import WorkplaceClosureIntervention
+from src.simulation.params import Params
+from src.simulation.event import DayEvent, DiseaseStateTransition
+from src.simulation.simulation import Simulation
+from src.simulation.array_simulation import ArraySimulation
+from src.simulation.partitioned_simulation import PartitionedArraySimulation
+from src.world import Person, World
+from src.world.population_generation import PopulationLoader
+from src.logs import Statistics, DayInstrumentation, INSTRUMENTATION_FILE_NAME, MEMORY_CENSUS_JSON_FILE_NAME
+from src.util import SimulationEngine, seed
 
 
 def test_simple_simulation_single():
@@ -78,3 +94,294 @@ def test_param_change_immune_parm(params):
     )[-1]
     assert 0.89 * 23061 <= total_immuned 
 
+
+def test_array_engine_simulation():
+    """
+    Runs the simple simulation of the disease on kefar yona with the numpy arrays engine,
+    and checks that the disease spreads from the initial set
+    """
+    job = SimpleJob("test_array_engine", 'kefar yona', 1.0, days=60,
+                    infection_params=NaiveInitialInfectionParams(10),
+                    engine=SimulationEngine.ARRAYS)
+    outdir = run([job], multi_processed=False)
+    results = Statistics.load(os.path.join(outdir, 'test_array_engine', 'statistics.pkl'))
+    total_infected = results.sum_days_data(
+        lambda person: person.disease_state != DiseaseState.SUSCEPTIBLE,
+        True
+    )[-1]
+    assert total_infected > 10
+
+
+def test_array_engine_matches_objects_engine(tmp_path, local_random_seed):
+    """
+    Runs seeded replicates of the objects engine and of the numpy arrays engine on the same kefar yona world
+    until the epidemic is over, and checks that both engines give the same mean final attack rate,
+    and the same shares of the infections in each environment type
+    """
+    config_path = os.path.join(os.path.dirname(__file__), "..", "src", "config.json")
+    with open(config_path) as json_data_file:
+        ConfigData = json.load(json_data_file)
+    Params.load_from(os.path.join(os.path.dirname(__file__), "..", "src", ConfigData['ParamsFilePath']), override=True)
+    DiseaseState.init_infectiousness_list()
+    population_loader = PopulationLoader(ConfigData['CitiesFilePath'], added_description=Params.loader().description())
+    world = population_loader.get_world(city_name='kefar yona', scale=1.0, is_smart=True)
+    num_replicates = 3
+    attack_rates = {}
+    env_shares = {}
+    for engine in (Simulation, ArraySimulation):
+        infected_by_env = Counter()
+        num_infected = num_people = 0
+        for replicate in range(num_replicates):
+            random.seed(replicate)
+            np.random.seed(replicate)
+            outdir = str(tmp_path / '{}_{}'.format(engine.__name__, replicate))
+            if engine is Simulation:
+                sim = Simulation(copy.deepcopy(world), INITIAL_DATE, outdir=outdir)
+            else:
+                sim = ArraySimulation(world, INITIAL_DATE, outdir=outdir, seed_sequence=seed.seed_sequence(replicate))
+            sim.infect_random_set(20, "test")
+            sim.run_simulation(150, "test_{}".format(replicate))
+            stats = sim.stats
+            for person, count in stats._final_state.items():
+                num_people += count
+                if person.disease_state != DiseaseState.SUSCEPTIBLE:
+                    num_infected += count
+                    infected_by_env[stats.full_env_name_to_short_env_name[person.infection_env_source]] += count
+        attack_rates[engine] = num_infected / num_people
+        env_shares[engine] = {env_name: count / num_infected for env_name, count in infected_by_env.items()}
+    assert attack_rates[Simulation] > 0.5
+    assert abs(attack_rates[Simulation] - attack_rates[ArraySimulation]) < 0.03
+    assert set(env_shares[Simulation]) == set(env_shares[ArraySimulation])
+    for env_name, share in env_shares[Simulation].items():
+        assert abs(share - env_shares[ArraySimulation][env_name]) < 0.03, env_name
+
+
+def test_vectorized_repeat_job():
+    """
+    Runs the repetitions of a job on kefar yona as the replicates of one simulation,
+    and checks that each repetition has its own statistics, and that the disease spreads in each of them
+    """
+    job = SimpleJob("test_vectorized_repeat", 'kefar yona', 1.0, days=40,
+                    infection_params=NaiveInitialInfectionParams(10),
+                    engine=SimulationEngine.ARRAYS)
+    outdir = run([RepeatJob(job, 3, vectorized=True)], multi_processed=False)
+    totals = []
+    for index in range(3):
+        results = Statistics.load(os.path.join(outdir, 'test_vectorized_repeat', 'sample_%d' % index, 'statistics.pkl'))
+        totals.append(results.sum_days_data(
+            lambda person: person.disease_state != DiseaseState.SUSCEPTIBLE,
+            True
+        )[-1])
+    assert all(total > 10 for total in totals)
+    assert len(set(totals)) > 1
+    assert os.path.exists(os.path.join(outdir, 'test_vectorized_repeat', 'test_vectorized_repeat_summary_long.csv'))
+
+
+def test_repetition_streams(tmp_path):
+    """
+    Runs the repetitions of a job on kefar yona once separately (in reverse order) and once vectorized,
+    from the same root entropy, and checks that each repetition gets the exact same results in both runs,
+    and that the random stream of each repetition is written to its inputs
+    """
+    results = {}
+    for vectorized in (False, True):
+        job = SimpleJob("test_repetition_streams", 'kefar yona', 1.0, days=30,
+                        infection_params=NaiveInitialInfectionParams(10),
+                        engine=SimulationEngine.ARRAYS)
+        repeat_job = RepeatJob(job, 2, vectorized=vectorized)
+        repeat_job.set_seed_stream(1234)
+        outdir = str(tmp_path / str(vectorized))
+        for task in reversed(repeat_job.generate_tasks(outdir)):
+            task.func(*task.params)
+        results[vectorized] = [
+            [day.person_count for day in Statistics.load(
+                os.path.join(outdir, 'test_repetition_streams', 'sample_%d' % index, 'statistics.pkl')
+            )._days_data]
+            for index in range(2)
+        ]
+        for index in range(2):
+            with open(os.path.join(outdir, 'test_repetition_streams', 'sample_%d' % index, 'inputs.txt')) as f:
+                inputs = f.read()
+            assert "Random seed entropy: 1234" in inputs
+            assert "Random seed keys: {}".format(repeat_job.jobs[index].seed_keys) in inputs
+    assert results[False] == results[True]
+    assert results[True][0] != results[True][1]
+
+
+def test_partitioned_engine_simulation(tmp_path):
+    """
+    Runs a small entire country simulation with the city partitioned engine, in one process and in several,
+    from the same root entropy, and checks that the disease spreads and that the results do not depend
+    on the number of workers
+    """
+    results = {}
+    for num_workers in (1, 3):
+        job = SimpleJob("test_partitioned_engine", 'all', 0.01, days=40,
+                        infection_params=NaiveInitialInfectionParams(50),
+                        engine=SimulationEngine.PARTITIONED, num_workers=num_workers)
+        job.set_seed_stream(1234)
+        outdir = str(tmp_path / str(num_workers))
+        for task in job.generate_tasks(outdir):
+            task.func(*task.params)
+        results[num_workers] = Statistics.load(os.path.join(outdir, 'test_partitioned_engine', 'statistics.pkl'))
+    assert [day.person_count for day in results[1]._days_data] == \
+        [day.person_count for day in results[3]._days_data]
+    assert results[1]._r0_data == results[3]._r0_data
+    total_infected = results[3].sum_days_data(
+        lambda person: person.disease_state != DiseaseState.SUSCEPTIBLE,
+        True
+    )[-1]
+    assert total_infected > 50
+
+
+def test_partitioned_engine_in_multi_processed_run(monkeypatch, caplog):
+    """
+    Runs a job of the city partitioned engine next to a job of the objects engine in a multi processed run,
+    and checks that the partitioned job is run outside of the pool, so it starts its worker processes
+    """
+    monkeypatch.setattr('src.run_utils.calc_CPU_count', lambda *args: 2)
+    # The patches of the test are not in the (spawned) processes of the pool, so only this process records
+    simulations_in_parent = []
+
+    def make_partitioned_simulation(*args, **kwargs):
+        simulations_in_parent.append(PartitionedArraySimulation(*args, **kwargs))
+        return simulations_in_parent[-1]
+    monkeypatch.setattr('src.run_utils.PartitionedArraySimulation', make_partitioned_simulation)
+    jobs = [
+        SimpleJob("test_partitioned_in_run", 'all', 0.01, days=10,
+                  infection_params=NaiveInitialInfectionParams(50),
+                  engine=SimulationEngine.PARTITIONED, num_workers=2),
+        SimpleJob("test_objects_in_run", 'kefar yona', 1.0, days=10,
+                  infection_params=NaiveInitialInfectionParams(10))
+    ]
+    with caplog.at_level('WARNING'):
+        outdir = run(jobs, multi_processed=True)
+    assert 'daemonic' not in caplog.text
+    assert len(simulations_in_parent) == 1
+    for job in jobs:
+        assert os.path.exists(os.path.join(outdir, job.scenario_name, 'statistics.pkl'))
+
+
+def test_instrumented_repeat_job():
+    """
+    Runs an instrumented job on kefar yona twice, and checks that each run records the phases and counts of
+    every simulated day next to its statistics, and that the repeated job summarizes them
+    """
+    job = SimpleJob("test_instrumentation", 'kefar yona', 1.0, days=20,
+                    infection_params=NaiveInitialInfectionParams(10), instrument=True)
+    outdir = run([RepeatJob(job, 2)], multi_processed=False)
+    for index in range(2):
+        sample_dir = os.path.join(outdir, 'test_instrumentation', 'sample_%d' % index)
+        days = DayInstrumentation.load(os.path.join(sample_dir, INSTRUMENTATION_FILE_NAME))
+        results = Statistics.load(os.path.join(sample_dir, 'statistics.pkl'))
+        assert len(days) == len(results._days_data)
+        assert all(set(day['phase_seconds']) >= {'apply_events', 'propagate_infection', 'add_daily_data'}
+                   for day in days)
+        assert sum(day['counts'].get('infections', 0) for day in days) >= 10
+        assert all(day['counts'].get('environments_propagated', 0) >=
+                   day['counts'].get('environments_propagated.household', 0) for day in days)
+    assert os.path.exists(os.path.join(outdir, 'test_instrumentation', 'test_instrumentation_instrumentation_summary.csv'))
+
+
+def test_memory_census():
+    """
+    Runs a job on kefar yona with memory censuses at two days, and checks that the report counts every person,
+    and attributes the traced allocations to the subsystems that made them
+    """
+    job = SimpleJob("test_memory_census", 'kefar yona', 1.0, days=4,
+                    infection_params=NaiveInitialInfectionParams(10), memory_census_days=[1, 3])
+    outdir = run([job], multi_processed=False)
+    with open(os.path.join(outdir, 'test_memory_census', MEMORY_CENSUS_JSON_FILE_NAME)) as f:
+        censuses = json.load(f)
+    results = Statistics.load(os.path.join(outdir, 'test_memory_census', 'statistics.pkl'))
+    num_people = sum(results._final_state.values())
+    assert [census['day'] for census in censuses] == [1, 3]
+    for census in censuses:
+        key_types = {row['type']: row for row in census['key_types']}
+        assert key_types['Person']['count'] == num_people
+        assert key_types['Person']['retained_size'] > 0
+        assert {'seir_events', 'stats', 'world'} <= set(census['subsystems'])
+    assert os.path.exists(os.path.join(outdir, 'test_memory_census', 'memory_census.txt'))
+
+
+def test_checkpoint_resume(tmp_path):
+    """
+    Checkpoints a simulation of kefar yona in the middle of a run,
+    and checks that the simulation that is loaded from the checkpoint continues exactly as the original one
+    """
+    config_path = os.path.join(os.path.dirname(__file__), "..", "src", "config.json")
+    with open(config_path) as json_data_file:
+        ConfigData = json.load(json_data_file)
+    Params.load_from(os.path.join(os.path.dirname(__file__), "..", "src", ConfigData['ParamsFilePath']), override=True)
+    DiseaseState.init_infectiousness_list()
+    population_loader = PopulationLoader(ConfigData['CitiesFilePath'], added_description=Params.loader().description())
+    world = population_loader.get_world(city_name='kefar yona', scale=1.0, is_smart=True)
+    outdir = str(tmp_path)
+    sim = Simulation(world, INITIAL_DATE, outdir=outdir)
+    NaiveInitialInfectionParams(10).infect_simulation(sim, outdir)
+    for _ in range(10):
+        sim.simulate_day()
+    checkpoint_path = os.path.join(outdir, 'checkpoint.pkl')
+    sim.save_checkpoint(checkpoint_path)
+    for _ in range(15):
+        sim.simulate_day()
+
+    resumed = Simulation.load_checkpoint(checkpoint_path)
+    assert resumed._date == INITIAL_DATE + timedelta(days=10)
+    for _ in range(15):
+        resumed.simulate_day()
+    assert [day.person_count for day in resumed.stats._days_data] == \
+        [day.person_count for day in sim.stats._days_data]
+    assert resumed.counters.state_counts() == sim.counters.state_counts()
+    assert resumed.counters.count_infected() > 0
+
+
+def test_branching_job():
+    """
+    Runs two branches of kefar yona that share the first 10 days, one of them with a workplace closure
+    from the branch day, and checks that they start from the same simulated prefix
+    """
+    prefix_job = SimpleJob("test_branching", 'kefar yona', 1.0, days=30,
+                           infection_params=NaiveInitialInfectionParams(10))
+    closure = WorkplaceClosureIntervention(INITIAL_DATE + timedelta(days=10), timedelta(days=20), 1.0)
+    job = BranchingJob(prefix_job, 10, {'none': [], 'closure': [closure]})
+    outdir = run([job], multi_processed=False)
+    results = {
+        name: Statistics.load(os.path.join(outdir, 'test_branching', name, 'statistics.pkl'))
+        for name in ('none', 'closure')
+    }
+    days_data = {name: [day.person_count for day in stats._days_data] for name, stats in results.items()}
+    assert days_data['none'][:10] == days_data['closure'][:10]
+    assert len(results['closure']._interventions) == 1
+    assert len(results['none']._interventions) == 0
+
+
+def test_transitions_apply_before_day_events(tmp_path):
+    """
+    Checks that the disease state changes of a day are applied before the DayEvents of that day,
+    even if the event was registered first,
+    and that the changes registered by the events of a day are applied on the same day
+    """
+    config_path = os.path.join(os.path.dirname(__file__), "..", "src", "config.json")
+    with open(config_path) as json_data_file:
+        ConfigData = json.load(json_data_file)
+    Params.load_from(os.path.join(os.path.dirname(__file__), "..", "src", ConfigData['ParamsFilePath']), override=True)
+    people = [Person(30), Person(40)]
+    world = World(all_people=people, all_environments=[], generating_city_name="test", generating_scale=1)
+    sim = Simulation(world, INITIAL_DATE, outdir=str(tmp_path))
+    seen_states = []
+
+    class RecordEffect:
+        def apply(self, simulation):
+            seen_states.append(people[0].get_disease_state())
+            simulation.register_events(DiseaseStateTransition(
+                simulation._date, people[1], DiseaseState.SUSCEPTIBLE, DiseaseState.IMMUNE
+            ))
+
+    sim.register_events([
+        DayEvent(INITIAL_DATE, RecordEffect()),
+        DiseaseStateTransition(INITIAL_DATE, people[0], DiseaseState.SUSCEPTIBLE, DiseaseState.IMMUNE)
+    ])
+    sim.simulate_day()
+    assert seen_states == [DiseaseState.IMMUNE]
+    assert people[1].get_disease_state() == DiseaseState.IMMUNE
@@ -1,6 +1,8 @@
 from random import randint
 from src.util.divide_array import divide_array, divide_weighted_array
 from src.util.distribution import DiscreteDistribution, Distribution
+from src.util.indexed_set import IndexedSet
+from src.util.weighted_sampler import WeightedSampler
 
 
 def test_divide_array():
@@ -115,4 +117,45 @@ def test_Distribution2():
 
     assert abs(acc_samples_dic[1] - 2 * acc_samples_dic[2]) <= 10
     assert abs(acc_samples_dic[0] - 3 * acc_samples_dic[2]) <= 10
-    assert abs(acc_samples_dic[0] - 1.5 * acc_samples_dic[1]) <= 10
\ No newline at end of file
+    assert abs(acc_samples_dic[0] - 1.5 * acc_samples_dic[1]) <= 10
+
+
+def test_IndexedSet():
+    s = IndexedSet(range(10))
+    s.add(3)
+    assert len(s) == 10
+    s.discard(3)
+    s.discard(3)
+    s.discard(0)
+    assert len(s) == 8
+    assert 3 not in s and 0 not in s and 9 in s
+    assert sorted(s) == [1, 2, 4, 5, 6, 7, 8, 9]
+    sample = s.sample(5)
+    assert len(set(sample)) == 5
+    assert all(item in s for item in sample)
+
+
+def test_WeightedSampler():
+    sampler = WeightedSampler()
+    for item in range(10):
+        sampler.set(item, 1.0)
+    for item in range(10):
+        if item % 2 == 0:
+            sampler.remove(item)
+    sampler.set(1, 3.0)
+    sampler.set(10, 0.0)
+    for i in range(100):
+        sampler.set(5, float(i % 3))
+    sampler.set(5, 1.0)
+    assert len(sampler) == 6
+    assert abs(sampler.total() - 7.0) < 1e-9
+    assert sampler.get_weight(1) == 3.0
+    assert 2 not in sampler and 10 in sampler
+    counts = {}
+    num_samples = 14000
+    for _ in range(num_samples):
+        item = sampler.sample()
+        counts[item] = counts.get(item, 0) + 1
+    assert set(counts) <= {1, 3, 5, 7, 9}
+    assert abs(counts[1] / num_samples - 3 / 7) < 0.03
+    assert abs(counts[9] / num_samples - 1 / 7) < 0.03
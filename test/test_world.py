@@ -1,6 +1,7 @@
 import json
 import os
 import random
+from collections import Counter
 
 from functools import cmp_to_key
 from src.run_utils import INITIAL_DATE 
@@ -700,3 +701,139 @@ def test_count_infected_in_hood():
         assert d1 == 0 , "Day:" + str(6 + i)
         assert d2 == 0 , "Day:" + str(6 + i)
         my_simulation.simulate_day()
+
+
+def test_hood_data_not_collected():
+    config_path = os.path.join(os.path.dirname(__file__),"..","src","config.json")
+    with open(config_path) as json_data_file:
+        ConfigData = json.load(json_data_file)
+        paramsDataPath = ConfigData['ParamsFilePath']
+    Params.load_from(os.path.join(os.path.dirname(__file__),"..","src", paramsDataPath), override=True)
+    Params.loader()["person"]["state_macine_type"] = "SIR"
+    DiseaseState.init_infectiousness_list()
+
+    house = Household(city=None, contact_prob_between_each_two_people=1)
+    hood = NeighborhoodCommunity(city=None, contact_prob_between_each_two_people=1)
+    people = list(map(Person, [30, 40]))
+    events_acc = []
+    for person in people:
+        house.sign_up_for_today(person, 1)
+        person.add_environment(hood)
+        events_acc += person.gen_and_register_events_from_seir_times(
+            date=INITIAL_DATE,
+            states_and_times=((DiseaseState.LATENT, daysdelta(1)), (DiseaseState.IMMUNE, None))
+        )
+    my_world = World(
+        all_people=people,
+        all_environments=[house, hood],
+        generating_city_name="test",
+        generating_scale=1)
+
+    my_simulation = Simulation(world=my_world, initial_date=INITIAL_DATE, collect_hood_data=False)
+    my_simulation.register_events(events_acc)
+    for i in range(3):
+        my_simulation.simulate_day()
+        assert my_simulation.stats.get_neiborhood_data(INITIAL_DATE + daysdelta(i), hood.get_neighborhood_id()) == 0
+
+def test_population_counters():
+    config_path = os.path.join(os.path.dirname(__file__),"..","src","config.json")
+    with open(config_path) as json_data_file:
+        ConfigData = json.load(json_data_file)
+        paramsDataPath = ConfigData['ParamsFilePath']
+    Params.load_from(os.path.join(os.path.dirname(__file__),"..","src", paramsDataPath), override=True)
+    Params.loader()["person"]["state_macine_type"] = "SIR"
+    DiseaseState.init_infectiousness_list()
+
+    house = Household(city=None, contact_prob_between_each_two_people=1)
+    people = list(map(Person, [5, 35, 38, 72]))
+    events_acc = []
+    for person in people:
+        house.sign_up_for_today(person, 1)
+    for person in people[1:3]:
+        events_acc += person.gen_and_register_events_from_seir_times(
+            date=INITIAL_DATE,
+            states_and_times=((DiseaseState.LATENT, daysdelta(1)), (DiseaseState.IMMUNE, None))
+        )
+    my_world = World(
+        all_people=people,
+        all_environments=[house],
+        generating_city_name="test",
+        generating_scale=1)
+
+    def stop_when_two_immune(counters):
+        return counters.count(DiseaseState.IMMUNE) >= 2
+
+    my_simulation = Simulation(world=my_world, initial_date=INITIAL_DATE, stop_condition=stop_when_two_immune)
+    my_simulation.register_events(events_acc)
+    for i in range(3):
+        my_simulation.simulate_day()
+        counters = my_simulation.counters
+        assert counters.state_counts() == Counter(p.get_disease_state() for p in people)
+        assert counters.count() == 4
+        assert counters.count_alive() == 4
+        assert counters.count(age_group=30) == 2
+        assert counters.count(DiseaseState.IMMUNE, age_group=30) == \
+            sum(1 for p in people[1:3] if p.get_disease_state() == DiseaseState.IMMUNE)
+        assert counters.count(DiseaseState.SUSCEPTIBLE, age_group=70) == 1
+        assert counters.city_names() == [None]
+    assert my_simulation.should_stop()
+
+
+
+def test_changed_people_tracking():
+    """
+    Test that the world keeps track of exactly the people that changed since their last saved state
+    """
+    config_path = os.path.join(os.path.dirname(__file__),"..","src","config.json")
+    with open(config_path) as json_data_file:
+        ConfigData = json.load(json_data_file)
+        paramsDataPath = ConfigData['ParamsFilePath']
+    Params.load_from(os.path.join(os.path.dirname(__file__),"..","src", paramsDataPath), override=True)
+
+    PersonList = list(map(Person, [10, 20, 30, 40]))
+    my_world = World(
+        all_people = PersonList,
+        all_environments=[],
+        generating_city_name = "test",
+        generating_scale = 1)
+    assert my_world.num_changed_people() == 4
+
+    my_simulation = Simulation(world = my_world, initial_date= INITIAL_DATE)
+    my_simulation.simulate_day()
+    assert my_world.num_changed_people() == 0
+
+    PersonList[1].set_disease_state(DiseaseState.IMMUNE)
+    assert my_world.changed_people() == [PersonList[1]]
+    my_simulation.simulate_day()
+    assert my_world.num_changed_people() == 0
+
+
+def test_sign_up_after_clearing_environments():
+    """
+    Test that signing up the people of a world after its environments were cleared
+    registers all of them again, including the people that did not change since their last saved state
+    """
+    config_path = os.path.join(os.path.dirname(__file__),"..","src","config.json")
+    with open(config_path) as json_data_file:
+        ConfigData = json.load(json_data_file)
+        paramsDataPath = ConfigData['ParamsFilePath']
+    Params.load_from(os.path.join(os.path.dirname(__file__),"..","src", paramsDataPath), override=True)
+
+    household = Household(city=None, contact_prob_between_each_two_people=1)
+    PersonList = list(map(Person, [10, 20, 30]))
+    for person in PersonList:
+        person.add_environment(household)
+    my_world = World(
+        all_people = PersonList,
+        all_environments=[household],
+        generating_city_name = "test",
+        generating_scale = 1)
+    my_world.sign_all_people_up_to_environments()
+    for person in PersonList:
+        person.save_state()
+    assert my_world.num_changed_people() == 0
+
+    household.clear()
+    assert len(household.get_people()) == 0
+    my_world.sign_all_people_up_to_environments()
+    assert set(household.get_people()) == set(PersonList)